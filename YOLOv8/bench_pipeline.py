@@ -0,0 +1,420 @@
+"""
+Offline end-to-end benchmark of the detection pipeline, no phones or backend needed.
+- N simulated cameras replay recorded clips (file source, real time) through
+  CameraWorker, in this process (the WORKER_PROCESSES = 0 threaded mode).
+- A local stub backend implements /api/alerts (+ /bulk), /api/alerts/status,
+  the /api/alerts/changes feed, the evidence segment API and
+  /api/upload_evidence with configurable latency and failure rate; it
+  confirms every alert after --confirm-after seconds so the clip upload path
+  runs too.
+- The model is the real one (--model / --runtime) or, with --stub-infer-ms, a
+  fixed-latency stand-in that reports a knife for a moment every
+  --stub-period seconds, so runs are comparable on any machine.
+- --tiles / --roi run the cameras with tiled / ROI inference (tiling.py) so
+  its CPU cost can be compared with whole-frame inference.
+- Reports per camera: inferred frames/s, frame-to-alert latency (capture of
+  the triggering frame until the backend accepted the alert) p50/p95/p99,
+  dropped frames, CPU and ring memory; for the process: peak RSS, CPU and
+  what the backend received. Results go to a JSON file tagged with the git
+  commit; --compare prints the change against an earlier run.
+
+    python bench_pipeline.py --cameras 4 --seconds 60 --clips clip1.mp4 clip2.mp4
+    python bench_pipeline.py --cameras 8 --stub-infer-ms 25 --backend-latency-ms 200 --backend-fail-rate 0.1
+    python bench_pipeline.py --compare bench_pipeline.json --out bench_new.json
+    python bench_pipeline.py --cameras 2 --tiles 3 2 --roi 0 0.3 1 1
+"""
+import os, time, json, uuid, random, hashlib, resource, argparse, tempfile, threading, subprocess
+from email.parser import BytesParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import yolo_multi_alert as app
+from yolo_multi_alert import CameraWorker, local_inference
+from dispatcher import Dispatcher
+from frame_scheduler import SCHEDULER
+from status_feed import StatusFeed
+from inference_proc import RemoteResult
+from inference_service import all_services, shutdown_all
+from fake_mjpeg_server import synthetic_frames
+from bench_ring import rss_bytes
+
+# how long the stub model keeps reporting the target once a period starts
+STUB_EVENT_SECONDS = 1.5
+# RSS / ring sampling interval
+SAMPLE_INTERVAL = 0.5
+
+
+def _pct(values, pct):
+    return round(float(np.percentile(values, pct)) * 1000, 1) if values else None
+
+
+# ---------- stub backend ----------
+
+class StubBackend:
+    def __init__(self, latency_ms=0.0, fail_rate=0.0, confirm_after=2.0, seed=0):
+        self.latency = latency_ms / 1000.0
+        self.fail_rate = fail_rate
+        self.confirm_after = confirm_after
+        self.rng = random.Random(seed)
+        self.cond = threading.Condition()
+        self.next_id = 1
+        self.changes = []          # [(seq, alert_id, status, due_ts)]
+        self.counts = {}           # "endpoint status" -> requests
+        self.upload_bytes = 0
+        self.segments = set()      # sha256 of segments "stored"
+
+    def count(self, key):
+        with self.cond:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def new_alerts(self, n):
+        now = time.time()
+        with self.cond:
+            ids = [str(self.next_id + i) for i in range(n)]
+            self.next_id += n
+            if self.confirm_after >= 0:
+                for aid in ids:
+                    self.changes.append((len(self.changes) + 1, aid, "confirmed", now + self.confirm_after))
+            self.cond.notify_all()
+        return ids
+
+    def due_changes(self, since, timeout):
+        """Changes after cursor since that are due, waiting up to timeout for one."""
+        deadline = time.time() + timeout
+        with self.cond:
+            while True:
+                now = time.time()
+                due = [c for c in self.changes[since:] if c[3] <= now]
+                pending = [c[3] for c in self.changes[since:] if c[3] > now]
+                if due or now >= deadline:
+                    return due
+                wake = min(pending + [deadline]) - now
+                self.cond.wait(max(0.01, wake))
+
+    def serve(self, port=0):
+        httpd = ThreadingHTTPServer(("127.0.0.1", port), make_backend_handler(self))
+        httpd.daemon_threads = True
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        return httpd
+
+
+def _form_fields(content_type, body):
+    """name -> bytes of a multipart/form-data body."""
+    msg = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    if not msg.is_multipart():
+        return {}
+    return {part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+            for part in msg.get_payload()}
+
+
+def make_backend_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, code, obj=None):
+            data = json.dumps(obj).encode() if obj is not None else b""
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _simulate(self, endpoint):
+            """Backend latency / failures; True if the request should fail."""
+            if stub.latency:
+                time.sleep(stub.latency)
+            failed = stub.fail_rate and stub.rng.random() < stub.fail_rate
+            stub.count(f"{endpoint} {'503' if failed else 'ok'}")
+            if failed:
+                self._reply(503, {"error": "stub failure"})
+            return failed
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/api/alerts/changes":
+                return self._reply(404)
+            q = parse_qs(url.query)
+            since = int(q.get("since", ["0"])[0])
+            timeout = min(float(q.get("timeout", ["25"])[0]), 25.0)
+            if self._simulate("changes"):
+                return
+            due = stub.due_changes(since, timeout)
+            cursor = due[-1][0] if due else since
+            self._reply(200, {"changes": [{"id": c[1], "status": c[2]} for c in due], "cursor": cursor})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = urlparse(self.path).path
+            if path == "/api/alerts":
+                if not self._simulate("alerts"):
+                    self._reply(201, {"id": stub.new_alerts(1)[0]})
+            elif path == "/api/alerts/bulk":
+                if not self._simulate("alerts_bulk"):
+                    items = json.loads(_form_fields(self.headers["Content-Type"], body).get("alerts") or b"[]")
+                    self._reply(201, {"ids": stub.new_alerts(len(items))})
+            elif path == "/api/alerts/status":
+                if not self._simulate("status"):
+                    ids = json.loads(body or b"{}").get("ids", [])
+                    self._reply(200, {"statuses": {aid: "pending" for aid in ids}})
+            elif path == "/api/evidence/segments/missing":
+                if not self._simulate("segments_missing"):
+                    hashes = json.loads(body or b"{}").get("hashes", [])
+                    with stub.cond:
+                        missing = [h for h in hashes if h not in stub.segments]
+                    self._reply(200, {"missing": missing})
+            elif path == "/api/evidence/manifest":
+                if not self._simulate("manifest"):
+                    segs = json.loads(body or b"{}").get("segments", [])
+                    with stub.cond:
+                        missing = [s["sha256"] for s in segs if s["sha256"] not in stub.segments]
+                    if missing:
+                        self._reply(409, {"missing": missing})
+                    else:
+                        self._reply(201, {"ok": True, "evidence_id": str(uuid.uuid4())})
+            elif path == "/api/upload_evidence":
+                if not self._simulate("upload"):
+                    with stub.cond:
+                        stub.upload_bytes += len(body)
+                    self._reply(201, {"ok": True})
+            else:
+                self._reply(404)
+
+        def do_PUT(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            path = urlparse(self.path).path
+            if not path.startswith("/api/evidence/segments/"):
+                return self._reply(404)
+            if not self._simulate("segment"):
+                with stub.cond:
+                    stub.upload_bytes += len(body)
+                    stub.segments.add(hashlib.sha256(body).hexdigest())
+                self._reply(201, {"ok": True})
+
+    return Handler
+
+
+# ---------- cameras / model ----------
+
+class StubModel:
+    """Fixed-latency detector: a knife for STUB_EVENT_SECONDS out of every period."""
+
+    def __init__(self, infer_ms, period):
+        self.infer = infer_ms / 1000.0
+        self.period = period
+        self.names = {0: "guns", 1: "knife"}
+        self.lock = threading.Lock()   # one "accelerator", like the shared service
+
+    def predict(self, frame, timeout=None):
+        with self.lock:
+            time.sleep(self.infer)
+        data = np.zeros((0, 6), np.float32)
+        if time.time() % self.period < STUB_EVENT_SECONDS:
+            data = np.array([[100, 100, 200, 200, 0.9, 1]], np.float32)
+        return RemoteResult(data, self.names)
+
+    def predict_many(self, frames, timeout=None):
+        return [self.predict(f, timeout) for f in frames]
+
+
+class BenchCamera(CameraWorker):
+    """CameraWorker that remembers when the frame behind each alert was captured."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.capture_ts = None
+        self.event_capture = {}    # event_key -> capture ts of the triggering frame
+        self.alert_latency = []
+        self.ring_peak = 0
+
+    def handle_frame(self, work):
+        self.capture_ts = work.packet.ts
+        super().handle_frame(work)
+
+    def send_alert(self, frame, cls, conf, event_key):
+        self.event_capture[event_key] = self.capture_ts
+        super().send_alert(frame, cls, conf, event_key)
+
+    def on_alert_posted(self, event_key, aid):
+        ts = self.event_capture.pop(event_key, None)
+        if ts is not None:
+            self.alert_latency.append(time.time() - ts)
+        super().on_alert_posted(event_key, aid)
+
+
+def synthetic_clip(folder):
+    for i, jpeg in enumerate(synthetic_frames()):
+        with open(os.path.join(folder, f"{i:04d}.jpg"), "wb") as f:
+            f.write(jpeg)
+    return folder
+
+
+def git_commit():
+    try:
+        here = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=here,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------- run ----------
+
+def run(args, workdir):
+    stub = StubBackend(args.backend_latency_ms, args.backend_fail_rate, args.confirm_after, seed=args.seed)
+    httpd = stub.serve()
+    backend = f"http://127.0.0.1:{httpd.server_address[1]}"
+    clips = args.clips or [synthetic_clip(tempfile.mkdtemp(dir=workdir))]
+    inference = local_inference
+    if args.stub_infer_ms is not None:
+        model = StubModel(args.stub_infer_ms, args.stub_period)
+        inference = lambda path: model
+
+    dispatcher = Dispatcher(backend, outbox_path=os.path.join(workdir, "outbox.db"),
+                            workers=app.DISPATCH_WORKERS, max_jobs=app.DISPATCH_MAX_JOBS)
+    status_feed = StatusFeed(backend)
+    status_feed.start()
+    cameras = []
+    for i in range(args.cameras):
+        cfg = {"source": "file", "stream": clips[i % len(clips)], "device_id": f"bench_cam_{i}",
+               "location": "bench", "fps": args.fps, "model_path": args.model, "runtime": args.runtime}
+        if args.no_motion:
+            cfg["motion_gating"] = False
+        if args.tiles:
+            cfg["tiles"] = args.tiles
+        if args.roi:
+            cfg["roi"] = [args.roi]
+        cameras.append(BenchCamera(cfg, dispatcher, status_feed, inference=inference))
+    dispatcher.start()
+
+    cpu0, t0 = time.process_time(), time.time()
+    rss_peak = rss_bytes()
+    for w in cameras:
+        w.start()
+    print(f"[bench] {args.cameras} cameras @ {args.fps} fps for {args.seconds}s, backend {backend}")
+    while time.time() - t0 < args.seconds:
+        time.sleep(SAMPLE_INTERVAL)
+        rss_peak = max(rss_peak, rss_bytes())
+        for w in cameras:
+            w.ring_peak = max(w.ring_peak, w.ring.nbytes)
+    elapsed = time.time() - t0
+    cpu = time.process_time() - cpu0
+
+    for w in cameras:
+        w.shutdown_flag.set()
+    for w in cameras:
+        w.join(timeout=5)
+    infer_stats = [svc.stats() for svc in all_services()]
+    shutdown_all()
+    status_feed.stop()
+    dispatcher.stop()
+    httpd.shutdown()
+
+    per_camera = []
+    for w in cameras:
+        src = w.source.stats()
+        s = w.stats()
+        per_camera.append({
+            "camera": w.device_id,
+            "frames_in": src["frames_in"],
+            "frames_inferred": w.frames_done,
+            "fps": round(w.frames_done / elapsed, 2),
+            "dropped_source": src["frames_dropped"],
+            "dropped_queue": s["queue_dropped"],
+            "skipped_motion": s["motion"].get("skipped", 0),
+            "alerts": len(w.alert_latency),
+            "alert_latency_p50_ms": _pct(w.alert_latency, 50),
+            "alert_latency_p95_ms": _pct(w.alert_latency, 95),
+            "alert_latency_p99_ms": _pct(w.alert_latency, 99),
+            "cpu_pct": round(100.0 * w.cpu_seconds / elapsed, 1),
+            "ring_peak_mb": round(w.ring_peak / 1e6, 1),
+            "target_fps": s["rate"]["target_fps"],
+            "stages": s["stages"],
+            "crops": s.get("crops"),
+        })
+    latency = [x for w in cameras for x in w.alert_latency]
+    return {
+        "commit": git_commit(),
+        "started": t0,
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 1),
+        "totals": {
+            "fps": round(sum(c["fps"] for c in per_camera), 2),
+            "fps_per_camera": round(sum(c["fps"] for c in per_camera) / len(per_camera), 2),
+            "dropped": sum(c["dropped_source"] + c["dropped_queue"] for c in per_camera),
+            "alerts": len(latency),
+            "alert_latency_p50_ms": _pct(latency, 50),
+            "alert_latency_p95_ms": _pct(latency, 95),
+            "alert_latency_p99_ms": _pct(latency, 99),
+            "cpu_pct": round(100.0 * cpu / elapsed, 1),
+            "shed_events": SCHEDULER.shed_events,
+            "peak_rss_mb": round(max(rss_peak, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024) / 1e6, 1),
+        },
+        "cameras": per_camera,
+        "inference": infer_stats,
+        "dispatcher": dispatcher.stats(),
+        "backend": {"requests": stub.counts, "upload_bytes": stub.upload_bytes},
+    }
+
+
+def print_summary(res, previous=None):
+    t = res["totals"]
+    for c in res["cameras"]:
+        print(f"{c['camera']:14s} fps={c['fps']:6.2f} dropped={c['dropped_source'] + c['dropped_queue']:5d} "
+              f"skipped={c['skipped_motion']:5d} alerts={c['alerts']:3d} p95={c['alert_latency_p95_ms']} ms "
+              f"cpu={c['cpu_pct']:5.1f}% ring={c['ring_peak_mb']} MB")
+    print(f"total fps={t['fps']} alerts={t['alerts']} latency p50/p95/p99={t['alert_latency_p50_ms']}/"
+          f"{t['alert_latency_p95_ms']}/{t['alert_latency_p99_ms']} ms cpu={t['cpu_pct']}% rss={t['peak_rss_mb']} MB")
+    if previous:
+        print(f"vs {previous.get('commit')}:")
+        for key, new in t.items():
+            old = previous.get("totals", {}).get(key)
+            if isinstance(new, (int, float)) and isinstance(old, (int, float)) and old:
+                print(f"  {key:22s} {old:>10} -> {new:<10} ({(new - old) / old:+.1%})")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cameras", type=int, default=4)
+    ap.add_argument("--seconds", type=float, default=60)
+    ap.add_argument("--fps", type=int, default=app.FPS)
+    ap.add_argument("--clips", nargs="*", default=None, help="video files / .jpg directories (default synthetic)")
+    ap.add_argument("--model", default=app.DEFAULT_MODEL_PATH)
+    ap.add_argument("--runtime", default=app.DEFAULT_RUNTIME)
+    ap.add_argument("--stub-infer-ms", type=float, default=None, help="use a fixed-latency stub model")
+    ap.add_argument("--stub-period", type=float, default=15.0)
+    ap.add_argument("--no-motion", action="store_true", help="disable the motion gate")
+    ap.add_argument("--tiles", type=int, nargs=2, metavar=("COLS", "ROWS"), help="tiled inference grid")
+    ap.add_argument("--roi", type=float, nargs=4, metavar=("X1", "Y1", "X2", "Y2"), help="normalized ROI")
+    ap.add_argument("--backend-latency-ms", type=float, default=20)
+    ap.add_argument("--backend-fail-rate", type=float, default=0.0)
+    ap.add_argument("--confirm-after", type=float, default=2.0, help="seconds until the stub confirms (-1 never)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default="bench_pipeline.json")
+    ap.add_argument("--compare", default=None, help="earlier results JSON to compare against")
+    args = ap.parse_args()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    # paths are taken relative to where the benchmark was started
+    args.clips = [os.path.abspath(c) for c in args.clips] if args.clips else None
+    args.model = os.path.abspath(args.model)
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    cwd = os.getcwd()
+    os.chdir(workdir)     # clips written by the cameras land here, not in the repo
+    try:
+        res = run(args, workdir)
+    finally:
+        os.chdir(cwd)
+    with open(args.out, "w") as f:
+        json.dump(res, f, indent=2)
+    print_summary(res, previous)
+    print(f"[bench] results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Ring buffer memory benchmark: raw-frame deque (old behaviour) vs JpegRing vs ArenaRing.
+Each variant runs in a fresh subprocess so RSS numbers don't bleed into each other.
+
+    python bench_ring.py --fps 5 --seconds 30
+    python bench_ring.py --source clip.mp4
+"""
+import sys, time, json, argparse, subprocess
+from collections import deque
+import numpy as np
+import cv2
+
+
+def rss_bytes():
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096
+
+
+def sample_frames(source, count):
+    """(frame, jpeg) pairs at 640x480; synthetic noisy scene if no source."""
+    out = []
+    if source:
+        cap = cv2.VideoCapture(source)
+        while len(out) < count:
+            ok, img = cap.read()
+            if not ok:
+                break
+            img = cv2.resize(img, (640, 480))
+            out.append(img)
+        cap.release()
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (15, 15), 0)
+    while len(out) < count:
+        noise = rng.integers(-8, 8, base.shape, dtype=np.int16)
+        out.append(np.clip(base.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    return [(f, cv2.imencode(".jpg", f)[1].tobytes()) for f in out]
+
+
+def run_variant(variant, fps, seconds, source):
+    from frame_ring import JpegRing, ArenaRing, MemoryBudget
+    samples = sample_frames(source, 50)
+    budget = MemoryBudget(None)
+    n = fps * seconds
+    if variant == "deque":
+        ring = deque(maxlen=n)
+        add = lambda f, j, ts: ring.append(f.copy())
+    elif variant == "jpeg":
+        ring = JpegRing(seconds, budget_bytes=1 << 40, process_budget=budget)
+        add = lambda f, j, ts: ring.append(frame=f, ts=ts)
+    elif variant == "jpeg-reuse":
+        ring = JpegRing(seconds, budget_bytes=1 << 40, process_budget=budget)
+        # fresh bytes each time, as a network fetch would produce
+        add = lambda f, j, ts: ring.append(jpeg=bytes(bytearray(j)), ts=ts)
+    elif variant == "arena":
+        ring = ArenaRing(seconds, fps, budget_bytes=1 << 40, process_budget=budget)
+        add = lambda f, j, ts: ring.append(frame=f, ts=ts)
+    else:
+        raise ValueError(variant)
+    base_rss = rss_bytes()
+    total = n * 2   # fill the ring twice so eviction is exercised
+    t0 = time.perf_counter()
+    start = time.time()
+    for i in range(total):
+        f, j = samples[i % len(samples)]
+        add(f, j, start + i / float(fps))   # timestamps as if captured at fps
+    dt = time.perf_counter() - t0
+    grown = rss_bytes() - base_rss
+    return {"variant": variant, "frames": len(ring), "rss_mb": grown / 1e6,
+            "bytes_per_frame": grown / max(1, len(ring)), "append_us": dt / total * 1e6}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fps", type=int, default=5)
+    ap.add_argument("--seconds", type=int, default=30)
+    ap.add_argument("--source", default=None)
+    ap.add_argument("--variant", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    n = args.fps * args.seconds
+
+    if args.variant:
+        print(json.dumps(run_variant(args.variant, args.fps, args.seconds, args.source)))
+        return
+
+    print(f"ring of {n} frames (640x480), per camera")
+    for v in ("deque", "jpeg", "jpeg-reuse", "arena"):
+        cmd = [sys.executable, __file__, "--fps", str(args.fps), "--seconds", str(args.seconds), "--variant", v]
+        if args.source:
+            cmd += ["--source", args.source]
+        res = json.loads(subprocess.check_output(cmd).decode().strip().splitlines()[-1])
+        print(f"{v:11s} rss={res['rss_mb']:8.1f} MB  per-frame={res['bytes_per_frame'] / 1024:7.1f} KB  "
+              f"append={res['append_us']:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Evidence clips prepared at alert time instead of at confirmation time.
+- When an event is created, the pre-trigger window is frozen as ring.refs():
+  a JPEG ring's shared (ts, jpeg) records, or an arena ring's slot indices.
+  Resolving them (encoding arena slots) runs on the encode pool right away,
+  so the detection thread never encodes and no raw frames are held per clip.
+- Post-trigger frames keep being added for post_seconds, then the clip is
+  spooled as content-addressed segments plus a manifest (evidence_segments.py)
+  on a background pool while the alert waits for review. Overlapping clips
+  share segments, and no frame is re-encoded.
+- confirm() hands over the finished manifest right away (or as soon as
+  spooling completes); discard() drops the prepared clip on rejection.
+- The manifest records the rate the frames were actually taken at (the
+  scheduler changes a camera's rate); fps is the fallback for short clips.
+"""
+import time, threading
+from concurrent.futures import ThreadPoolExecutor
+import metrics
+import evidence_segments
+from frame_ring import measured_fps
+
+CLIP_ENCODE_WORKERS = 2
+# Prepared clips nobody confirmed or rejected are deleted after this long
+CLIP_MAX_PENDING_SECONDS = 3600
+
+_encode_pool = ThreadPoolExecutor(max_workers=CLIP_ENCODE_WORKERS, thread_name_prefix="clip-encode")
+
+
+class PendingClip:
+    def __init__(self, event_key, trigger_ts, records, post_until):
+        self.event_key = event_key
+        self.alert_id = None
+        self.trigger_ts = trigger_ts
+        self.created = time.time()
+        self.pre_roll = None            # future of the pre-trigger (ts, jpeg) records
+        self.records = records          # post-trigger records; dropped after encoding
+        self.post_until = post_until
+        self.state = "capturing"        # capturing -> encoding -> ready | failed
+        self.path = None                # spooled manifest
+        self.confirmed = False
+        self.discarded = False
+
+
+class ClipBuilder:
+    def __init__(self, ring, fps, pre_seconds=30, post_seconds=0, on_ready=None, name="clips"):
+        self.ring = ring
+        self.fps = fps
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.on_ready = on_ready        # called as on_ready(clip) for confirmed clips with a file
+        self.name = name
+        self.lock = threading.Lock()
+        self.capturing = []             # clips still collecting post-trigger frames
+        self.unbound = {}               # event_key -> clip waiting for its alert id
+        self.by_alert = {}              # alert_id -> clip
+
+    def start(self, event_key, trigger_ts=None):
+        """Freeze the pre-trigger window for a new event."""
+        trigger_ts = trigger_ts or time.time()
+        lo = trigger_ts - self.pre_seconds
+        clip = PendingClip(event_key, trigger_ts, [], trigger_ts + self.post_seconds)
+        # submitted before the clip's own encode job, so that job never waits on a queued one
+        clip.pre_roll = _encode_pool.submit(self.ring.resolve, self.ring.refs(lo))
+        with self.lock:
+            self.unbound[event_key] = clip
+            if self.post_seconds > 0:
+                self.capturing.append(clip)
+        if self.post_seconds <= 0:
+            self._encode(clip)
+        return clip
+
+    def is_capturing(self):
+        return bool(self.capturing)
+
+    def pending(self):
+        """Clips still capturing, waiting for their alert id or for review."""
+        with self.lock:
+            return len(self.capturing) + len(self.unbound) + len(self.by_alert)
+
+    def on_frame(self, record):
+        """Feed a post-trigger (ts, jpeg-or-frame) record to clips still capturing."""
+        finished = []
+        with self.lock:
+            for clip in self.capturing:
+                if clip.discarded:
+                    finished.append(clip)
+                    continue
+                clip.records.append(record)
+                if record[0] >= clip.post_until:
+                    finished.append(clip)
+            for clip in finished:
+                self.capturing.remove(clip)
+        for clip in finished:
+            if not clip.discarded:
+                self._encode(clip)
+
+    def _encode(self, clip):
+        clip.state = "encoding"
+        _encode_pool.submit(self._encode_job, clip)
+
+    def _encode_job(self, clip):
+        path = None
+        try:
+            if not clip.discarded:
+                records = clip.pre_roll.result() + clip.records
+                path = evidence_segments.spool_clip(records, fps=measured_fps(records, self.fps))
+        except Exception as e:
+            metrics.get_logger("clips").error("clip spool failed", clips=self.name, error=e)
+        clip.pre_roll = clip.records = None
+        with self.lock:
+            clip.path = path
+            clip.state = "ready" if path else "failed"
+            discard = clip.discarded
+            deliver = clip.confirmed and not discard
+        if discard:
+            self._remove_file(clip)
+        elif deliver and self.on_ready:
+            self.on_ready(clip)
+
+    def bind(self, event_key, alert_id):
+        """Attach the backend alert id once the alert was delivered."""
+        with self.lock:
+            clip = self.unbound.pop(event_key, None)
+            if clip is not None:
+                clip.alert_id = alert_id
+                self.by_alert[alert_id] = clip
+        return clip
+
+    def confirm(self, alert_id):
+        """Mark confirmed. Returns the clip if its file is ready now, None if it
+        will be passed to on_ready later, False if there is no prepared clip."""
+        with self.lock:
+            clip = self.by_alert.get(alert_id)
+            if clip is None or clip.state == "failed":
+                return False
+            clip.confirmed = True
+            return clip if clip.state == "ready" else None
+
+    def discard(self, alert_id):
+        with self.lock:
+            clip = self.by_alert.pop(alert_id, None)
+            if clip is None:
+                return
+            clip.discarded = True
+            ready = clip.state in ("ready", "failed")
+        if ready:
+            self._remove_file(clip)
+
+    def done(self, alert_id):
+        """Forget a clip after its file was handed off (the uploader removes it)."""
+        with self.lock:
+            self.by_alert.pop(alert_id, None)
+
+    def expire(self, now=None):
+        """Drop clips nobody reviewed within CLIP_MAX_PENDING_SECONDS."""
+        now = now or time.time()
+        with self.lock:
+            stale = [aid for aid, c in self.by_alert.items()
+                     if now - c.created > CLIP_MAX_PENDING_SECONDS and not c.confirmed]
+            stale_unbound = [self.unbound.pop(k) for k, c in list(self.unbound.items())
+                             if now - c.created > CLIP_MAX_PENDING_SECONDS]
+            for clip in stale_unbound:
+                clip.discarded = True
+        for clip in stale_unbound:
+            if clip.state in ("ready", "failed"):
+                self._remove_file(clip)
+        for aid in stale:
+            self.discard(aid)
+        evidence_segments.sweep()
+
+    def _remove_file(self, clip):
+        if clip.path:
+            evidence_segments.remove_manifest(clip.path)
+            clip.path = None
@@ -0,0 +1,416 @@
+"""
+Background delivery of alerts, status checks and evidence uploads.
+- Detection threads only enqueue; a small pool of dispatcher threads talks
+  to the backend, so a slow or dead backend never stalls frame processing.
+- Jobs live in a bounded SQLite outbox, so pending alerts and uploads survive
+  a process restart. When it is full, status checks and then uploads make
+  room (logged, dispatch_jobs_total{result="evicted"}); alerts are never
+  evicted, a new alert is queued past the bound instead.
+- A camera hears about every upload that leaves the outbox (delivered,
+  given up or evicted) through on_uploaded, so nothing stays "uploading".
+- Failed jobs are retried with exponential backoff (+ jitter).
+- Results are routed back to the camera that queued the job through the
+  handler registered for its device_id.
+- Alerts are sent as multipart (raw JPEG, no base64); a backlog of due alerts
+  (e.g. after an outage) is flushed through /api/alerts/bulk in one request.
+- Every alert carries an idempotency key, so a retry after a lost response
+  gets the alert the backend already created instead of a duplicate.
+- Clip uploads are spooled segment manifests (evidence_segments.py): the
+  backend is asked which segments it lacks and only those are sent, then the
+  manifest. A backend without the segment API gets one rendered mp4 instead.
+- Backend request latency, job outcomes and the outbox depth are metrics.
+"""
+import time, os, json, uuid, random, sqlite3, threading
+import requests
+import metrics
+import evidence_segments
+
+# Defaults (overridable per dispatcher)
+DEFAULT_OUTBOX_PATH = "outbox.db"
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_JOBS = 2000
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MAX_ATTEMPTS = {"alert": 20, "status": 1, "upload": 50}
+TIMEOUTS = {"alert": 5, "status": 3, "upload": 60}
+# at most this many queued alerts per /api/alerts/bulk request
+ALERT_BULK_MAX = 20
+# when the outbox is full, jobs of these kinds are evicted (in this order, oldest first);
+# alerts are never evicted
+EVICT_ORDER = ("status", "upload")
+
+log = metrics.get_logger("dispatcher")
+REQUEST_SECONDS = metrics.histogram("dispatch_request_seconds", "Backend request latency per job kind", ("kind",))
+JOBS = metrics.counter("dispatch_jobs_total", "Finished job attempts (delivered, failed, given_up) and jobs "
+                       "evicted from the full outbox", ("kind", "result"))
+OUTBOX_JOBS = metrics.gauge("dispatch_outbox_jobs", "Jobs waiting in the outbox", ("kind",))
+SEGMENTS = metrics.counter("dispatch_segments_total", "Evidence segments uploaded / skipped as already stored", ("result",))
+SEGMENT_BYTES = metrics.counter("dispatch_segment_bytes_total", "Evidence segment bytes uploaded / skipped", ("result",))
+
+
+class Outbox:
+    """SQLite-backed job table shared by the dispatcher threads."""
+
+    def __init__(self, path, max_jobs):
+        self.path = path
+        self.max_jobs = max_jobs
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                kind TEXT,
+                                dedupe_key TEXT,
+                                device_id TEXT,
+                                payload TEXT,
+                                blob BLOB,
+                                attempts INTEGER DEFAULT 0,
+                                next_attempt_ts REAL,
+                                created_ts REAL
+                            )''')
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_due ON jobs (next_attempt_ts)")
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_dedupe ON jobs (dedupe_key)")
+        self.conn.commit()
+        self.inflight = set()
+        self.dropped = 0
+
+    def put(self, kind, device_id, payload, blob=None, dedupe_key=None):
+        """Add a job. Returns (id, evicted): id is None if a job with the same dedupe_key
+        is queued or the job did not fit; evicted is the job that left the full outbox
+        (this one when nothing else could go, never an alert) as a dict, else None."""
+        now = time.time()
+        evicted = None
+        with self.lock:
+            if dedupe_key is not None:
+                row = self.conn.execute("SELECT id FROM jobs WHERE dedupe_key=?", (dedupe_key,)).fetchone()
+                if row:
+                    return None, None
+            count = self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+            if count >= self.max_jobs:
+                evicted = self._evict_one()
+                if evicted is None and kind != "alert":
+                    self.dropped += 1
+                    return None, {"kind": kind, "device_id": device_id, "payload": payload}
+            cur = self.conn.execute(
+                "INSERT INTO jobs (kind, dedupe_key, device_id, payload, blob, attempts, next_attempt_ts, created_ts) "
+                "VALUES (?,?,?,?,?,0,?,?)",
+                (kind, dedupe_key, device_id, json.dumps(payload), blob, now, now))
+            self.conn.commit()
+            return cur.lastrowid, evicted
+
+    def _evict_one(self):
+        for kind in EVICT_ORDER:
+            row = self.conn.execute("SELECT id, device_id, payload FROM jobs WHERE kind=? ORDER BY id LIMIT 1",
+                                    (kind,)).fetchone()
+            if row and row[0] not in self.inflight:
+                self.conn.execute("DELETE FROM jobs WHERE id=?", (row[0],))
+                self.dropped += 1
+                return {"kind": kind, "device_id": row[1], "payload": json.loads(row[2])}
+        return None
+
+    def claim(self):
+        """Oldest due job not already being worked on, or None."""
+        jobs = self._claim("", (), 1)
+        return jobs[0] if jobs else None
+
+    def claim_more(self, kind, limit):
+        """Up to limit more due jobs of one kind (for bulk delivery)."""
+        return self._claim("AND kind=?", (kind,), limit)
+
+    def _claim(self, cond, args, limit):
+        out = []
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, kind, device_id, payload, blob, attempts FROM jobs "
+                f"WHERE next_attempt_ts<=? {cond} ORDER BY next_attempt_ts LIMIT ?",
+                (time.time(),) + args + (limit + len(self.inflight),)).fetchall()
+            for r in rows:
+                if r[0] in self.inflight:
+                    continue
+                self.inflight.add(r[0])
+                out.append({"id": r[0], "kind": r[1], "device_id": r[2], "payload": json.loads(r[3]),
+                            "blob": r[4], "attempts": r[5]})
+                if len(out) >= limit:
+                    break
+        return out
+
+    def done(self, job_id):
+        with self.lock:
+            self.conn.execute("DELETE FROM jobs WHERE id=?", (job_id,))
+            self.conn.commit()
+            self.inflight.discard(job_id)
+
+    def retry(self, job_id, attempts, delay):
+        with self.lock:
+            self.conn.execute("UPDATE jobs SET attempts=?, next_attempt_ts=? WHERE id=?",
+                              (attempts, time.time() + delay, job_id))
+            self.conn.commit()
+            self.inflight.discard(job_id)
+
+    def pending(self, device_id):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE device_id=?", (device_id,)).fetchone()[0]
+
+    def depth(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT kind, COUNT(*) FROM jobs GROUP BY kind").fetchall()
+        return {k: n for k, n in rows}
+
+
+class Dispatcher:
+    def __init__(self, backend, outbox_path=DEFAULT_OUTBOX_PATH, workers=DEFAULT_WORKERS, max_jobs=DEFAULT_MAX_JOBS):
+        self.backend = backend
+        self.outbox = Outbox(outbox_path, max_jobs)
+        self.session = requests.Session()
+        self.handlers = {}        # device_id -> object with on_* callbacks
+        self.shutdown_flag = threading.Event()
+        self.wakeup = threading.Event()
+        self.threads = [threading.Thread(target=self._loop, name=f"dispatch-{i}", daemon=True) for i in range(workers)]
+        self.stats_lock = threading.Lock()
+        self.delivered = {}
+        self.failed = {}
+        metrics.REGISTRY.add_collector(self._collect)
+
+    # ----- producer API (called from camera threads, never blocks on the network) -----
+    def register(self, device_id, handler):
+        self.handlers[device_id] = handler
+
+    def unregister(self, device_id):
+        """Stop routing results to a camera (e.g. it moved to another process)."""
+        self.handlers.pop(device_id, None)
+
+    def pending(self, device_id):
+        """Jobs of this camera still in the outbox; their callbacks only reach this process."""
+        return self.outbox.pending(device_id)
+
+    def post_alert(self, device_id, event_key, meta, jpeg):
+        """Queue an alert. handler.on_alert_posted(event_key, alert_id) is called once delivered."""
+        # sent with every attempt: a retry after a lost response gets the alert the first one created
+        payload = dict(meta, event_key=event_key, idempotency_key=uuid.uuid4().hex)
+        self._put("alert", device_id, payload, blob=jpeg)
+
+    def check_status(self, device_id, alert_ids):
+        """Queue one status check for these ids. handler.on_status(alert_id, status) per answer."""
+        if alert_ids:
+            self._put("status", device_id, {"alert_ids": list(alert_ids)}, dedupe_key=f"status|{device_id}")
+
+    def upload_clip(self, device_id, alert_id, path):
+        """Queue a clip upload (an mp4 or a spooled manifest); the file is removed after a successful upload.
+        handler.on_uploaded(alert_id, ok) is called when it is delivered or given up."""
+        self._put("upload", device_id, {"alert_id": alert_id, "path": path}, dedupe_key=f"upload|{alert_id}")
+
+    def _put(self, kind, device_id, payload, blob=None, dedupe_key=None):
+        _, evicted = self.outbox.put(kind, device_id, payload, blob=blob, dedupe_key=dedupe_key)
+        self.wakeup.set()
+        if evicted is not None:
+            JOBS.labels(evicted["kind"], "evicted").inc()
+            log.error("outbox full, job evicted", kind=evicted["kind"], device=evicted["device_id"],
+                      queued=kind)
+            if evicted["kind"] == "upload":
+                self._notify(evicted["device_id"], "on_uploaded", evicted["payload"]["alert_id"], False)
+
+    # ----- lifecycle -----
+    def start(self):
+        for t in self.threads:
+            t.start()
+
+    def stop(self, timeout=5):
+        self.shutdown_flag.set()
+        self.wakeup.set()
+        for t in self.threads:
+            t.join(timeout=timeout)
+
+    def stats(self):
+        with self.stats_lock:
+            return {"depth": self.outbox.depth(), "inflight": len(self.outbox.inflight),
+                    "delivered": dict(self.delivered), "failed": dict(self.failed),
+                    "dropped": self.outbox.dropped}
+
+    def _collect(self):
+        depth = self.outbox.depth()
+        for kind in MAX_ATTEMPTS:
+            OUTBOX_JOBS.labels(kind).set(depth.get(kind, 0))
+
+    # ----- delivery -----
+    def _loop(self):
+        while not self.shutdown_flag.is_set():
+            job = self.outbox.claim()
+            if job is None:
+                self.wakeup.wait(0.5)
+                self.wakeup.clear()
+                continue
+            batch = [job]
+            if job["kind"] == "alert":
+                batch += self.outbox.claim_more("alert", ALERT_BULK_MAX - 1)
+            t0 = time.perf_counter()
+            try:
+                if len(batch) > 1:
+                    oks = self._do_alert_bulk(batch)
+                else:
+                    oks = [getattr(self, "_do_" + job["kind"])(job)]
+            except Exception as e:
+                log.warning("job failed", kind=job["kind"], job=job["id"], error=e)
+                oks = [False] * len(batch)
+            REQUEST_SECONDS.labels(job["kind"]).observe(time.perf_counter() - t0)
+            for j, ok in zip(batch, oks):
+                self._finish(j, ok)
+
+    def _finish(self, job, ok):
+        kind = job["kind"]
+        with self.stats_lock:
+            bucket = self.delivered if ok else self.failed
+            bucket[kind] = bucket.get(kind, 0) + 1
+        if ok:
+            JOBS.labels(kind, "delivered").inc()
+            self.outbox.done(job["id"])
+            return
+        attempts = job["attempts"] + 1
+        if attempts >= MAX_ATTEMPTS.get(kind, 1):
+            JOBS.labels(kind, "given_up").inc()
+            log.error("giving up on job", kind=kind, job=job["id"], attempts=attempts)
+            self.outbox.done(job["id"])
+            if kind == "upload":
+                self._notify(job["device_id"], "on_uploaded", job["payload"]["alert_id"], False)
+            return
+        JOBS.labels(kind, "failed").inc()
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+        self.outbox.retry(job["id"], attempts, delay)
+
+    def _notify(self, device_id, method, *args):
+        handler = self.handlers.get(device_id)
+        fn = getattr(handler, method, None) if handler is not None else None
+        if fn is None:
+            return
+        try:
+            fn(*args)
+        except Exception as e:
+            log.error("callback failed", device=device_id, method=method, error=e)
+
+    def _do_alert(self, job):
+        meta = dict(job["payload"])
+        event_key = meta.pop("event_key", None)
+        files = {"frame": ("frame.jpg", job["blob"], "image/jpeg")} if job["blob"] else None
+        r = self.session.post(self.backend + "/api/alerts", data=meta, files=files, timeout=TIMEOUTS["alert"])
+        if r.status_code != 201:
+            log.warning("alert POST failed", status=r.status_code, body=r.text[:200])
+            return False
+        aid = r.json().get("id")
+        self._notify(job["device_id"], "on_alert_posted", event_key, aid)
+        return True
+
+    def _do_alert_bulk(self, jobs):
+        """One request for many alert jobs; a job only counts as sent if it got an id back."""
+        items, files = [], {}
+        for i, job in enumerate(jobs):
+            meta = {k: v for k, v in job["payload"].items() if k != "event_key"}
+            if job["blob"]:
+                meta["frame"] = f"frame{i}"
+                files[meta["frame"]] = (f"frame{i}.jpg", job["blob"], "image/jpeg")
+            items.append(meta)
+        r = self.session.post(self.backend + "/api/alerts/bulk", data={"alerts": json.dumps(items)}, files=files,
+                              timeout=TIMEOUTS["alert"] + len(jobs))
+        if r.status_code == 404:
+            # backend without the bulk endpoint
+            return [self._do_alert(job) for job in jobs]
+        if r.status_code != 201:
+            log.warning("bulk alert POST failed", status=r.status_code, body=r.text[:200])
+            return [False] * len(jobs)
+        ids = r.json().get("ids", [])
+        if len(ids) != len(jobs):
+            log.warning("bulk alert POST returned fewer ids than alerts", alerts=len(jobs), ids=len(ids))
+        log.info("flushed queued alerts in one request", alerts=len(jobs))
+        ok = []
+        for i, job in enumerate(jobs):
+            aid = ids[i] if i < len(ids) else None
+            if aid:
+                self._notify(job["device_id"], "on_alert_posted", job["payload"].get("event_key"), aid)
+            ok.append(bool(aid))
+        return ok
+
+    def _do_status(self, job):
+        # one batch lookup for all of the camera's outstanding alerts
+        r = self.session.post(f"{self.backend}/api/alerts/status", json={"ids": job["payload"]["alert_ids"]},
+                              timeout=TIMEOUTS["status"])
+        if r.status_code != 200:
+            return False
+        for aid, st in r.json().get("statuses", {}).items():
+            self._notify(job["device_id"], "on_status", aid, st)
+        return True
+
+    def _do_upload(self, job):
+        aid = job["payload"]["alert_id"]
+        path = job["payload"]["path"]
+        if not os.path.exists(path):
+            log.error("upload file not found", path=path)
+            self._notify(job["device_id"], "on_uploaded", aid, False)
+            return True
+        if path.endswith(".json"):
+            ok = self._upload_segments(job["device_id"], aid, path)
+        else:
+            ok = self._upload_file(aid, path)
+        if not ok:
+            return False
+        if path.endswith(".json"):
+            evidence_segments.remove_manifest(path)
+        else:
+            try: os.remove(path)
+            except OSError: pass
+        self._notify(job["device_id"], "on_uploaded", aid, True)
+        return True
+
+    def _upload_file(self, aid, path):
+        with open(path, "rb") as f:
+            r = self.session.post(f"{self.backend}/api/upload_evidence", files={"file": f},
+                                  data={"alert_id": aid}, timeout=TIMEOUTS["upload"])
+        if r.status_code not in (200, 201):
+            log.warning("upload failed", status=r.status_code, body=r.text[:200])
+            return False
+        return True
+
+    def _upload_segments(self, device_id, aid, path):
+        man = evidence_segments.read_manifest(path)
+        segs = man["segments"]
+        r = self.session.post(f"{self.backend}/api/evidence/segments/missing",
+                              json={"hashes": [s["sha256"] for s in segs]}, timeout=TIMEOUTS["status"])
+        if r.status_code == 404:
+            # backend without the segment store: one mp4 as before
+            mp4 = evidence_segments.manifest_to_mp4(path, path[:-len(".json")] + ".mp4")
+            if not mp4:
+                # retried, then given up (on_uploaded False); manifest and segments stay
+                log.error("could not render clip", path=path)
+                return False
+            ok = self._upload_file(aid, mp4)
+            try: os.remove(mp4)
+            except OSError: pass
+            return ok
+        if r.status_code != 200:
+            log.warning("segment check failed", status=r.status_code, body=r.text[:200])
+            return False
+        missing = set(r.json().get("missing", []))
+        sent = 0
+        for s in segs:
+            if s["sha256"] not in missing:
+                SEGMENTS.labels("skipped").inc()
+                SEGMENT_BYTES.labels("skipped").inc(s["size"])
+                continue
+            missing.discard(s["sha256"])     # listed twice in one clip: send it once
+            with open(evidence_segments.segment_path(s["sha256"]), "rb") as f:
+                r = self.session.put(f"{self.backend}/api/evidence/segments/{s['sha256']}", data=f,
+                                     headers={"Content-Type": "application/octet-stream"},
+                                     timeout=TIMEOUTS["upload"])
+            if r.status_code not in (200, 201):
+                log.warning("segment upload failed", status=r.status_code, body=r.text[:200])
+                return False
+            SEGMENTS.labels("uploaded").inc()
+            SEGMENT_BYTES.labels("uploaded").inc(s["size"])
+            sent += 1
+        r = self.session.post(f"{self.backend}/api/evidence/manifest", timeout=TIMEOUTS["upload"],
+                              json={"alert_id": aid, "device_id": device_id, "fps": man.get("fps"),
+                                    "segments": [{k: s[k] for k in ("sha256", "start", "end", "frames")}
+                                                 for s in segs]})
+        if r.status_code not in (200, 201):
+            # 409: a segment vanished (retention) between the check and the manifest; retried
+            log.warning("manifest upload failed", status=r.status_code, body=r.text[:200])
+            return False
+        log.info("uploaded evidence segments", aid=aid, segments=len(segs), sent=sent, skipped=len(segs) - sent)
+        return True
@@ -0,0 +1,111 @@
+"""
+Per-camera detection gating and event debouncing.
+- update() takes a frame's whole boxes.cls / boxes.conf arrays: target-class
+  and confidence gating is one vectorized mask, and every class keeps its
+  highest-confidence box (box order no longer matters).
+- Time-based hysteresis instead of frame counts: a class has to be seen for
+  confirm_seconds (gaps of up to release_seconds allowed) before it opens an
+  event, so the behaviour is the same at any frame rate or when the motion
+  gate skips frames.
+- An event suppresses that class for event_window seconds and the class
+  re-arms rearm_seconds after the event ended. Event ends are kept in a heap,
+  so expire() only touches events that are actually due.
+- Pure logic with explicit timestamps: a synthetic stream of (cls, conf, now)
+  drives it without a model or camera (see bench_tracker.py).
+"""
+import heapq
+import numpy as np
+
+# Defaults (overridable per camera, see CameraWorker)
+CONFIRM_SECONDS = 0.2
+RELEASE_SECONDS = 1.0
+REARM_SECONDS = 2.0
+
+
+def as_numpy(values):
+    """boxes.cls / boxes.conf as a 1-d numpy array (torch tensor or ndarray)."""
+    if values is None:
+        return np.zeros(0, np.float32)
+    if hasattr(values, "cpu"):
+        values = values.cpu().numpy()
+    return np.asarray(values).reshape(-1)
+
+
+class EventTracker:
+    def __init__(self, names, target_classes, conf_threshold, event_window, key_prefix="",
+                 confirm_seconds=CONFIRM_SECONDS, release_seconds=RELEASE_SECONDS, rearm_seconds=REARM_SECONDS):
+        names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+        self.nclasses = max(names) + 1 if names else 0
+        self.names = [names.get(i, str(i)) for i in range(self.nclasses)]
+        # class index -> is a target class
+        self.target = np.array([n in target_classes for n in self.names], dtype=bool)
+        self.conf_threshold = conf_threshold
+        self.event_window = event_window
+        self.key_prefix = key_prefix
+        self.confirm_seconds = confirm_seconds
+        self.release_seconds = release_seconds
+        self.rearm_seconds = rearm_seconds
+        self.first_seen = {}      # class index -> start of the current sighting
+        self.last_seen = {}       # class index -> last frame it was seen in
+        self.events = {}          # key -> {"start_ts", "alert_id", "posted"}
+        self.ends = []            # heap of (end_ts, key)
+        self.last_event_end = {}  # key -> ts the last event for it ended
+
+    def key(self, cls_idx):
+        return f"{self.key_prefix}{self.names[cls_idx]}"
+
+    def best_per_class(self, cls, conf):
+        """{class index: max confidence} over boxes that pass the gating."""
+        conf = as_numpy(conf)
+        if conf.size == 0:
+            return {}
+        # confidence first: it usually leaves only a handful of boxes
+        keep = np.flatnonzero(conf >= self.conf_threshold)
+        if keep.size == 0:
+            return {}
+        cls = as_numpy(cls)[keep].astype(np.int64)
+        conf = conf[keep]
+        keep = (cls >= 0) & (cls < self.nclasses)
+        keep[keep] = self.target[cls[keep]]
+        best = {}
+        for c, p in zip(cls[keep].tolist(), conf[keep].tolist()):
+            if p > best.get(c, -1.0):
+                best[c] = p
+        return best
+
+    def update(self, cls, conf, now):
+        """Feed one inferred frame. Returns [(key, class name, conf)] for events to open."""
+        best = self.best_per_class(cls, conf)
+        opened = []
+        for idx, c in best.items():
+            if now - self.last_seen.get(idx, -1e18) > self.release_seconds:
+                self.first_seen[idx] = now      # new sighting
+            self.last_seen[idx] = now
+            if now - self.first_seen[idx] < self.confirm_seconds:
+                continue
+            key = self.key(idx)
+            if key in self.events:
+                continue
+            last_end = self.last_event_end.get(key)
+            if last_end is not None and now - last_end < self.rearm_seconds:
+                continue
+            self.events[key] = {"start_ts": now, "alert_id": None, "posted": False}
+            heapq.heappush(self.ends, (now + self.event_window, key))
+            # the next event for this class needs a fresh sighting
+            self.first_seen[idx] = now
+            opened.append((key, self.names[idx], c))
+        return opened
+
+    def last_sighting(self):
+        """Time a target class last passed the gating, or None."""
+        return max(self.last_seen.values()) if self.last_seen else None
+
+    def expire(self, now):
+        """End events whose window is over; returns their keys."""
+        ended = []
+        while self.ends and self.ends[0][0] < now:
+            _, key = heapq.heappop(self.ends)
+            if self.events.pop(key, None) is not None:
+                self.last_event_end[key] = now
+                ended.append(key)
+        return ended
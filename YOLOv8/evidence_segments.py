@@ -0,0 +1,182 @@
+"""
+Evidence clips as content-addressed segments instead of one mp4 per alert.
+- A clip's (ts, jpeg) records are cut into SEGMENT_SECONDS slots aligned to
+  the wall clock, so two clips of one camera that overlap produce
+  byte-identical segments for every slot both of them cover completely.
+- A segment is an "EVS1" frame pack: MAGIC, frame count, then per frame its
+  timestamp, length and JPEG bytes. The JPEGs from the ring are used as-is
+  (raw arena frames are encoded once), so nothing is decoded or re-encoded
+  and the sha256 of the pack is its name, here and on the backend.
+- Clips are spooled to SPOOL_DIR: <sha256>.seg files shared by every clip
+  that contains them, and one <name>.json manifest per clip listing its
+  segments in order. sweep() removes segments no manifest refers to.
+- The backend stores the same packs encrypted and renders them to mp4 for
+  viewing (render_mp4; cv2 is imported only there, the backend may lack it).
+"""
+import os, json, time, uuid, struct, hashlib, threading
+
+SEGMENT_SECONDS = 2.0
+SPOOL_DIR = "evidence_spool"
+# JPEG quality for raw (arena ring) frames packed into segments
+SEGMENT_JPEG_QUALITY = 85
+# Spooled segments younger than this are never swept (their manifest may
+# still be being written by another camera / process)
+SWEEP_GRACE_SECONDS = 120
+SWEEP_INTERVAL = 60
+
+MAGIC = b"EVS1"
+_FRAME = struct.Struct(">dI")
+_last_sweep = 0.0
+_sweep_lock = threading.Lock()
+
+
+def _jpeg(data):
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    import cv2
+    ok, buf = cv2.imencode(".jpg", data, [int(cv2.IMWRITE_JPEG_QUALITY), SEGMENT_JPEG_QUALITY])
+    return buf.tobytes() if ok else None
+
+
+def pack(records):
+    """EVS1 bytes for [(ts, jpeg)] records."""
+    parts = [MAGIC, struct.pack(">I", len(records))]
+    for ts, jpeg in records:
+        parts.append(_FRAME.pack(ts, len(jpeg)))
+        parts.append(jpeg)
+    return b"".join(parts)
+
+
+def unpack(data):
+    """[(ts, jpeg)] from EVS1 bytes."""
+    if data[:4] != MAGIC:
+        raise ValueError("not an EVS1 segment")
+    (n,) = struct.unpack_from(">I", data, 4)
+    out, pos = [], 8
+    for _ in range(n):
+        ts, size = _FRAME.unpack_from(data, pos)
+        pos += _FRAME.size
+        out.append((ts, bytes(data[pos:pos + size])))
+        pos += size
+    return out
+
+
+def split(records, seconds=SEGMENT_SECONDS):
+    """Group (ts, jpeg-or-frame) records into wall-clock aligned slots.
+    Returns [(slot start, [(ts, jpeg)])] in time order."""
+    slots = {}
+    for ts, data in records:
+        jpeg = _jpeg(data) if data is not None else None
+        if jpeg:
+            slots.setdefault(int(ts // seconds), []).append((ts, jpeg))
+    return [(idx * seconds, sorted(slots[idx], key=lambda r: r[0])) for idx in sorted(slots)]
+
+
+def segment_path(sha, spool_dir=SPOOL_DIR):
+    return os.path.join(spool_dir, sha + ".seg")
+
+
+def _write_atomic(path, data):
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.part"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def spool_clip(records, spool_dir=SPOOL_DIR, seconds=SEGMENT_SECONDS, fps=None):
+    """Spool a clip's records as segments plus a manifest; returns the manifest path
+    (or None when there are no frames). Segments already spooled are reused."""
+    os.makedirs(spool_dir, exist_ok=True)
+    segments = []
+    nframes = 0
+    for start, frames in split(records, seconds):
+        data = pack(frames)
+        sha = hashlib.sha256(data).hexdigest()
+        path = segment_path(sha, spool_dir)
+        if os.path.exists(path):
+            os.utime(path)      # keeps it out of the sweep's grace window
+        else:
+            _write_atomic(path, data)
+        segments.append({"sha256": sha, "start": frames[0][0], "end": frames[-1][0],
+                         "frames": len(frames), "size": len(data)})
+        nframes += len(frames)
+    if not segments:
+        return None
+    if fps is None:
+        span = segments[-1]["end"] - segments[0]["start"]
+        fps = (nframes - 1) / span if nframes > 1 and span > 0 else 5
+    manifest = {"version": 1, "segment_seconds": seconds, "fps": round(fps, 3), "segments": segments}
+    path = os.path.join(spool_dir, f"clip_{int(time.time())}_{uuid.uuid4().hex[:8]}.json")
+    _write_atomic(path, json.dumps(manifest).encode())
+    return path
+
+
+def read_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def remove_manifest(path):
+    """Drop a spooled clip; its segments go with the next sweep unless shared."""
+    try: os.remove(path)
+    except OSError: pass
+
+
+def sweep(spool_dir=SPOOL_DIR, grace=SWEEP_GRACE_SECONDS, force=False):
+    """Delete spooled segments that no manifest refers to; at most every SWEEP_INTERVAL."""
+    global _last_sweep
+    now = time.time()
+    with _sweep_lock:
+        if not force and now - _last_sweep < SWEEP_INTERVAL:
+            return 0
+        _last_sweep = now
+    if not os.path.isdir(spool_dir):
+        return 0
+    names = os.listdir(spool_dir)
+    referenced = set()
+    for name in names:
+        if name.endswith(".json"):
+            try:
+                referenced.update(s["sha256"] for s in read_manifest(os.path.join(spool_dir, name))["segments"])
+            except (OSError, ValueError, KeyError):
+                pass
+    removed = 0
+    for name in names:
+        if not (name.endswith(".seg") or name.endswith(".part")):
+            continue
+        path = os.path.join(spool_dir, name)
+        if name[:-4] in referenced:
+            continue
+        try:
+            if now - os.path.getmtime(path) > grace:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def render_mp4(segment_datas, outpath, fps=5):
+    """Decode EVS1 segment bytes (in order) into an mp4 at outpath; returns the path or None."""
+    import numpy as np
+    import cv2
+    from frame_ring import write_mp4
+
+    def frames():
+        for data in segment_datas:
+            for _, jpeg in unpack(data):
+                img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+                if img is not None:
+                    yield img
+    return write_mp4(frames(), outpath, fps)
+
+
+def manifest_to_mp4(manifest_path, outpath, spool_dir=SPOOL_DIR):
+    """Render a spooled clip (for backends without the segment store)."""
+    man = read_manifest(manifest_path)
+
+    def datas():
+        for s in man["segments"]:
+            with open(segment_path(s["sha256"], spool_dir), "rb") as f:
+                yield f.read()
+    return render_mp4(datas(), outpath, man.get("fps") or 5)
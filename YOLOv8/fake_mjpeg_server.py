@@ -0,0 +1,162 @@
+"""
+Local stand-in for the IP Webcam app, for offline testing and benchmarks.
+- /video     multipart MJPEG stream
+- /shot.jpg  single snapshot
+Frames come from --source (video file or directory of .jpg) or are synthetic.
+
+Serve:      python fake_mjpeg_server.py --port 8080 --fps 30
+Benchmark:  python fake_mjpeg_server.py --bench 10
+"""
+import time, os, glob, argparse, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+import cv2
+
+BOUNDARY = "frameboundary"
+
+
+def synthetic_frames(count=60, size=(640, 480)):
+    """Pre-encoded moving-box frames so serving costs almost no CPU."""
+    w, h = size
+    out = []
+    for i in range(count):
+        img = np.full((h, w, 3), 40, np.uint8)
+        x = int((w - 80) * i / max(1, count - 1))
+        cv2.rectangle(img, (x, h // 2 - 40), (x + 80, h // 2 + 40), (0, 200, 255), -1)
+        cv2.putText(img, f"frame {i}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        out.append(cv2.imencode(".jpg", img)[1].tobytes())
+    return out
+
+
+def load_frames(source):
+    if source is None:
+        return synthetic_frames()
+    if os.path.isdir(source):
+        frames = []
+        for fp in sorted(glob.glob(os.path.join(source, "*.jpg"))):
+            with open(fp, "rb") as f:
+                frames.append(f.read())
+        return frames
+    frames = []
+    cap = cv2.VideoCapture(source)
+    while True:
+        ok, img = cap.read()
+        if not ok:
+            break
+        frames.append(cv2.imencode(".jpg", img)[1].tobytes())
+    cap.release()
+    return frames
+
+
+def make_handler(frames, fps):
+    interval = 1.0 / fps if fps > 0 else 0.0
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive for the snapshot poller
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/shot.jpg"):
+                data = frames[int(time.time() * max(1, fps)) % len(frames)]
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            if self.path.startswith("/video"):
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                i = 0
+                next_ts = time.time()
+                try:
+                    while True:
+                        data = frames[i % len(frames)]
+                        self.wfile.write(f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+                                         f"Content-Length: {len(data)}\r\n\r\n".encode())
+                        self.wfile.write(data)
+                        self.wfile.write(b"\r\n")
+                        i += 1
+                        if interval:
+                            next_ts += interval
+                            delay = next_ts - time.time()
+                            if delay > 0:
+                                time.sleep(delay)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                return
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    return Handler
+
+
+def serve(port, frames, fps):
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), make_handler(frames, fps))
+    httpd.daemon_threads = True
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    return httpd
+
+
+def bench(frames, seconds, fps, port):
+    """Measure frames/s delivered and decoded by each network source type."""
+    from frame_sources import SnapshotSource, MjpegSource
+    httpd = serve(port, frames, fps)
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for label, src in (("snapshot", SnapshotSource(base, fps=1000)), ("mjpeg", MjpegSource(base))):
+            src.start()
+            decoded = 0
+            last_seq = 0
+            cpu0 = time.process_time()
+            t0 = time.time()
+            while time.time() - t0 < seconds:
+                pkt = src.get(last_seq, timeout=1.0)
+                if pkt is None:
+                    continue
+                last_seq = pkt.seq
+                if cv2.imdecode(np.frombuffer(pkt.jpeg, np.uint8), cv2.IMREAD_COLOR) is not None:
+                    decoded += 1
+            elapsed = time.time() - t0
+            cpu = time.process_time() - cpu0
+            src.stop()
+            s = src.stats()
+            print(f"{label:9s} received={s['frames_in'] / elapsed:7.1f} fps  decoded={decoded / elapsed:7.1f} fps  "
+                  f"dropped={s['frames_dropped']}  errors={s['errors']}  cpu={cpu / elapsed:.0%}")
+    finally:
+        httpd.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--fps", type=float, default=30, help="stream rate, 0 = as fast as possible")
+    ap.add_argument("--source", default=None, help="video file or directory of .jpg (default synthetic)")
+    ap.add_argument("--bench", type=float, default=0, help="run the source benchmark for N seconds per source")
+    args = ap.parse_args()
+
+    frames = load_frames(args.source)
+    if not frames:
+        print("No frames loaded from", args.source)
+        return
+    if args.bench:
+        bench(frames, args.bench, args.fps, args.port)
+        return
+    httpd = serve(args.port, frames, args.fps)
+    print(f"Fake IP Webcam on http://127.0.0.1:{args.port} ({len(frames)} frames @ {args.fps} fps). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == "__main__":
+    main()
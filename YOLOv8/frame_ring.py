@@ -0,0 +1,297 @@
+"""
+Evidence ring buffers (the last N seconds of frames per camera).
+- JpegRing: frames stored JPEG-encoded (~30-60 KB instead of ~920 KB raw);
+  the bytes fetched from the camera are reused when no resize was needed.
+  Bounded by age (the last `seconds` of frames, whatever the frame rate), a
+  per-camera byte budget and a process-wide budget.
+- ArenaRing: raw frames in one preallocated (N, h, w, 3) array; no per-frame
+  allocation, sized up front for `seconds` at the highest rate the camera can
+  be scheduled at, against the same budgets; older frames are not returned.
+Both can write their contents to an mp4, at the rate the frames were taken.
+- Clips take refs(since) (cheap, under the lock) and resolve(refs) them to
+  (ts, jpeg) records later, off the caller's thread: JpegRing's refs are its
+  shared records, ArenaRing's are (slot, ts) pairs encoded slot by slot
+  through one scratch frame (slots overwritten meanwhile are skipped).
+  encoded(since) does both at once.
+"""
+import time, uuid, threading
+from collections import deque
+import numpy as np
+import cv2
+import metrics
+
+# Defaults (overridable per ring)
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_CAMERA_BUDGET = 64 * 1024 * 1024
+DEFAULT_PROCESS_BUDGET = 1024 * 1024 * 1024
+
+
+class MemoryBudget:
+    """Byte accounting shared by all rings in the process."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.lock = threading.Lock()
+
+    def add(self, n):
+        with self.lock:
+            self.used += n
+
+    def release(self, n):
+        with self.lock:
+            self.used -= n
+
+    def over(self):
+        return self.limit is not None and self.used > self.limit
+
+
+PROCESS_BUDGET = MemoryBudget(DEFAULT_PROCESS_BUDGET)
+
+
+def measured_fps(records, default=5):
+    """Average rate of (ts, ...) records; default when there are too few."""
+    if len(records) < 2 or records[-1][0] <= records[0][0]:
+        return default
+    return (len(records) - 1) / (records[-1][0] - records[0][0])
+
+
+def write_mp4(frames, outpath=None, fps=5):
+    """Write an iterable of BGR frames to mp4. Returns the path or None."""
+    if outpath is None:
+        outpath = f"clip_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
+    out = None
+    try:
+        for f in frames:
+            if out is None:
+                h, w = f.shape[:2]
+                out = cv2.VideoWriter(outpath, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+            out.write(f)
+        if out is None:
+            return None
+        out.release()
+        return outpath
+    except Exception as e:
+        metrics.get_logger("ring").error("write_mp4 failed", path=outpath, error=e)
+        try: out.release()
+        except: pass
+        return None
+
+
+class JpegRing:
+    def __init__(self, seconds, quality=DEFAULT_JPEG_QUALITY, budget_bytes=DEFAULT_CAMERA_BUDGET,
+                 process_budget=PROCESS_BUDGET, maxlen=None):
+        self.seconds = seconds
+        self.maxlen = maxlen
+        self.quality = quality
+        self.budget_bytes = budget_bytes
+        self.process_budget = process_budget
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+        self.frames = deque()   # (ts, jpeg bytes)
+        self.nbytes = 0
+        self.evicted_for_budget = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def append(self, frame=None, jpeg=None, ts=None):
+        """Add a frame. Pass jpeg= to store already-encoded bytes without re-encoding.
+        Returns the stored (ts, jpeg) record."""
+        if jpeg is None:
+            ok, buf = cv2.imencode('.jpg', frame, self.encode_params)
+            if not ok:
+                return None
+            jpeg = buf.tobytes()
+        n = len(jpeg)
+        record = (ts or time.time(), jpeg)
+        with self.lock:
+            self.frames.append(record)
+            self.nbytes += n
+            self.process_budget.add(n)
+            oldest = record[0] - self.seconds
+            while self.frames[0][0] < oldest or (self.maxlen and len(self.frames) > self.maxlen):
+                self._pop()
+            while len(self.frames) > 1 and (self.nbytes > self.budget_bytes or self.process_budget.over()):
+                self._pop()
+                self.evicted_for_budget += 1
+        return record
+
+    def _pop(self):
+        _, old = self.frames.popleft()
+        self.nbytes -= len(old)
+        self.process_budget.release(len(old))
+
+    def clear(self):
+        with self.lock:
+            while self.frames:
+                self._pop()
+
+    def close(self):
+        self.clear()
+
+    def snapshot(self):
+        """(ts, jpeg) records currently held; bytes are shared, not copied."""
+        with self.lock:
+            return list(self.frames)
+
+    def refs(self, since=None):
+        """The (ts, jpeg) records from `since` on; shared, like snapshot()."""
+        return [r for r in self.snapshot() if since is None or r[0] >= since]
+
+    def resolve(self, refs):
+        return list(refs)
+
+    def encoded(self, since=None):
+        return self.resolve(self.refs(since))
+
+    def encode(self, frame):
+        ok, buf = cv2.imencode('.jpg', frame, self.encode_params)
+        return buf.tobytes() if ok else None
+
+    def decoded(self, records=None):
+        for _, jpeg in (records if records is not None else self.snapshot()):
+            img = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+            if img is not None:
+                yield img
+
+    def to_mp4(self, outpath=None, fps=None):
+        records = self.snapshot()
+        return write_mp4(self.decoded(records), outpath, fps or measured_fps(records))
+
+
+class ArenaRing:
+    def __init__(self, seconds, max_fps=5, shape=(480, 640, 3), quality=DEFAULT_JPEG_QUALITY,
+                 budget_bytes=DEFAULT_CAMERA_BUDGET, process_budget=PROCESS_BUDGET):
+        self.seconds = seconds
+        self.encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+        maxlen = max(1, int(np.ceil(seconds * max_fps)))
+        frame_bytes = int(np.prod(shape))
+        cap = min(maxlen, max(1, budget_bytes // frame_bytes))
+        if process_budget.limit is not None:
+            free = process_budget.limit - process_budget.used
+            cap = min(cap, max(1, free // frame_bytes))
+        if cap < maxlen:
+            metrics.get_logger("ring").warning("ArenaRing budget allows fewer frames", frames=cap, wanted=maxlen)
+        self.maxlen = cap
+        self.shape = tuple(shape)
+        self.arena = np.empty((cap,) + self.shape, np.uint8)
+        self.ts = np.zeros(cap, np.float64)
+        self.nbytes = self.arena.nbytes
+        self.process_budget = process_budget
+        process_budget.add(self.nbytes)
+        self.head = 0     # next slot to write
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """Give the arena's share back to the process budget (once)."""
+        nbytes, self.nbytes = self.nbytes, 0
+        self.process_budget.release(nbytes)
+
+    def __del__(self):
+        try: self.close()
+        except Exception: pass
+
+    def append(self, frame=None, jpeg=None, ts=None):
+        """Copy a frame into the next slot. Returns (ts, None): slots are reused,
+        so there is no stable record to hand out."""
+        if frame is None:
+            frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        if frame.shape != self.shape:
+            frame = cv2.resize(frame, (self.shape[1], self.shape[0]))
+        ts = ts or time.time()
+        with self.lock:
+            np.copyto(self.arena[self.head], frame)
+            self.ts[self.head] = ts
+            self.head = (self.head + 1) % self.maxlen
+            self.count = min(self.count + 1, self.maxlen)
+        return (ts, None)
+
+    def clear(self):
+        with self.lock:
+            self.head = 0
+            self.count = 0
+
+    def _window(self):
+        """(first slot, count) of the frames from the last `seconds`; call with the lock held."""
+        start = (self.head - self.count) % self.maxlen
+        if self.count:
+            oldest = self.ts[(self.head - 1) % self.maxlen] - self.seconds
+            skip = 0
+            while skip < self.count and self.ts[(start + skip) % self.maxlen] < oldest:
+                skip += 1
+            return (start + skip) % self.maxlen, self.count - skip
+        return start, 0
+
+    def snapshot(self):
+        """Copies of the held frames, oldest first (slots get overwritten)."""
+        with self.lock:
+            start, n = self._window()
+            idx = [(start + i) % self.maxlen for i in range(n)]
+            return [(float(self.ts[i]), self.arena[i].copy()) for i in idx]
+
+    def encode(self, frame):
+        ok, buf = cv2.imencode('.jpg', frame, self.encode_params)
+        return buf.tobytes() if ok else None
+
+    def refs(self, since=None):
+        """(slot, ts) of the held frames from `since` on, oldest first; nothing is copied."""
+        with self.lock:
+            start, n = self._window()
+            slots = [((start + i) % self.maxlen, float(self.ts[(start + i) % self.maxlen])) for i in range(n)]
+        return [(i, ts) for i, ts in slots if since is None or ts >= since]
+
+    def resolve(self, refs):
+        """(ts, jpeg) records for refs(). Each slot is copied into one scratch
+        frame under the lock and encoded outside it; slots overwritten since
+        refs() are skipped."""
+        scratch = np.empty(self.shape, np.uint8)
+        out = []
+        for i, ts in refs:
+            with self.lock:
+                if self.ts[i] != ts:
+                    continue
+                np.copyto(scratch, self.arena[i])
+            jpeg = self.encode(scratch)
+            if jpeg is not None:
+                out.append((ts, jpeg))
+        return out
+
+    def encoded(self, since=None):
+        return self.resolve(self.refs(since))
+
+    def decoded(self, records=None):
+        if records is not None:
+            for _, img in records:
+                yield img
+            return
+        # one scratch frame instead of copying the whole arena; slots the
+        # writer reaches while we iterate will already hold newer frames
+        with self.lock:
+            start, n = self._window()
+        scratch = np.empty(self.shape, np.uint8)
+        for i in range(n):
+            with self.lock:
+                np.copyto(scratch, self.arena[(start + i) % self.maxlen])
+            yield scratch
+
+    def to_mp4(self, outpath=None, fps=None):
+        if fps is None:
+            with self.lock:
+                start, n = self._window()
+                span = self.ts[(start + n - 1) % self.maxlen] - self.ts[start] if n > 1 else 0.0
+            fps = (n - 1) / span if span > 0 else 5
+        return write_mp4(self.decoded(), outpath, fps)
+
+
+def make_ring(mode, seconds, max_fps=5, **kw):
+    """Ring holding the last `seconds` of frames; max_fps sizes the preallocated arena."""
+    if mode == "jpeg":
+        return JpegRing(seconds, **kw)
+    if mode == "arena":
+        return ArenaRing(seconds, max_fps, **kw)
+    raise ValueError(f"unknown ring mode: {mode}")
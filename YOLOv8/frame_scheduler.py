@@ -0,0 +1,246 @@
+"""
+Per-process frame scheduler: deadline pacing and load shedding by priority.
+- Cameras pace their preprocess loop on a deadline (next = previous +
+  interval) instead of sleeping 1/fps after the work, so the work no longer
+  eats into the frame rate. A camera that falls more than an interval behind
+  starts a new schedule instead of bursting to catch up.
+- Every SCHED_INTERVAL the scheduler measures what each camera really did
+  (frames/s, deadlines overrun by the work, frames dropped before inference)
+  and the CPU pressure (this process and the host load average, per core).
+- A shed level in (0, 1] scales the total frame budget: cut multiplicatively
+  while overloaded, raised additively when there is headroom. The budget is
+  split over the cameras by weight (priority, x SCHED_HOT_WEIGHT when hot),
+  each within [min_fps, ceiling]:
+    hot (active event / detection in the last SCHED_HOT_SECONDS): max_fps
+    quiet (static scene per the motion gate):  fps * SCHED_QUIET_FACTOR
+    otherwise:                                 fps
+- Target / actual fps per camera, the shed level and the pressure are metrics.
+"""
+import os, time, threading
+import metrics
+
+# Control loop period (seconds)
+SCHED_INTERVAL = 1.0
+# Overloaded above SCHED_CPU_HIGH busy cores per available core or when more than
+# SCHED_LAG_HIGH of the frames overran their deadline / were dropped before
+# inference; headroom below both LOW marks
+SCHED_CPU_HIGH = 0.90
+SCHED_CPU_LOW = 0.70
+SCHED_LAG_HIGH = 0.10
+SCHED_LAG_LOW = 0.02
+# Shed level changes: x SCHED_DECREASE when overloaded, + SCHED_INCREASE with headroom
+SCHED_DECREASE = 0.8
+SCHED_INCREASE = 0.1
+# Weight of the newest sample in the smoothed pressure / lag
+SCHED_SMOOTHING = 0.5
+# Camera rates: never below SCHED_MIN_FPS; hot cameras may go up to
+# fps * SCHED_HOT_FPS_FACTOR (or the camera's max_fps)
+SCHED_MIN_FPS = 1.0
+SCHED_HOT_FPS_FACTOR = 2.0
+SCHED_HOT_SECONDS = 10.0
+SCHED_HOT_WEIGHT = 4.0
+SCHED_QUIET_FACTOR = 0.5
+
+log = metrics.get_logger("scheduler")
+TARGET_FPS = metrics.gauge("camera_target_fps", "Frame rate the scheduler assigned", ("camera",))
+ACTUAL_FPS = metrics.gauge("camera_actual_fps", "Frames/s the camera really processed", ("camera",))
+LATE = metrics.counter("camera_late_frames_total", "Frames whose work overran the frame interval", ("camera",))
+SHED_LEVEL = metrics.gauge("scheduler_shed_level", "Fraction of the full frame budget handed out")
+PRESSURE = metrics.gauge("scheduler_cpu_pressure", "Busy cores per available core (process or host, the higher)")
+
+
+def _cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def allocate(budget, cams):
+    """Split budget (frames/s) over cams [(floor, ceiling, weight)] by weight,
+    capping at each ceiling and handing the excess to the others (floors are
+    always granted). Returns the rates in the same order."""
+    rates = [floor for floor, _, _ in cams]
+    left = budget - sum(rates)
+    open_ = [i for i, (floor, ceil, _) in enumerate(cams) if ceil > floor]
+    while left > 1e-6 and open_:
+        # all-zero weights (priority 0) share evenly
+        total = sum(cams[i][2] for i in open_)
+        for i in open_:
+            share = left * (cams[i][2] / total if total else 1.0 / len(open_))
+            rates[i] = min(cams[i][1], rates[i] + share)
+        left = budget - sum(rates)
+        open_ = [i for i in open_ if rates[i] < cams[i][1] - 1e-9]
+    return rates
+
+
+class Pace:
+    """One camera's schedule; wait() and done() are called from its preprocess loop."""
+
+    def __init__(self, camera, fps, min_fps, max_fps, priority=1.0):
+        self.camera = camera
+        self.fps = float(fps)
+        self.min_fps = min(float(min_fps), self.fps)
+        self.max_fps = max(float(max_fps), self.fps)
+        self.priority = priority
+        self.target = self.fps
+        self.interval = 1.0 / self.target
+        self.deadline = 0.0
+        self.hot = False          # set by the camera: active event / recent detection
+        self.quiet = False        # set by the camera: static scene
+        self.actual = 0.0
+        self.lock = threading.Lock()
+        self._frames = self._late = self._dropped = 0
+        self._m_target = TARGET_FPS.labels(camera)
+        self._m_actual = ACTUAL_FPS.labels(camera)
+        self._m_late = LATE.labels(camera)
+        self._m_target.set(self.target)
+
+    def wait(self, stop):
+        """Sleep until the next deadline (or until stop is set)."""
+        now = time.time()
+        if self.deadline - now > 0:
+            stop.wait(self.deadline - now)
+        elif now - self.deadline > self.interval:
+            self.deadline = now     # fell behind: new schedule, no burst
+        self.deadline += self.interval
+
+    def done(self, work_seconds):
+        """One frame processed; work_seconds is what it cost this stage."""
+        with self.lock:
+            self._frames += 1
+            if work_seconds > self.interval:
+                self._late += 1
+                self._m_late.inc()
+
+    def dropped(self):
+        """A frame was dropped on its way to inference (queue or shared-memory slot full)."""
+        with self.lock:
+            self._dropped += 1
+
+    def ceiling(self):
+        if self.hot:
+            return self.max_fps
+        if self.quiet:
+            return max(self.min_fps, self.fps * SCHED_QUIET_FACTOR)
+        return self.fps
+
+    def weight(self):
+        return self.priority * (SCHED_HOT_WEIGHT if self.hot else 1.0)
+
+    def set_target(self, fps):
+        self.target = fps
+        self.interval = 1.0 / fps
+        self._m_target.set(round(fps, 2))
+
+    def take(self, dt):
+        """(frames, late + dropped) since the last call; updates the actual rate."""
+        with self.lock:
+            frames, lag = self._frames, self._late + self._dropped
+            self._frames = self._late = self._dropped = 0
+        self.actual = frames / dt if dt > 0 else 0.0
+        self._m_actual.set(round(self.actual, 2))
+        return frames, lag
+
+    def stats(self):
+        return {"target_fps": round(self.target, 2), "actual_fps": round(self.actual, 2),
+                "hot": self.hot, "quiet": self.quiet}
+
+
+class FrameScheduler(threading.Thread):
+    def __init__(self, interval=SCHED_INTERVAL):
+        super().__init__(daemon=True, name="frame-scheduler")
+        self.interval = interval
+        self.cores = _cores()
+        self.paces = {}
+        self.lock = threading.Lock()
+        self.level = 1.0
+        self.pressure = 0.0
+        self.lag = 0.0
+        self.shed_events = 0
+        self._running = False
+        SHED_LEVEL.set(self.level)
+
+    def register(self, camera, fps, min_fps=None, max_fps=None, priority=1.0):
+        """Schedule for one camera; the control loop starts with the first camera."""
+        # shedding never goes below min_fps, so a zero floor would be a zero rate (no interval)
+        if fps <= 0 or (min_fps is not None and min_fps <= 0):
+            raise ValueError(f"camera {camera}: fps and min_fps must be > 0 (got {fps}, {min_fps})")
+        pace = Pace(camera, fps, SCHED_MIN_FPS if min_fps is None else min_fps,
+                    fps * SCHED_HOT_FPS_FACTOR if max_fps is None else max_fps, priority)
+        with self.lock:
+            self.paces[camera] = pace
+            if not self._running:
+                self._running = True
+                self.start()
+        return pace
+
+    def unregister(self, camera):
+        with self.lock:
+            self.paces.pop(camera, None)
+        for m in (TARGET_FPS, ACTUAL_FPS, LATE):
+            m.remove(camera)
+
+    def _cpu(self, proc_cpu, dt):
+        busy = (time.process_time() - proc_cpu) / dt
+        if hasattr(os, "getloadavg"):
+            busy = max(busy, os.getloadavg()[0])
+        return busy / self.cores
+
+    def rebalance(self, dt, cpu):
+        """One control step: measure, move the shed level, hand out the budget."""
+        with self.lock:
+            paces = list(self.paces.values())
+        frames = lag = 0
+        for p in paces:
+            f, l = p.take(dt)
+            frames += f
+            lag += l
+        # smoothed, so one slow frame or a short CPU spike does not shed frames
+        a = SCHED_SMOOTHING
+        self.pressure = a * cpu + (1 - a) * self.pressure
+        self.lag = a * lag / float(max(1, frames + lag)) + (1 - a) * self.lag
+        cpu = self.pressure
+        full = sum(p.ceiling() for p in paces)
+        actual = sum(p.actual for p in paces)
+        level = self.level
+        if cpu > SCHED_CPU_HIGH or self.lag > SCHED_LAG_HIGH:
+            # cut from what the cameras actually managed, not from a budget they never reached
+            level = min(level, actual / full if full else 1.0) * SCHED_DECREASE
+        elif cpu < SCHED_CPU_LOW and self.lag < SCHED_LAG_LOW:
+            level = min(1.0, level + SCHED_INCREASE)
+        floor = sum(p.min_fps for p in paces)
+        level = max(level, floor / full if full else 1.0)
+        if level < 1.0 <= self.level:
+            self.shed_events += 1
+            log.warning("overloaded, shedding frames", cpu=round(cpu, 2), lag=round(self.lag, 3),
+                        shed_level=round(level, 2))
+        elif level >= 1.0 > self.level:
+            log.info("load back to normal, full frame rate", cpu=round(cpu, 2))
+        self.level = level
+        SHED_LEVEL.set(round(level, 3))
+        PRESSURE.set(round(cpu, 3))
+        rates = allocate(full * level, [(p.min_fps, p.ceiling(), p.weight()) for p in paces])
+        for p, rate in zip(paces, rates):
+            p.set_target(rate)
+
+    def run(self):
+        last = time.time()
+        proc_cpu = time.process_time()
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            dt = now - last
+            cpu = self._cpu(proc_cpu, dt)
+            last, proc_cpu = now, time.process_time()
+            try:
+                self.rebalance(dt, cpu)
+            except Exception as e:
+                log.error("scheduler step failed", error=e)
+
+    def stats(self):
+        return {"shed_level": round(self.level, 2), "cpu_pressure": round(self.pressure, 2),
+                "lag": round(self.lag, 3), "shed_events": self.shed_events}
+
+
+SCHEDULER = FrameScheduler()
@@ -0,0 +1,284 @@
+"""
+Pluggable frame sources for camera workers.
+- Every source runs its own reader thread and only keeps the NEWEST frame;
+  a slow consumer skips stale frames instead of building up latency.
+- snapshot: keep-alive /shot.jpg poller on a pooled requests.Session; it
+            polls at the rate the frame scheduler gives the camera (set_fps)
+- mjpeg:    IP Webcam /video multipart reader, JPEG boundaries parsed
+            incrementally from the socket
+- file:     replay of a video file or a directory of .jpg files (testing)
+- Frames received / dropped, errors and snapshot fetch latency are metrics,
+  labelled with the camera's device_id.
+"""
+import time, os, glob, threading
+from collections import namedtuple
+import requests
+from requests.adapters import HTTPAdapter
+import cv2
+import metrics
+
+# seq: increasing per source, ts: capture time, jpeg: encoded bytes (or None),
+# image: decoded BGR array (or None; only file sources fill it)
+FramePacket = namedtuple("FramePacket", "seq ts jpeg image")
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+# Reconnect backoff for network sources (seconds)
+RECONNECT_MIN = 0.2
+RECONNECT_MAX = 5.0
+# Drop the parse buffer if it grows past this without a complete JPEG
+MJPEG_MAX_BUFFER = 8 * 1024 * 1024
+
+log = metrics.get_logger("source")
+SOURCE_FRAMES = metrics.counter("source_frames_total", "Frames received from the camera", ("camera",))
+SOURCE_DROPPED = metrics.counter("source_frames_dropped_total", "Frames replaced before anyone read them", ("camera",))
+SOURCE_ERRORS = metrics.counter("source_errors_total", "Failed fetches / stream errors", ("camera",))
+FETCH_SECONDS = metrics.histogram("source_fetch_seconds", "Snapshot request latency", ("camera",))
+
+
+def to_shot_url(video_url):
+    if "/video" in video_url:
+        return video_url.replace("/video", "/shot.jpg")
+    return video_url.rstrip("/") + "/shot.jpg"
+
+
+def to_video_url(url):
+    if "/shot.jpg" in url:
+        return url.replace("/shot.jpg", "/video")
+    if url.rstrip("/").endswith("/video"):
+        return url
+    return url.rstrip("/") + "/video"
+
+
+def make_session(pool_size=2):
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+
+class FrameSource(threading.Thread):
+    """Base class: subclasses implement read_loop() and call _publish()."""
+
+    def __init__(self, name):
+        super().__init__(daemon=True)
+        self.name = name
+        self.shutdown_flag = threading.Event()
+        self._cond = threading.Condition()
+        self._latest = None
+        self._seq = 0
+        self._taken_seq = 0
+        # counters
+        self.frames_in = 0
+        self.frames_dropped = 0   # overwritten before anyone read them
+        self.errors = 0
+        self.camera = name        # metric label; make_frame_source sets the device_id
+        self._m_frames = self._m_dropped = self._m_errors = None
+
+    def _publish(self, jpeg=None, image=None, ts=None):
+        with self._cond:
+            if self._latest is not None and self._latest.seq > self._taken_seq:
+                self.frames_dropped += 1
+                self._m_dropped.inc()
+            self._seq += 1
+            self.frames_in += 1
+            self._m_frames.inc()
+            self._latest = FramePacket(self._seq, ts or time.time(), jpeg, image)
+            self._cond.notify_all()
+
+    def get(self, last_seq=0, timeout=1.0):
+        """Newest packet with seq > last_seq, or None on timeout."""
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._latest is None or self._latest.seq <= last_seq:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self.shutdown_flag.is_set():
+                    return None
+                self._cond.wait(remaining)
+            self._taken_seq = self._latest.seq
+            return self._latest
+
+    def set_fps(self, fps):
+        """Rate the consumer currently wants; only polling sources use it."""
+
+    def stats(self):
+        return {"frames_in": self.frames_in, "frames_dropped": self.frames_dropped, "errors": self.errors}
+
+    def stop(self):
+        self.shutdown_flag.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def error(self):
+        self.errors += 1
+        self._m_errors.inc()
+
+    def read_loop(self):
+        raise NotImplementedError
+
+    def run(self):
+        self._m_frames = SOURCE_FRAMES.labels(self.camera)
+        self._m_dropped = SOURCE_DROPPED.labels(self.camera)
+        self._m_errors = SOURCE_ERRORS.labels(self.camera)
+        backoff = RECONNECT_MIN
+        while not self.shutdown_flag.is_set():
+            try:
+                self.read_loop()
+                backoff = RECONNECT_MIN
+            except Exception as e:
+                self.error()
+                # the first failure is a warning; the retries while it stays down are debug
+                if backoff == RECONNECT_MIN:
+                    log.warning("source failed, reconnecting", camera=self.camera, source=self.name, error=e)
+                else:
+                    log.debug("source still failing", camera=self.camera, error=e, backoff=backoff)
+                self.shutdown_flag.wait(backoff)
+                backoff = min(RECONNECT_MAX, backoff * 2)
+
+
+class SnapshotSource(FrameSource):
+    """Polls /shot.jpg over a keep-alive session at up to fps requests/second."""
+
+    def __init__(self, url, fps, timeout=6):
+        super().__init__(f"snapshot:{url}")
+        self.url = to_shot_url(url)
+        self.interval = 1.0 / max(1, fps)
+        self.timeout = timeout
+        self.session = make_session()
+
+    def set_fps(self, fps):
+        self.interval = 1.0 / max(1, fps)
+
+    def read_loop(self):
+        next_ts = time.time()
+        fetch = FETCH_SECONDS.labels(self.camera)
+        while not self.shutdown_flag.is_set():
+            t0 = time.perf_counter()
+            r = self.session.get(self.url, timeout=self.timeout)
+            fetch.observe(time.perf_counter() - t0)
+            if r.status_code == 200 and r.content:
+                self._publish(jpeg=r.content)
+            else:
+                self.error()
+                log.debug("snapshot failed", camera=self.camera, status=r.status_code)
+            next_ts += self.interval
+            delay = next_ts - time.time()
+            if delay > 0:
+                self.shutdown_flag.wait(delay)
+            else:
+                next_ts = time.time()
+
+
+class MjpegSource(FrameSource):
+    """Reads a multipart MJPEG stream and publishes each complete JPEG."""
+
+    def __init__(self, url, chunk_size=64 * 1024, timeout=(5, 10)):
+        super().__init__(f"mjpeg:{url}")
+        self.url = to_video_url(url)
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.session = make_session()
+
+    def read_loop(self):
+        with self.session.get(self.url, stream=True, timeout=self.timeout) as r:
+            if r.status_code != 200:
+                raise IOError(f"stream returned {r.status_code}")
+            buf = bytearray()
+            start = -1      # offset of current SOI in buf, -1 if not found yet
+            scan = 0        # where to resume searching so old bytes aren't rescanned
+            # read1() returns whatever has arrived (up to chunk_size) instead of
+            # blocking until a full chunk is buffered, so frames aren't delayed
+            read = getattr(r.raw, "read1", None) or r.raw.read
+            while not self.shutdown_flag.is_set():
+                chunk = read(self.chunk_size)
+                if not chunk:
+                    return
+                buf += chunk
+                while True:
+                    if start < 0:
+                        start = buf.find(SOI, scan)
+                        if start < 0:
+                            # keep one byte in case a marker is split across chunks
+                            del buf[:max(0, len(buf) - 1)]
+                            scan = 0
+                            break
+                        del buf[:start]
+                        start = 0; scan = 2
+                    end = buf.find(EOI, scan)
+                    if end < 0:
+                        scan = max(2, len(buf) - 1)
+                        if len(buf) > MJPEG_MAX_BUFFER:
+                            self.error()
+                            log.debug("mjpeg buffer overflow, resyncing", camera=self.camera)
+                            buf.clear(); start = -1; scan = 0
+                        break
+                    self._publish(jpeg=bytes(buf[start:end + 2]))
+                    del buf[:end + 2]
+                    start = -1; scan = 0
+
+
+class FileSource(FrameSource):
+    """Replays a video file or a directory of JPEGs at fps (loop=True restarts at the end)."""
+
+    def __init__(self, path, fps, loop=True, realtime=True):
+        super().__init__(f"file:{path}")
+        self.path = path
+        self.interval = 1.0 / max(1, fps)
+        self.loop = loop
+        self.realtime = realtime
+        self.finished = threading.Event()
+
+    def _frames(self):
+        if os.path.isdir(self.path):
+            for fp in sorted(glob.glob(os.path.join(self.path, "*.jpg"))):
+                with open(fp, "rb") as f:
+                    yield f.read(), None
+            return
+        cap = cv2.VideoCapture(self.path)
+        try:
+            while True:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield None, frame
+        finally:
+            cap.release()
+
+    def read_loop(self):
+        while not self.shutdown_flag.is_set():
+            next_ts = time.time()
+            count = 0
+            for jpeg, image in self._frames():
+                if self.shutdown_flag.is_set():
+                    return
+                self._publish(jpeg=jpeg, image=image)
+                count += 1
+                if self.realtime:
+                    next_ts += self.interval
+                    delay = next_ts - time.time()
+                    if delay > 0:
+                        self.shutdown_flag.wait(delay)
+            if count == 0:
+                raise IOError(f"no frames in {self.path}")
+            if not self.loop:
+                self.finished.set()
+                self.shutdown_flag.wait()
+                return
+
+
+def make_frame_source(cam_cfg, fps):
+    """Build the source for a camera config. cam_cfg['source'] is snapshot (default), mjpeg or file."""
+    kind = cam_cfg.get("source", "snapshot")
+    if kind == "snapshot":
+        src = SnapshotSource(cam_cfg["stream"], fps)
+    elif kind == "mjpeg":
+        src = MjpegSource(cam_cfg["stream"])
+    elif kind == "file":
+        src = FileSource(cam_cfg.get("path", cam_cfg["stream"]), fps,
+                         loop=cam_cfg.get("loop", True), realtime=cam_cfg.get("realtime", True))
+    else:
+        raise ValueError(f"unknown frame source: {kind}")
+    src.camera = cam_cfg.get("device_id", src.name)
+    return src
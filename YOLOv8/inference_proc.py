@@ -0,0 +1,315 @@
+"""
+InferenceService behind a process boundary.
+- serve() runs in its own process, one per model path: it owns the weights
+  and the batching InferenceService, reads frames as zero-copy views of the
+  cameras' shared-memory slots (shm_frames.FrameSlots) and answers with a
+  compact (n, 6) float32 array per frame: x1 y1 x2 y2 conf cls.
+- Camera processes use RemoteInference, which has the predict() /
+  predict_many() / names interface of InferenceService and returns a result
+  with ultralytics-style .boxes (iterable; .cls / .conf / .xyxy arrays).
+- Every camera process has its own Pipe to every inference process (no
+  queue locks shared between processes), so when either side crashes the
+  supervisor simply hands out fresh pipes; nothing is left half-locked.
+- Shared-memory blocks are attached on a camera's first frame and detached
+  when the camera process that last sent from them goes away (its pipe
+  closes or is replaced), once their in-flight frames are answered.
+"""
+import time, itertools, threading
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+import numpy as np
+
+# a predict() that takes longer than this (e.g. the inference process died) fails
+REMOTE_TIMEOUT = 10.0
+
+
+class Boxes:
+    """Detections of one frame, shaped like ultralytics Boxes (numpy only)."""
+
+    def __init__(self, data):
+        self.data = data if data is not None else np.zeros((0, 6), np.float32)
+
+    @property
+    def xyxy(self):
+        return self.data[:, :4]
+
+    @property
+    def conf(self):
+        return self.data[:, 4]
+
+    @property
+    def cls(self):
+        return self.data[:, 5]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield Boxes(self.data[i:i + 1])
+
+
+class RemoteResult:
+    def __init__(self, data, names):
+        self.boxes = Boxes(data)
+        self.names = names
+
+
+def _compact(res):
+    b = res.boxes
+    if b is None or len(b) == 0:
+        return np.zeros((0, 6), np.float32)
+    cols = [b.xyxy.cpu().numpy(), b.conf.cpu().numpy()[:, None], b.cls.cpu().numpy()[:, None]]
+    return np.concatenate(cols, axis=1).astype(np.float32)
+
+
+# ---------- inference process ----------
+
+def serve(model_path, inbox, max_batch, max_wait_ms, metrics_port=0):
+    """Process entry point. inbox delivers ("connect", proc_idx, conn) from the supervisor
+    (None to stop); each conn carries ("names", req_id) or (req_id, shm_spec, slot)
+    requests and gets (req_id, payload, error) answers."""
+    from inference_service import InferenceService
+    from shm_frames import FrameSlots
+    import metrics
+    if metrics_port:
+        metrics.serve_metrics(metrics_port)
+    svc = InferenceService(model_path, max_batch=max_batch, max_wait_ms=max_wait_ms)
+    svc.start()
+    names = dict(enumerate(svc.names)) if isinstance(svc.names, list) else svc.names
+    conns = {}        # conn -> proc_idx
+    attached = {}     # shm name -> FrameSlots
+    owner = {}        # shm name -> conn that last sent a frame from it
+    inflight = {}     # FrameSlots -> frames submitted and not answered yet
+    retiring = set()  # detached FrameSlots closed once their frames are answered
+    send_lock = threading.Lock()
+    slots_lock = threading.Lock()
+
+    def reply(conn, msg):
+        with send_lock:
+            try:
+                conn.send(msg)
+            except (OSError, EOFError):
+                pass      # the camera process went away
+
+    def done(conn, req_id, slots, fut):
+        try:
+            reply(conn, (req_id, _compact(fut.result()), None))
+        except Exception as e:
+            reply(conn, (req_id, None, repr(e)))
+        with slots_lock:
+            inflight[slots] -= 1
+            if inflight[slots] or slots not in retiring:
+                return
+            retiring.discard(slots)
+            del inflight[slots]
+        slots.close()
+
+    def drop(conn):
+        """A camera process went away: close its pipe and detach its cameras' blocks."""
+        conns.pop(conn, None)
+        conn.close()
+        for name in [n for n, c in owner.items() if c is conn]:
+            del owner[name]
+            slots = attached.pop(name)
+            with slots_lock:
+                if inflight.get(slots):
+                    retiring.add(slots)
+                    continue
+                inflight.pop(slots, None)
+            slots.close()
+
+    running = True
+    while running:
+        for conn in wait([inbox] + list(conns)):
+            if conn is inbox:
+                try:
+                    msg = inbox.recv()
+                except EOFError:
+                    msg = None
+                if msg is None:
+                    running = False
+                    break
+                _, proc_idx, new = msg
+                # a restarted camera process replaces its old pipe
+                for old, idx in list(conns.items()):
+                    if idx == proc_idx:
+                        drop(old)
+                conns[new] = proc_idx
+                continue
+            try:
+                req = conn.recv()
+            except (EOFError, OSError):
+                drop(conn)
+                continue
+            if req[0] == "names":
+                reply(conn, (req[1], names, None))
+                continue
+            req_id, spec, slot = req
+            slots = attached.get(spec["name"])
+            if slots is None:
+                try:
+                    slots = attached[spec["name"]] = FrameSlots.attach(spec)
+                except FileNotFoundError as e:
+                    reply(conn, (req_id, None, repr(e)))
+                    continue
+            owner[spec["name"]] = conn      # a moved camera now belongs to its new process
+            with slots_lock:
+                inflight[slots] = inflight.get(slots, 0) + 1
+            fut = svc.submit(slots.view(slot))
+            fut.add_done_callback(lambda f, c=conn, r=req_id, s=slots: done(c, r, s, f))
+
+    svc.shutdown_flag.set()
+    svc.join(timeout=5)
+    metrics.get_logger("inference").info("final stats", **svc.stats())
+    for slots in attached.values():
+        slots.close()
+
+
+# ---------- camera process side ----------
+
+class ResultRouter(threading.Thread):
+    """Owns this process's pipes to the inference processes: sends requests
+    and resolves their futures from the answers."""
+
+    def __init__(self, proc_idx, channels):
+        super().__init__(daemon=True)
+        self.name = f"results-{proc_idx}"
+        self.proc_idx = proc_idx
+        self.channels = dict(channels)   # model_path -> Connection
+        self.incoming = {}               # replacements, swapped in by the router thread
+        self.pending = {}                # req_id -> (model_path, Future)
+        self.cond = threading.Condition()
+        self.ids = itertools.count()
+        self.shutdown_flag = threading.Event()
+
+    def connect(self, model_path, conn):
+        """New pipe after the model's inference process was restarted."""
+        with self.cond:
+            self.incoming[model_path] = conn
+
+    def submit(self, model_path, make_msg, deadline):
+        """Send make_msg(req_id) to the model's process; returns (req_id, Future).
+        The caller forget()s the request once it is done waiting."""
+        fut = Future()
+        with self.cond:
+            while model_path not in self.channels:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    raise RuntimeError(f"no inference process for {model_path}")
+            req_id = next(self.ids)
+            self.pending[req_id] = (model_path, fut)
+            try:
+                self.channels[model_path].send(make_msg(req_id))
+            except (OSError, EOFError) as e:
+                self.pending.pop(req_id, None)
+                raise RuntimeError(f"inference process for {model_path} is gone: {e!r}")
+        return req_id, fut
+
+    def forget(self, req_ids):
+        with self.cond:
+            for req_id in req_ids:
+                self.pending.pop(req_id, None)
+
+    def request(self, model_path, make_msg, timeout):
+        """Send make_msg(req_id) to the model's process and wait for the answer."""
+        deadline = time.time() + timeout
+        req_id, fut = self.submit(model_path, make_msg, deadline)
+        try:
+            return fut.result(timeout=max(0.0, deadline - time.time()))
+        finally:
+            self.forget([req_id])
+
+    def _fail_pending(self, model_path, reason):
+        for req_id, (path, fut) in list(self.pending.items()):
+            if path == model_path:
+                del self.pending[req_id]
+                fut.set_exception(RuntimeError(reason))
+
+    def _swap_channels(self):
+        with self.cond:
+            for path, conn in self.incoming.items():
+                old = self.channels.get(path)
+                if old is not None:
+                    old.close()
+                self.channels[path] = conn
+                # whatever was in flight on the old pipe is not coming back
+                self._fail_pending(path, f"inference process for {path} restarted")
+            if self.incoming:
+                self.incoming = {}
+                self.cond.notify_all()
+            return {conn: path for path, conn in self.channels.items()}
+
+    def run(self):
+        while not self.shutdown_flag.is_set():
+            by_conn = self._swap_channels()
+            for conn in wait(list(by_conn), timeout=0.5):
+                try:
+                    req_id, payload, err = conn.recv()
+                except (EOFError, OSError):
+                    with self.cond:
+                        path = by_conn[conn]
+                        if self.channels.get(path) is conn:
+                            del self.channels[path]
+                        self._fail_pending(path, f"inference process for {path} exited")
+                    conn.close()
+                    continue
+                with self.cond:
+                    entry = self.pending.pop(req_id, None)
+                if entry is None:
+                    continue
+                if err is not None:
+                    entry[1].set_exception(RuntimeError(err))
+                else:
+                    entry[1].set_result(payload)
+
+
+class RemoteInference:
+    """predict() through a model's inference process; frames travel in slots."""
+
+    def __init__(self, model_path, router, slots, timeout=REMOTE_TIMEOUT):
+        self.model_path = model_path
+        self.router = router
+        self.slots = slots
+        self.timeout = timeout
+        # the first camera of a model may have to wait for the weights to load
+        self.names = router.request(model_path, lambda req_id: ("names", req_id), max(timeout, 120))
+
+    def predict(self, frame, timeout=None):
+        """frame should be a view from slots.put(); anything else is copied into a slot first."""
+        return self.predict_many([frame], timeout)[0]
+
+    def predict_many(self, frames, timeout=None):
+        """All frames are sent before waiting, so the inference process batches them together."""
+        deadline = time.time() + (timeout or self.timeout)
+        own, sent, late = [], [], set()
+        try:
+            idx = []
+            for frame in frames:
+                slot = self.slots.index_of(frame)
+                if slot is None:
+                    frame = self.slots.put(frame)
+                    if frame is None:
+                        raise RuntimeError("no free frame slot")
+                    own.append(frame)
+                    slot = self.slots.index_of(frame)
+                idx.append(slot)
+            spec = self.slots.spec()
+            for slot in idx:
+                req_id, fut = self.router.submit(self.model_path, lambda req_id, s=slot: (req_id, spec, s), deadline)
+                sent.append((req_id, fut, slot))
+            return [RemoteResult(fut.result(timeout=max(0.0, deadline - time.time())), self.names)
+                    for _, fut, _ in sent]
+        except BaseException:
+            for req_id, fut, slot in sent:
+                if not fut.done():
+                    # timed out, but the inference process may still be reading the slot: it is
+                    # not reused (whoever releases it) until the answer, or the process's end, arrives
+                    self.slots.hold(slot)
+                    fut.add_done_callback(lambda f, s=slot: self.slots.unhold(s))
+                    late.add(req_id)
+            raise
+        finally:
+            self.router.forget([req_id for req_id, _, _ in sent if req_id not in late])
+            for frame in own:
+                self.slots.release(frame)
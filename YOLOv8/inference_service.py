@@ -0,0 +1,219 @@
+"""
+Shared batched inference for all camera workers.
+- One InferenceService (one copy of the weights) per distinct model path.
+- Workers submit frames; a scheduler thread gathers them into batches that
+  flush on max_batch or after max_wait_ms, runs a single predict() on the list
+  and hands every camera back its own result.
+- Per-batch latency and occupancy are kept so max_batch / max_wait_ms can be
+  tuned against end-to-end alert latency.
+- The weights can be any format ultralytics loads (PyTorch .pt, ONNX,
+  OpenVINO); resolve_model_path() maps a camera's model_path + runtime to the
+  file model_tool.py exported for it.
+"""
+import os, time, threading, queue
+from collections import deque
+from concurrent.futures import Future
+from ultralytics import YOLO
+import metrics
+
+# Defaults (overridable per service)
+DEFAULT_MAX_BATCH = 8
+DEFAULT_MAX_WAIT_MS = 15
+# Print a stats line every this many seconds (0 disables)
+STATS_INTERVAL = 30
+# Number of recent batches kept for latency percentiles
+STATS_WINDOW = 200
+# runtime -> exported weights next to the .pt (names as written by model_tool.py)
+RUNTIMES = {
+    "torch": "{stem}.pt",
+    "onnx": "{stem}.onnx",
+    "onnx-int8": "{stem}.int8.onnx",
+    "openvino": "{stem}_openvino_model",
+}
+
+log = metrics.get_logger("inference")
+BATCH_SECONDS = metrics.histogram("inference_batch_seconds", "predict() time per batch", ("model",))
+BATCH_SIZE = metrics.histogram("inference_batch_size", "Frames per batch", ("model",),
+                               buckets=(1, 2, 4, 8, 16, 32))
+QUEUE_WAIT = metrics.histogram("inference_queue_wait_seconds", "Time the first frame waited for its batch", ("model",))
+INFER_ERRORS = metrics.counter("inference_errors_total", "Failed batches", ("model",))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    idx = min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1))))
+    return vals[idx]
+
+
+def resolve_model_path(model_path, runtime=None):
+    """Weights to load for model_path on runtime, e.g. ("best.pt", "onnx") -> "best.onnx".
+    No runtime, or a model_path that is already an exported model, is used as is."""
+    if not runtime or not model_path.endswith(".pt"):
+        return model_path
+    if runtime not in RUNTIMES:
+        raise ValueError(f"unknown runtime {runtime!r} (expected one of {sorted(RUNTIMES)})")
+    folder, name = os.path.split(model_path)
+    path = os.path.join(folder, RUNTIMES[runtime].format(stem=name[:-3]))
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; export it with: python model_tool.py export --weights {model_path}")
+    return path
+
+
+class InferenceService(threading.Thread):
+    def __init__(self, model_path, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        super().__init__(daemon=True)
+        self.model_path = model_path
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+        self.name = f"infer-{model_path}"
+        log.info("loading model", model=model_path)
+        # task is only stored in .pt files; exported models would otherwise be guessed
+        self.model = YOLO(model_path, task="detect")
+        self.names = self.model.names
+        self.requests = queue.Queue()
+        self.shutdown_flag = threading.Event()
+        # metrics
+        self.stats_lock = threading.Lock()
+        self.batch_latency = deque(maxlen=STATS_WINDOW)   # seconds per predict() call
+        self.queue_wait = deque(maxlen=STATS_WINDOW)      # seconds first frame waited for its batch
+        self.batch_sizes = deque(maxlen=STATS_WINDOW)
+        self.total_batches = 0
+        self.total_frames = 0
+        self.total_errors = 0
+        self.last_stats_print = time.time()
+        self.m_batch = BATCH_SECONDS.labels(model_path)
+        self.m_size = BATCH_SIZE.labels(model_path)
+        self.m_wait = QUEUE_WAIT.labels(model_path)
+        self.m_errors = INFER_ERRORS.labels(model_path)
+
+    def submit(self, frame):
+        """Queue one frame for inference. Returns a Future resolving to its Results object."""
+        fut = Future()
+        self.requests.put((frame, fut, time.time()))
+        return fut
+
+    def predict(self, frame, timeout=None):
+        """Blocking helper: submit a frame and wait for its result."""
+        return self.submit(frame).result(timeout=timeout)
+
+    def predict_many(self, frames, timeout=None):
+        """Submit several frames at once (e.g. the crops of one frame) so they share a batch."""
+        futs = [self.submit(f) for f in frames]
+        return [f.result(timeout=timeout) for f in futs]
+
+    def _gather(self):
+        try:
+            first = self.requests.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                if remaining <= 0:
+                    batch.append(self.requests.get_nowait())
+                else:
+                    batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        frames = [b[0] for b in batch]
+        t0 = time.time()
+        try:
+            results = self.model.predict(source=frames, verbose=False)
+        except Exception as e:
+            log.error("batch predict failed", model=self.model_path, batch=len(batch), error=e)
+            self.m_errors.inc()
+            with self.stats_lock:
+                self.total_errors += 1
+            for _, fut, _ in batch:
+                fut.set_exception(e)
+            return
+        dt = time.time() - t0
+        for (_, fut, _), res in zip(batch, results):
+            fut.set_result(res)
+        self.m_batch.observe(dt)
+        self.m_size.observe(len(batch))
+        self.m_wait.observe(t0 - batch[0][2])
+        with self.stats_lock:
+            self.batch_latency.append(dt)
+            self.queue_wait.append(t0 - batch[0][2])
+            self.batch_sizes.append(len(batch))
+            self.total_batches += 1
+            self.total_frames += len(batch)
+
+    def stats(self):
+        with self.stats_lock:
+            sizes = list(self.batch_sizes)
+            lat = list(self.batch_latency)
+            wait = list(self.queue_wait)
+            avg_size = sum(sizes) / len(sizes) if sizes else 0.0
+            return {
+                "model_path": self.model_path,
+                "batches": self.total_batches,
+                "frames": self.total_frames,
+                "errors": self.total_errors,
+                "queue_depth": self.requests.qsize(),
+                "avg_batch_size": avg_size,
+                "occupancy": avg_size / self.max_batch,
+                "batch_latency_p50_ms": _percentile(lat, 50) * 1000,
+                "batch_latency_p95_ms": _percentile(lat, 95) * 1000,
+                "queue_wait_p95_ms": _percentile(wait, 95) * 1000,
+            }
+
+    def _maybe_print_stats(self):
+        if not STATS_INTERVAL or time.time() - self.last_stats_print < STATS_INTERVAL:
+            return
+        self.last_stats_print = time.time()
+        s = self.stats()
+        log.info("stats", model=self.model_path, batches=s["batches"], frames=s["frames"],
+                 avg_batch=round(s["avg_batch_size"], 2), occupancy=round(s["occupancy"], 2),
+                 latency_p50_ms=round(s["batch_latency_p50_ms"], 1), latency_p95_ms=round(s["batch_latency_p95_ms"], 1),
+                 wait_p95_ms=round(s["queue_wait_p95_ms"], 1), queue=s["queue_depth"])
+
+    def run(self):
+        while not self.shutdown_flag.is_set():
+            batch = self._gather()
+            if batch:
+                self._run_batch(batch)
+            self._maybe_print_stats()
+        # fail anything still queued so callers don't hang
+        while True:
+            try:
+                _, fut, _ = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            fut.set_exception(RuntimeError("inference service stopped"))
+
+
+# ---------- registry: one service per model path ----------
+_services = {}
+_services_lock = threading.Lock()
+
+
+def get_inference_service(model_path, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    """Return the shared (started) service for model_path, creating it on first use."""
+    with _services_lock:
+        svc = _services.get(model_path)
+        if svc is None:
+            svc = InferenceService(model_path, max_batch=max_batch, max_wait_ms=max_wait_ms)
+            svc.start()
+            _services[model_path] = svc
+        return svc
+
+
+def all_services():
+    with _services_lock:
+        return list(_services.values())
+
+
+def shutdown_all(timeout=5):
+    for svc in all_services():
+        svc.shutdown_flag.set()
+    for svc in all_services():
+        svc.join(timeout=timeout)
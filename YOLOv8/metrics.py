@@ -0,0 +1,413 @@
+"""
+Metrics, sampled profiling and structured logging, shared by the detector
+(yolo_multi_alert.py and its modules) and the backend (backend/app.py).
+- Registry of counters, gauges and histograms with labels, rendered in the
+  Prometheus text format. Updates are a lock + an add (histograms: + a
+  bisect), cheap enough for per-frame use. Counters and gauges can be
+  callbacks, read only when /metrics is scraped (ring occupancy, outstanding alerts, queue depth).
+- serve_metrics() exposes /metrics (and /debug/profile) from a process that
+  has no web server of its own; the backend adds the same routes to Flask.
+- Profiler: off by default; once switched on (/debug/profile?seconds=N) a
+  thread samples every thread's stack at PROFILE_HZ and returns the folded
+  stacks (flamegraph.pl / speedscope input). Nothing runs while it is off.
+- get_logger(): logfmt (or JSON) lines with key=value fields instead of
+  print(); the level is checked before anything is formatted, so debug logs
+  on hot paths cost one comparison while disabled.
+"""
+import os, sys, json, time, bisect, threading, traceback
+from collections import Counter as _Tally
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Latency buckets (seconds) used unless a histogram brings its own
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Stack samples per second while the profiler is on, and the longest run one request may ask for
+PROFILE_HZ = 100
+PROFILE_MAX_SECONDS = 60
+# Logging: LOG_LEVEL / LOG_FORMAT environment variables override these
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info")
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "logfmt")    # "logfmt" or "json"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _fmt_labels(names, values, extra=""):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _num(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+# ---------- metric types ----------
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.children = {}
+        if not self.labelnames:
+            self.children[()] = self._child()
+
+    def labels(self, *values):
+        """Child for one set of label values (keep it around on hot paths)."""
+        values = tuple(str(v) for v in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    def remove(self, *values):
+        with self.lock:
+            self.children.pop(tuple(str(v) for v in values), None)
+
+    def remove_prefix(self, *values):
+        """Drop every series whose leading label values are `values` (e.g. all of one camera)."""
+        values = tuple(str(v) for v in values)
+        with self.lock:
+            for key in [k for k in self.children if k[:len(values)] == values]:
+                del self.children[key]
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            out += child.render(self.name, self.labelnames, values)
+        return out
+
+    # unlabelled metrics can be used directly
+    def __getattr__(self, attr):
+        if attr in ("inc", "dec", "set", "observe", "time", "set_function", "value"):
+            return getattr(self.children[()], attr)
+        raise AttributeError(attr)
+
+
+class _CounterChild:
+    fn = None
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def set_function(self, fn):
+        """Read fn() at scrape time instead of a stored value (e.g. a count kept elsewhere)."""
+        self.fn = fn
+
+    def render(self, name, labelnames, values):
+        v = self.value
+        if self.fn is not None:
+            try:
+                v = self.fn()
+            except Exception:
+                return []
+        return [f"{name}{_fmt_labels(labelnames, values)} {_num(v)}"]
+
+
+class _GaugeChild(_CounterChild):
+    def set(self, v):
+        self.value = v
+
+    def dec(self, n=1):
+        self.inc(-n)
+
+
+class _Timer:
+    __slots__ = ("child", "t0")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.t0)
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, v):
+        i = bisect.bisect_left(self.buckets, v)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += v
+
+    def time(self):
+        """with hist.time(): ... observes the block's duration."""
+        return _Timer(self)
+
+    def render(self, name, labelnames, values):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        out, acc = [], 0
+        for b, n in zip(self.buckets + (float("inf"),), counts):
+            acc += n
+            le = 'le="%s"' % _num(b)
+            out.append(f"{name}_bucket{_fmt_labels(labelnames, values, le)} {acc}")
+        out.append(f"{name}_sum{_fmt_labels(labelnames, values)} {_num(total)}")
+        out.append(f"{name}_count{_fmt_labels(labelnames, values)} {acc}")
+        return out
+
+
+class CounterMetric(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _CounterChild()
+
+
+class GaugeMetric(_Metric):
+    kind = "gauge"
+
+    def _child(self):
+        return _GaugeChild()
+
+
+class HistogramMetric(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bucket_bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _child(self):
+        return _HistogramChild(self.bucket_bounds)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.collectors = []    # callables run before every render (refresh gauges etc.)
+
+    def _get(self, cls, name, help, labelnames, **kw):
+        with self.lock:
+            m = self.metrics.get(name)
+            if m is None:
+                m = self.metrics[name] = cls(name, help, labelnames, **kw)
+            elif not isinstance(m, cls) or m.labelnames != tuple(labelnames):
+                raise ValueError(f"metric {name} already registered with a different type / labels")
+            return m
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(CounterMetric, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._get(GaugeMetric, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(HistogramMetric, name, help, labelnames, buckets=buckets)
+
+    def add_collector(self, fn):
+        self.collectors.append(fn)
+
+    def render(self):
+        for fn in list(self.collectors):
+            try:
+                fn()
+            except Exception as e:
+                get_logger("metrics").warning("collector failed", error=e)
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for m in metrics:
+            lines += m.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+# ---------- sampled profiling ----------
+
+class Profiler:
+    """Samples all threads' stacks while running; folded stacks on stop()."""
+
+    def __init__(self, hz=PROFILE_HZ):
+        self.hz = hz
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_flag = threading.Event()
+        self.samples = _Tally()
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.samples = _Tally()
+            self.stop_flag.clear()
+            self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling; returns the folded stacks ("thread;outer;...;inner count" lines)."""
+        with self.lock:
+            t, self.thread = self.thread, None
+        if t is not None:
+            self.stop_flag.set()
+            t.join()
+        return "\n".join(f"{stack} {n}" for stack, n in self.samples.most_common()) + "\n"
+
+    def _run(self):
+        me = threading.get_ident()
+        interval = 1.0 / self.hz
+        while not self.stop_flag.wait(interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                # one entry per function, so samples on different lines of it add up
+                stack = [f"{f.f_code.co_name} ({os.path.basename(f.f_code.co_filename)}:{f.f_code.co_firstlineno})"
+                         for f, _ in traceback.walk_stack(frame)]
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def profile(self, seconds):
+        """Sample for seconds (capped) and return the folded stacks; None if already running."""
+        if not self.start():
+            return None
+        time.sleep(max(0.0, min(float(seconds), PROFILE_MAX_SECONDS)))
+        return self.stop()
+
+
+PROFILER = Profiler()
+
+
+# ---------- HTTP endpoint for processes without a web server ----------
+
+def _make_handler(registry, profiling):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body, ctype=CONTENT_TYPE):
+            data = body.encode()
+            self.send_response(code)
+            self.send_header("Content-Type", ctype)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/metrics":
+                return self._send(200, registry.render())
+            if url.path == "/debug/profile" and profiling:
+                seconds = parse_qs(url.query).get("seconds", ["10"])[0]
+                folded = PROFILER.profile(seconds)
+                if folded is None:
+                    return self._send(409, "profiler already running\n", "text/plain")
+                return self._send(200, folded, "text/plain")
+            self._send(404, "not found\n", "text/plain")
+
+    return Handler
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY, profiling=True):
+    """Serve /metrics (+ /debug/profile) on a daemon thread; returns the server or None."""
+    try:
+        httpd = ThreadingHTTPServer((host, port), _make_handler(registry, profiling))
+    except OSError as e:
+        get_logger("metrics").warning("metrics endpoint not started", port=port, error=e)
+        return None
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, name="metrics-http", daemon=True).start()
+    get_logger("metrics").info("serving /metrics", url=f"http://{host}:{port}/metrics")
+    return httpd
+
+
+# ---------- structured logging ----------
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+_log_level = LEVELS.get(LOG_LEVEL.lower(), 20)
+_log_lock = threading.Lock()
+_log_out = sys.stdout
+
+
+def set_log_level(level):
+    global _log_level
+    _log_level = LEVELS[level] if isinstance(level, str) else int(level)
+
+
+def _logfmt_value(v):
+    s = str(v)
+    if not s or any(c in s for c in ' ="\n'):
+        return '"' + s.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return s
+
+
+class Logger:
+    """get_logger(name, **context).info("message", key=value, ...)."""
+
+    def __init__(self, name, context=None):
+        self.name = name
+        self.context = context or {}
+
+    def bind(self, **context):
+        return Logger(self.name, dict(self.context, **context))
+
+    def enabled(self, level):
+        return LEVELS[level] >= _log_level
+
+    def _emit(self, level, msg, fields):
+        rec = {"ts": round(time.time(), 3), "level": level, "logger": self.name, "msg": msg}
+        rec.update(self.context)
+        rec.update(fields)
+        if LOG_FORMAT == "json":
+            line = json.dumps(rec, default=str)
+        else:
+            line = " ".join(f"{k}={_logfmt_value(v)}" for k, v in rec.items())
+        with _log_lock:
+            _log_out.write(line + "\n")
+            _log_out.flush()
+
+    def debug(self, msg, **fields):
+        if _log_level <= 10:
+            self._emit("debug", msg, fields)
+
+    def info(self, msg, **fields):
+        if _log_level <= 20:
+            self._emit("info", msg, fields)
+
+    def warning(self, msg, **fields):
+        if _log_level <= 30:
+            self._emit("warning", msg, fields)
+
+    def error(self, msg, **fields):
+        if _log_level <= 40:
+            self._emit("error", msg, fields)
+
+
+def get_logger(name, **context):
+    return Logger(name, context)
@@ -0,0 +1,296 @@
+"""
+Model management: export best.pt to the other inference runtimes and check
+the exports before a camera is switched to one (runtime key, see
+yolo_multi_alert.py).
+- export: ONNX (dynamic batch / size, so the shared service can still batch),
+  optionally OpenVINO and an INT8 ONNX quantized with ONNX Runtime, calibrated
+  on the sample frames when given (static QDQ), otherwise dynamic.
+- check: every variant's class names must equal the .pt's and contain
+  TARGET_CLASSES; a renamed or reordered class would silently stop alerts.
+- compare: runs every variant over a sample frame set and reports, per
+  variant, latency p50 / p95 at batch 1, throughput at INFER_MAX_BATCH and the
+  accuracy drift against the .pt: detections (conf >= CONF_THRESHOLD) matched
+  by class + IoU, confidence deltas and how often the alert decision (any
+  target class in the frame) agrees. Written as JSON and a markdown table.
+
+    python model_tool.py export --weights best.pt --formats onnx,onnx-int8,openvino --frames samples/
+    python model_tool.py check --weights best.pt
+    python model_tool.py compare --weights best.pt --frames samples/ --report model_report
+"""
+import os, sys, glob, json, time, argparse
+import numpy as np
+import cv2
+from ultralytics import YOLO
+from inference_service import RUNTIMES
+from event_tracker import as_numpy
+from yolo_multi_alert import TARGET_CLASSES, CONF_THRESHOLD, INFER_MAX_BATCH
+
+IMGSZ = 640
+# Sample frames used for INT8 calibration / the comparison
+MAX_FRAMES = 200
+CALIBRATION_FRAMES = 64
+WARMUP_FRAMES = 5
+# A detection of the same class overlapping at least this much counts as the same object
+MATCH_IOU = 0.5
+
+
+def variant_path(weights, runtime):
+    folder, name = os.path.split(weights)
+    return os.path.join(folder, RUNTIMES[runtime].format(stem=os.path.splitext(name)[0]))
+
+
+def variants(weights):
+    """[(runtime, path)] for the .pt and every export of it that exists."""
+    return [(rt, variant_path(weights, rt)) for rt in RUNTIMES if os.path.exists(variant_path(weights, rt))]
+
+
+def load_frames(source, limit=MAX_FRAMES):
+    """BGR frames from a directory of images or a video file, evenly spread over it."""
+    if not source:
+        return []
+    if os.path.isdir(source):
+        files = sorted(f for ext in ("jpg", "jpeg", "png", "bmp")
+                       for f in glob.glob(os.path.join(source, "*." + ext)))
+        step = max(1, len(files) // limit)
+        frames = [cv2.imread(f) for f in files[::step][:limit]]
+        return [f for f in frames if f is not None]
+    cap = cv2.VideoCapture(source)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or limit
+    step = max(1, total // limit)
+    frames, i = [], 0
+    while len(frames) < limit:
+        ok, img = cap.read()
+        if not ok:
+            break
+        if i % step == 0:
+            frames.append(img)
+        i += 1
+    cap.release()
+    return frames
+
+
+def letterbox(frame, size=IMGSZ):
+    """NCHW float32 input as the exported model expects it (RGB, 0..1, padded square)."""
+    h, w = frame.shape[:2]
+    r = min(size / h, size / w)
+    nh, nw = int(round(h * r)), int(round(w * r))
+    canvas = np.full((size, size, 3), 114, np.uint8)
+    top, left = (size - nh) // 2, (size - nw) // 2
+    canvas[top:top + nh, left:left + nw] = cv2.resize(frame, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return np.ascontiguousarray(canvas[:, :, ::-1].transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+
+# ---------- export ----------
+
+def quantize_onnx(src, dst, frames, imgsz=IMGSZ):
+    try:
+        import onnx
+        from onnxruntime.quantization import (quantize_static, quantize_dynamic, CalibrationDataReader,
+                                              QuantFormat, QuantType)
+    except ImportError:
+        sys.exit("INT8 export needs onnx and onnxruntime: pip install onnx onnxruntime")
+
+    if frames:
+        input_name = onnx.load(src, load_external_data=False).graph.input[0].name
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.it = iter(frames[:CALIBRATION_FRAMES])
+
+            def get_next(self):
+                frame = next(self.it, None)
+                return None if frame is None else {input_name: letterbox(frame, imgsz)}
+
+        print(f"[export] INT8 static quantization, calibrating on {min(len(frames), CALIBRATION_FRAMES)} frames")
+        quantize_static(src, dst, Reader(), quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    else:
+        print("[export] no --frames given: INT8 dynamic quantization (weights only)")
+        quantize_dynamic(src, dst, weight_type=QuantType.QUInt8)
+    # ultralytics reads names / stride / imgsz from the metadata; carry it over
+    model = onnx.load(dst)
+    meta = {p.key: p.value for p in model.metadata_props}
+    for p in onnx.load(src, load_external_data=False).metadata_props:
+        if p.key not in meta:
+            model.metadata_props.add(key=p.key, value=p.value)
+    onnx.save(model, dst)
+    return dst
+
+
+def export(weights, formats, frames, imgsz=IMGSZ):
+    out = {}
+    if "onnx" in formats or "onnx-int8" in formats:
+        out["onnx"] = YOLO(weights).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+    if "onnx-int8" in formats:
+        out["onnx-int8"] = quantize_onnx(out["onnx"], variant_path(weights, "onnx-int8"), frames, imgsz)
+    if "openvino" in formats:
+        out["openvino"] = YOLO(weights).export(format="openvino", imgsz=imgsz, dynamic=True)
+    for rt, path in out.items():
+        print(f"[export] {rt:10s} -> {path}")
+    return out
+
+
+# ---------- checks / comparison ----------
+
+def check_names(names, reference, targets=TARGET_CLASSES):
+    """Problems with a variant's class names ([] if it is usable)."""
+    names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+    problems = []
+    missing = sorted(set(targets) - set(names.values()))
+    if missing:
+        problems.append(f"target classes missing: {missing}")
+    if reference is not None and names != dict(reference):
+        diff = sorted(k for k in set(names) | set(reference) if names.get(k) != reference.get(k))
+        problems.append(f"class names differ from the .pt at indices {diff[:10]}")
+    return problems
+
+
+def detections(res, conf_threshold=CONF_THRESHOLD):
+    """(xyxy, conf, cls) of one result, boxes under conf_threshold dropped."""
+    b = res.boxes
+    conf = as_numpy(b.conf)
+    keep = conf >= conf_threshold
+    return as_numpy(b.xyxy).reshape(-1, 4)[keep], conf[keep], as_numpy(b.cls).astype(np.int64)[keep]
+
+
+def box_iou(a, b):
+    tl = np.maximum(a[:, None, :2], b[None, :, :2])
+    br = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match(ref, out, iou_threshold=MATCH_IOU):
+    """Greedy same-class matching; returns the |conf delta| of every matched pair."""
+    (rb, rc, rk), (ob, oc, ok) = ref, out
+    if not len(rb) or not len(ob):
+        return []
+    iou = box_iou(rb, ob)
+    iou[rk[:, None] != ok[None, :]] = 0
+    deltas = []
+    for i in np.argsort(-rc):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_threshold:
+            deltas.append(abs(float(rc[i]) - float(oc[j])))
+            iou[:, j] = 0
+    return deltas
+
+
+def alert_classes(det, names, targets=TARGET_CLASSES):
+    return {names[int(c)] for c in det[2]} & set(targets)
+
+
+def run_variant(path, frames, batch=INFER_MAX_BATCH):
+    model = YOLO(path, task="detect")
+    for frame in frames[:WARMUP_FRAMES]:
+        model.predict(frame, verbose=False)
+    lat, results = [], []
+    for frame in frames:
+        t0 = time.perf_counter()
+        results.append(model.predict(frame, verbose=False)[0])
+        lat.append(time.perf_counter() - t0)
+    throughput = None
+    try:
+        t0 = time.perf_counter()
+        for i in range(0, len(frames), batch):
+            model.predict(frames[i:i + batch], verbose=False)
+        throughput = len(frames) / (time.perf_counter() - t0)
+    except Exception as e:
+        print(f"[compare] {path}: batch {batch} failed ({e}); throughput not measured")
+    return model.names, lat, throughput, [detections(r) for r in results]
+
+
+def compare(weights, frames, report=None):
+    if not frames:
+        sys.exit("compare needs sample frames (--frames)")
+    rows = []
+    ref_names = ref_dets = None
+    for rt, path in variants(weights):
+        print(f"[compare] {rt}: {path} on {len(frames)} frames")
+        names, lat, fps, dets = run_variant(path, frames)
+        names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+        lat_ms = np.array(lat) * 1000
+        row = {"runtime": rt, "path": path, "frames": len(frames),
+               "latency_p50_ms": round(float(np.percentile(lat_ms, 50)), 2),
+               "latency_p95_ms": round(float(np.percentile(lat_ms, 95)), 2),
+               "fps_batch1": round(1000.0 / float(np.mean(lat_ms)), 2),
+               f"fps_batch{INFER_MAX_BATCH}": round(fps, 2) if fps else None}
+        if ref_dets is None:          # the .pt comes first and is the reference
+            ref_names, ref_dets = names, dets
+        row["problems"] = check_names(names, ref_names)
+        row["names_ok"] = not row["problems"]
+        n_ref = sum(len(d[1]) for d in ref_dets)
+        n_out = sum(len(d[1]) for d in dets)
+        deltas = [x for r, o in zip(ref_dets, dets) for x in match(r, o)]
+        agree = sum(alert_classes(r, ref_names) == alert_classes(o, names) for r, o in zip(ref_dets, dets))
+        row.update({"detections": n_out,
+                    "recall_vs_pt": round(len(deltas) / n_ref, 4) if n_ref else 1.0,
+                    "precision_vs_pt": round(len(deltas) / n_out, 4) if n_out else 1.0,
+                    "conf_delta_mean": round(float(np.mean(deltas)), 4) if deltas else 0.0,
+                    "conf_delta_max": round(float(np.max(deltas)), 4) if deltas else 0.0,
+                    "alert_agreement": round(agree / len(frames), 4)})
+        rows.append(row)
+
+    cols = ["runtime", "latency_p50_ms", "latency_p95_ms", "fps_batch1", f"fps_batch{INFER_MAX_BATCH}",
+            "recall_vs_pt", "precision_vs_pt", "conf_delta_mean", "alert_agreement", "names_ok"]
+    table = ["| " + " | ".join(cols) + " |", "|" + "---|" * len(cols)]
+    table += ["| " + " | ".join(str(r[c]) for c in cols) + " |" for r in rows]
+    print("\n".join(table))
+    for r in rows:
+        for p in r["problems"]:
+            print(f"[compare] {r['runtime']}: {p}")
+    if report:
+        with open(report + ".json", "w") as f:
+            json.dump({"weights": weights, "conf_threshold": CONF_THRESHOLD,
+                       "target_classes": sorted(TARGET_CLASSES), "variants": rows}, f, indent=2)
+        with open(report + ".md", "w") as f:
+            f.write(f"# Model variants of {weights} ({len(frames)} frames)\n\n" + "\n".join(table) + "\n")
+        print(f"[compare] report written to {report}.json / {report}.md")
+    return rows
+
+
+def check(weights):
+    ref = None
+    failed = False
+    for rt, path in variants(weights):
+        names = YOLO(path, task="detect").names
+        names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else dict(names)
+        if ref is None:
+            ref = names
+        problems = check_names(names, ref)
+        failed = failed or bool(problems)
+        print(f"[check] {rt:10s} {path}: " + ("; ".join(problems) if problems else "ok"))
+    return not failed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name in ("export", "check", "compare"):
+        p = sub.add_parser(name)
+        p.add_argument("--weights", default="best.pt")
+        if name != "check":
+            p.add_argument("--frames", default=None, help="directory of images or a video file")
+            p.add_argument("--max-frames", type=int, default=MAX_FRAMES)
+    sub.choices["export"].add_argument("--formats", default="onnx", help="comma list of onnx, onnx-int8, openvino")
+    sub.choices["export"].add_argument("--imgsz", type=int, default=IMGSZ)
+    sub.choices["compare"].add_argument("--report", default="model_report")
+    args = ap.parse_args()
+
+    if args.cmd == "export":
+        formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+        unknown = set(formats) - (set(RUNTIMES) - {"torch"})
+        if unknown:
+            sys.exit(f"unknown formats: {sorted(unknown)}")
+        export(args.weights, formats, load_frames(args.frames, args.max_frames), args.imgsz)
+        sys.exit(0 if check(args.weights) else 1)
+    elif args.cmd == "check":
+        sys.exit(0 if check(args.weights) else 1)
+    else:
+        compare(args.weights, load_frames(args.frames, args.max_frames), args.report)
+
+
+if __name__ == "__main__":
+    main()
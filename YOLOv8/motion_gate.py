@@ -0,0 +1,112 @@
+"""
+Cheap motion / scene-change pre-filter that runs before inference.
+- Each frame is reduced to a small blurred grayscale image and compared with
+  a running-average background (cv2.accumulateWeighted / absdiff), so the
+  test costs about a millisecond per 640x480 frame.
+- While the scene is static, inference is only run every idle_interval seconds
+  (a slow heartbeat, so a still object that appeared between frames is still
+  seen); once motion is detected the camera is back at full rate and stays
+  there for hold_seconds after the motion stops. A target-class detection
+  holds the full rate the same way (hold()), so a still object found by a
+  heartbeat is seen often enough to be confirmed (event_tracker.py: its
+  sightings expire after release_seconds, less than idle_interval).
+- Counters: frames checked, frames skipped, and inference time saved
+  (skipped frames x recent inference latency).
+"""
+import time
+import cv2
+
+# Defaults (overridable per camera, see CameraWorker)
+MOTION_WIDTH = 160            # width of the comparison image
+MOTION_PIXEL_THRESHOLD = 25   # per-pixel gray level change that counts as "changed"
+MOTION_MIN_AREA = 0.005       # fraction of changed pixels that counts as motion
+MOTION_HOLD_SECONDS = 3.0     # keep full rate this long after the last motion
+MOTION_IDLE_INTERVAL = 2.0    # still run inference this often on a static scene (0 = never)
+MOTION_BG_ALPHA = 0.05        # background adaptation rate (lighting drift)
+
+# sensitivity presets: (pixel threshold, min changed area)
+SENSITIVITY = {
+    "low": (40, 0.02),
+    "medium": (MOTION_PIXEL_THRESHOLD, MOTION_MIN_AREA),
+    "high": (15, 0.001),
+}
+
+
+class MotionGate:
+    def __init__(self, sensitivity="medium", pixel_threshold=None, min_area=None,
+                 hold_seconds=MOTION_HOLD_SECONDS, idle_interval=MOTION_IDLE_INTERVAL,
+                 width=MOTION_WIDTH, bg_alpha=MOTION_BG_ALPHA, enabled=True):
+        preset_thr, preset_area = SENSITIVITY.get(sensitivity, SENSITIVITY["medium"])
+        self.pixel_threshold = preset_thr if pixel_threshold is None else pixel_threshold
+        self.min_area = preset_area if min_area is None else min_area
+        self.hold_seconds = hold_seconds
+        self.idle_interval = idle_interval
+        self.width = width
+        self.bg_alpha = bg_alpha
+        self.enabled = enabled
+        self.background = None        # float32 running average
+        self.last_motion = 0.0
+        self.last_infer = 0.0
+        self.last_score = 0.0
+        # counters
+        self.frames = 0
+        self.skipped = 0
+        self.infer_time_ema = 0.0
+        self.saved_seconds = 0.0
+
+    def _small(self, frame):
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (self.width, max(1, int(h * self.width / w))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def motion_score(self, frame):
+        """Fraction of pixels that differ from the background; updates the background."""
+        gray = self._small(frame)
+        if self.background is None or self.background.shape != gray.shape:
+            self.background = gray.astype("float32")
+            return 1.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self.background))
+        changed = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+        cv2.accumulateWeighted(gray, self.background, self.bg_alpha)
+        return changed / float(diff.size)
+
+    def should_infer(self, frame, now=None):
+        """True if this frame should go to the model."""
+        now = now or time.time()
+        self.frames += 1
+        if not self.enabled:
+            return True
+        self.last_score = self.motion_score(frame)
+        if self.last_score >= self.min_area:
+            self.last_motion = now
+        if now - self.last_motion <= self.hold_seconds:
+            return True
+        if self.idle_interval and now - self.last_infer >= self.idle_interval:
+            return True
+        self.skipped += 1
+        self.saved_seconds += self.infer_time_ema
+        return False
+
+    def record_inference(self, seconds, now=None):
+        """Report how long an inference took; used to estimate the time saved."""
+        self.last_infer = now or time.time()
+        self.infer_time_ema = seconds if not self.infer_time_ema else 0.9 * self.infer_time_ema + 0.1 * seconds
+
+    def hold(self, now=None):
+        """Keep the full rate for hold_seconds from now, as after motion."""
+        self.last_motion = max(self.last_motion, now or time.time())
+
+    def static(self, now=None):
+        """True while the gate sees no motion (past hold_seconds); False when disabled."""
+        return self.enabled and (now or time.time()) - self.last_motion > self.hold_seconds
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / self.frames if self.frames else 0.0,
+            "inference_ms_avg": self.infer_time_ema * 1000,
+            "inference_saved_s": self.saved_seconds,
+            "last_score": self.last_score,
+        }
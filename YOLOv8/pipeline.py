@@ -0,0 +1,130 @@
+"""
+Helpers for the per-camera staged pipeline (see CameraWorker):
+fetch (frame source thread) -> decode + preprocess (one thread) -> inference +
+events (the worker thread), with a bounded queue between the last two.
+- decode_scaled() lets libjpeg decode at 1/2, 1/4 or 1/8 size when the source
+  is that much larger than the target, so a 1080p frame is neither fully
+  decoded nor resized from full size; frames are then resized exactly once.
+- LatestQueue keeps the newest items only: when inference falls behind the
+  oldest queued frame is dropped instead of building latency.
+- StageTimes keeps recent per-stage latencies (p50 / p95) so it is visible
+  where a frame's time goes.
+"""
+import time, queue, threading
+from collections import deque
+import numpy as np
+import cv2
+
+# Recent frames kept for the stage percentiles
+STAGE_WINDOW = 300
+
+_REDUCED = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+# SOFn markers carry the image size (C4 / C8 / CC are not frame headers)
+_SOF = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    return vals[min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1))))]
+
+
+def jpeg_size(buf):
+    """(width, height) from the JPEG frame header, or None."""
+    i, n = 2, len(buf)
+    while i + 9 < n:
+        if buf[i] != 0xFF:
+            return None
+        marker = buf[i + 1]
+        if marker == 0xFF:          # fill byte
+            i += 1
+            continue
+        seg_len = (buf[i + 2] << 8) | buf[i + 3]
+        if marker in _SOF:
+            return (buf[i + 7] << 8) | buf[i + 8], (buf[i + 5] << 8) | buf[i + 6]
+        i += 2 + seg_len
+    return None
+
+
+def decode_scaled(jpeg, width, height):
+    """Decode at the smallest 1/2^k scale that is still at least width x height."""
+    flag = cv2.IMREAD_COLOR
+    size = jpeg_size(jpeg)
+    if size:
+        for factor, reduced in _REDUCED:
+            if size[0] // factor >= width and size[1] // factor >= height:
+                flag = reduced
+                break
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), flag)
+
+
+class LatestQueue:
+    """Bounded queue that drops its oldest item (passed to on_drop) when full."""
+
+    def __init__(self, maxsize=1, on_drop=None):
+        self.q = queue.Queue(maxsize=maxsize)
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def put(self, item):
+        while True:
+            try:
+                self.q.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    old = self.q.get_nowait()
+                except queue.Empty:
+                    continue
+                self.dropped += 1
+                if self.on_drop:
+                    self.on_drop(old)
+
+    def get(self, timeout=None):
+        try:
+            return self.q.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def drain(self):
+        while True:
+            item = self.get(timeout=0)
+            if item is None:
+                return
+            if self.on_drop:
+                self.on_drop(item)
+
+
+class StageTimes:
+    def __init__(self, window=STAGE_WINDOW):
+        self.lock = threading.Lock()
+        self.window = window
+        self.samples = {}
+
+    def add(self, times):
+        """times: {stage: seconds} for one frame."""
+        with self.lock:
+            for stage, dt in times.items():
+                d = self.samples.get(stage)
+                if d is None:
+                    d = self.samples[stage] = deque(maxlen=self.window)
+                d.append(dt)
+
+    def stats(self):
+        with self.lock:
+            return {stage: {"p50_ms": round(_percentile(list(d), 50) * 1000, 2),
+                            "p95_ms": round(_percentile(list(d), 95) * 1000, 2)}
+                    for stage, d in self.samples.items()}
+
+
+class FrameWork:
+    """One frame on its way from preprocess to inference."""
+    __slots__ = ("packet", "frame", "times", "queued_at", "crops")
+
+    def __init__(self, packet, frame, times, crops=None):
+        self.packet = packet
+        self.frame = frame
+        self.times = times
+        self.crops = crops      # model inputs when the camera runs ROI / tiled inference
+        self.queued_at = time.time()
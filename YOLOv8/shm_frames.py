@@ -0,0 +1,100 @@
+"""
+Fixed-size frame slots in one multiprocessing shared-memory block.
+- A camera decodes/resizes straight into one of its slots; the inference
+  process attaches the same block by name and reads the slot as a NumPy
+  view, so a frame crosses the process boundary without pickling.
+- put() takes a free slot and release() gives it back once inference and
+  alerting are done with the frame; with the staged camera pipeline one frame
+  is being written, one queued and one in inference, so 4 slots leave one
+  spare. When none is free the new frame is dropped rather than overwriting.
+- hold() keeps a slot out of circulation while another process may still read
+  it (a request that timed out): release() is deferred until unhold().
+"""
+import threading
+import numpy as np
+import cv2
+from multiprocessing import shared_memory
+
+FRAME_SHAPE = (480, 640, 3)
+SLOTS_PER_CAMERA = 4
+
+
+class FrameSlots:
+    def __init__(self, nslots=SLOTS_PER_CAMERA, shape=FRAME_SHAPE, name=None, create=True):
+        self.nslots = nslots
+        self.shape = tuple(shape)
+        self.slot_bytes = int(np.prod(self.shape))
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=self.slot_bytes * nslots)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.array = np.ndarray((nslots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.base = self.array.ctypes.data
+        self.lock = threading.Lock()
+        self.free = list(range(nslots))
+        self.held = {}     # slot -> release() was called while held
+
+    def spec(self):
+        """Picklable description used to attach() in another process."""
+        return {"name": self.name, "nslots": self.nslots, "shape": self.shape}
+
+    @classmethod
+    def attach(cls, spec):
+        return cls(spec["nslots"], spec["shape"], name=spec["name"], create=False)
+
+    def view(self, idx):
+        return self.array[idx]
+
+    def index_of(self, frame):
+        """Slot index if frame is exactly one of our slot views, else None."""
+        off = frame.ctypes.data - self.base
+        if frame.shape != self.shape or off < 0 or off % self.slot_bytes or off // self.slot_bytes >= self.nslots:
+            return None
+        return off // self.slot_bytes
+
+    def put(self, frame):
+        """Resize/copy frame into a free slot and return the slot view (None if all are in use)."""
+        with self.lock:
+            if not self.free:
+                return None
+            idx = self.free.pop(0)
+        dst = self.array[idx]
+        if frame.shape != self.shape:
+            cv2.resize(frame, (self.shape[1], self.shape[0]), dst=dst)
+        else:
+            np.copyto(dst, frame)
+        return dst
+
+    def release(self, frame):
+        """Give back the slot holding frame (no-op for frames that are not slot views)."""
+        idx = self.index_of(frame)
+        if idx is not None:
+            with self.lock:
+                if idx in self.held:
+                    self.held[idx] = True
+                elif idx not in self.free:
+                    self.free.append(idx)
+
+    def hold(self, idx):
+        with self.lock:
+            self.held.setdefault(idx, False)
+
+    def unhold(self, idx):
+        """End a hold(); a release() that came in meanwhile takes effect now."""
+        with self.lock:
+            if self.held.pop(idx, False) and idx not in self.free:
+                self.free.append(idx)
+
+    def close(self):
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            pass   # a view is still referenced; the mapping goes away with the process
+
+    def unlink(self):
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,82 @@
+"""
+Alert status change feed subscriber.
+- One long-poll loop on GET /api/alerts/changes per process instead of every
+  camera polling /api/alerts/<aid>/status for each outstanding alert.
+- Cameras watch() the alert ids they own and get handler.on_status(aid, status)
+  as soon as a reviewer acts.
+- `healthy` is False while the feed is down, so cameras can fall back to the
+  batch status lookup.
+"""
+import time, threading
+import requests
+import metrics
+
+LONG_POLL_TIMEOUT = 25
+RECONNECT_MIN = 0.5
+RECONNECT_MAX = 30.0
+
+log = metrics.get_logger("status_feed")
+CHANGES = metrics.counter("status_feed_changes_total", "Alert status changes received from the feed")
+HEALTHY = metrics.gauge("status_feed_healthy", "1 while the change feed is connected")
+
+
+class StatusFeed(threading.Thread):
+    def __init__(self, backend, poll_timeout=LONG_POLL_TIMEOUT):
+        super().__init__(daemon=True)
+        self.name = "status-feed"
+        self.backend = backend
+        self.poll_timeout = poll_timeout
+        self.session = requests.Session()
+        self.cursor = None
+        self.watched = {}          # alert_id -> handler
+        self.lock = threading.Lock()
+        self.healthy = False
+        self.shutdown_flag = threading.Event()
+        self.events_seen = 0
+
+    def watch(self, alert_id, handler):
+        with self.lock:
+            self.watched[alert_id] = handler
+
+    def unwatch(self, alert_id):
+        with self.lock:
+            self.watched.pop(alert_id, None)
+
+    def _poll(self):
+        params = {"timeout": self.poll_timeout}
+        if self.cursor is not None:
+            params["since"] = self.cursor
+        r = self.session.get(f"{self.backend}/api/alerts/changes", params=params, timeout=self.poll_timeout + 10)
+        if r.status_code != 200:
+            raise IOError(f"change feed returned {r.status_code}")
+        data = r.json()
+        for ch in data.get("changes", []):
+            self.events_seen += 1
+            CHANGES.inc()
+            with self.lock:
+                handler = self.watched.get(ch["id"])
+            if handler is not None:
+                try:
+                    handler.on_status(ch["id"], ch["status"])
+                except Exception as e:
+                    log.error("on_status failed", aid=ch["id"], error=e)
+        self.cursor = data.get("cursor", self.cursor)
+
+    def run(self):
+        backoff = RECONNECT_MIN
+        while not self.shutdown_flag.is_set():
+            try:
+                self._poll()
+                self.healthy = True
+                HEALTHY.set(1)
+                backoff = RECONNECT_MIN
+            except Exception as e:
+                if self.healthy:
+                    log.warning("feed lost, falling back to status polling", error=e)
+                self.healthy = False
+                HEALTHY.set(0)
+                self.shutdown_flag.wait(backoff)
+                backoff = min(RECONNECT_MAX, backoff * 2)
+
+    def stop(self):
+        self.shutdown_flag.set()
@@ -0,0 +1,392 @@
+"""
+Multi-process runtime for yolo_multi_alert.
+- Cameras are spread over WORKER_PROCESSES camera processes. Each one runs
+  the usual CameraWorker threads (decode, ring, motion gate, event logic) with
+  its own Dispatcher (outbox-<n>.db) and StatusFeed, so the per-frame Python
+  work of different cameras no longer shares one GIL.
+- Inference runs in one process per model path (inference_proc.serve). Every
+  camera has a shared-memory FrameSlots block created here; the camera resizes
+  its frame (or each of its ROI / tile crops) into a slot and the inference
+  process reads it as a NumPy view.
+- The supervisor restarts crashed processes (with backoff) and, from the
+  per-camera CPU load the camera processes report, moves one camera at a time
+  from the busiest to the idlest process. Cameras with events, alerts, clips
+  or outbox jobs outstanding stay put: that state belongs to their process.
+- All IPC runs over per-pair Pipes (supervisor <-> camera process, camera
+  process <-> inference process) rather than shared Queues: a process killed
+  while reading a Queue leaves its lock held, which would hang its
+  replacement. A restarted process just gets new pipes.
+- Every process serves its own /metrics: the supervisor on METRICS_PORT,
+  camera process n on METRICS_PORT + 1 + n, then one port per inference process.
+"""
+import os, time, signal
+import multiprocessing as mp
+import metrics
+from shm_frames import FrameSlots, SLOTS_PER_CAMERA
+from tiling import slots_for
+from frame_scheduler import SCHEDULER
+from inference_proc import serve, ResultRouter, RemoteInference
+
+# Crashed processes are restarted after a backoff that doubles up to the max;
+# it resets once a process stayed up RESTART_STABLE_SECONDS
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 30.0
+RESTART_STABLE_SECONDS = 60
+# Camera processes report per-camera CPU load this often
+REPORT_INTERVAL = 5
+# Move a camera when the busiest and idlest process differ by more than
+# REBALANCE_MIN_GAP cores; at most one move per REBALANCE_INTERVAL
+REBALANCE_INTERVAL = 30
+REBALANCE_MIN_GAP = 0.3
+
+log = metrics.get_logger("supervisor")
+RESTARTS = metrics.counter("supervisor_restarts_total", "Process restarts", ("process",))
+PROC_LOAD = metrics.gauge("supervisor_process_cpu_cores", "CPU load reported by each camera process", ("process",))
+CAM_LOAD = metrics.gauge("supervisor_camera_cpu_cores", "CPU load of each camera's threads", ("camera",))
+
+
+def _outbox_path(base, proc_idx):
+    root, ext = os.path.splitext(base)
+    return f"{root}-{proc_idx}{ext or '.db'}"
+
+
+def _report(conn, msg):
+    try:
+        conn.send(msg)
+    except OSError:
+        pass          # supervisor is gone; the next recv() stops the process
+
+
+def _terminate(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _metrics_port(app, offset):
+    return app.METRICS_PORT + offset if app.METRICS_PORT else 0
+
+
+def inference_process(model_path, inbox, max_batch, max_wait_ms, metrics_port=0):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # the supervisor handles Ctrl+C
+    serve(model_path, inbox, max_batch, max_wait_ms, metrics_port)
+
+
+def camera_process(proc_idx, cameras, slot_specs, cam_ids, control, channels):
+    """Runs the cameras cam_ids (indexes into cameras) as CameraWorker threads.
+    control is the pipe to the supervisor: commands ("add", cam_id), ("remove", cam_id),
+    ("connect", model_path, conn), ("stop",) in; ("load", ...) / ("removed", cam_id) /
+    ("kept", cam_id) out.
+    channels: model_path -> pipe to that model's inference process."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import yolo_multi_alert as app
+    from dispatcher import Dispatcher
+    from status_feed import StatusFeed
+
+    name = f"proc-{proc_idx}"
+    plog = log.bind(process=name)
+    if app.METRICS_PORT:
+        metrics.serve_metrics(_metrics_port(app, 1 + proc_idx))
+    router = ResultRouter(proc_idx, channels)
+    router.start()
+    dispatcher = Dispatcher(app.BACKEND, outbox_path=_outbox_path(app.DISPATCH_OUTBOX, proc_idx),
+                            workers=app.DISPATCH_WORKERS, max_jobs=app.DISPATCH_MAX_JOBS)
+    status_feed = StatusFeed(app.BACKEND)
+    status_feed.start()
+    workers = {}
+
+    def make_worker(cam_id):
+        slots = FrameSlots.attach(slot_specs[cam_id])
+        inference = lambda path: RemoteInference(path, router, slots)
+        return app.CameraWorker(cameras[cam_id], dispatcher, status_feed, inference=inference, frame_slots=slots)
+
+    def remove(cam_id):
+        w = workers.pop(cam_id, None)
+        if w is None:
+            return
+        w.shutdown_flag.set()
+        w.join(timeout=5)
+        dispatcher.unregister(w.device_id)
+        w.frame_slots.close()
+
+    # handlers are registered before the dispatcher delivers leftover outbox jobs
+    for cam_id in cam_ids:
+        workers[cam_id] = make_worker(cam_id)
+    dispatcher.start()
+    for w in workers.values():
+        w.start()
+    plog.info("running cameras", pid=os.getpid(), cameras=sorted(workers))
+
+    last_report = time.time()
+    last_cpu = {}
+    last_proc_cpu = time.process_time()
+    last_stats = time.time()
+    while True:
+        try:
+            cmd = control.recv() if control.poll(1.0) else None
+        except (EOFError, OSError):
+            cmd = ("stop",)       # supervisor is gone
+        if cmd is not None:
+            if cmd[0] == "stop":
+                break
+            if cmd[0] == "add" and cmd[1] not in workers:
+                w = workers[cmd[1]] = make_worker(cmd[1])
+                w.start()
+                plog.info("took over camera", camera=w.name)
+            elif cmd[0] == "remove":
+                w = workers.get(cmd[1])
+                if w is not None and w.outstanding():
+                    # got busy since the last load report: moving would drop its alerts / clips
+                    _report(control, ("kept", proc_idx, cmd[1]))
+                else:
+                    remove(cmd[1])
+                    _report(control, ("removed", proc_idx, cmd[1]))
+            elif cmd[0] == "connect":
+                router.connect(cmd[1], cmd[2])
+
+        now = time.time()
+        if now - last_report >= REPORT_INTERVAL:
+            dt = now - last_report
+            loads, busy = {}, {}
+            for cam_id, w in workers.items():
+                loads[cam_id] = (w.cpu_seconds - last_cpu.get(cam_id, 0.0)) / dt
+                last_cpu[cam_id] = w.cpu_seconds
+                busy[cam_id] = w.outstanding() > 0
+            proc_cpu = time.process_time()
+            _report(control, ("load", proc_idx, loads, (proc_cpu - last_proc_cpu) / dt, busy))
+            last_proc_cpu = proc_cpu
+            last_report = now
+        if app.STATS_INTERVAL and now - last_stats >= app.STATS_INTERVAL:
+            last_stats = now
+            plog.info("dispatcher stats", **dispatcher.stats())
+            plog.info("scheduler stats", **SCHEDULER.stats())
+            for w in workers.values():
+                w.log.info("stats", **w.stats())
+
+    for cam_id in list(workers):
+        remove(cam_id)
+    status_feed.stop()
+    dispatcher.stop()
+    router.shutdown_flag.set()
+    plog.info("dispatcher final stats", **dispatcher.stats())
+
+
+class Supervisor:
+    def __init__(self, cameras, processes):
+        import yolo_multi_alert as app
+        self.app = app
+        self.ctx = mp.get_context("spawn")   # safe with threads, CUDA and on Windows
+        self.cameras = list(cameras)
+        self.nproc = max(1, min(processes, len(self.cameras)))
+        # ROI / tiled cameras need a set of slots for every crop of a frame
+        self.slots = [FrameSlots(nslots=slots_for(c, SLOTS_PER_CAMERA)) for c in self.cameras]
+        self.slot_specs = [s.spec() for s in self.slots]
+        self.model_paths = sorted({app.camera_model_path(c) for c in self.cameras})
+        self.inbox = {}              # model_path -> pipe into that inference process
+        self.control = {}            # proc idx -> pipe to that camera process
+        # cameras round-robin over the processes to start with
+        self.assign = {i: [c for c in range(len(self.cameras)) if c % self.nproc == i] for i in range(self.nproc)}
+        self.cam_load = {}
+        self.cam_busy = {}           # cam_id -> has outstanding alerts / clips / jobs (not movable)
+        self.proc_load = {}
+        self.moving = {}             # cam_id -> (from, to) while the source process lets go of it
+        self.procs = {}              # key -> Process; key is ("infer", path) or ("cam", idx)
+        self.started = {}
+        self.backoff = {}
+        self.restart_at = {}
+        self.restarts = {}
+        self.last_rebalance = time.time()
+
+    # ----- process management -----
+    def _alive(self, key):
+        p = self.procs.get(key)
+        return p is not None and p.is_alive()
+
+    def _send(self, conn, msg):
+        try:
+            conn.send(msg)
+            return True
+        except (OSError, EOFError):
+            return False      # the other side died; it gets new pipes on restart
+
+    def _pair(self, idx, path):
+        """New pipe between camera process idx and the model's inference process;
+        the inference end is handed over right away, the camera end is returned."""
+        cam_end, infer_end = self.ctx.Pipe()
+        self._send(self.inbox[path], ("connect", idx, infer_end))
+        infer_end.close()
+        return cam_end
+
+    def _spawn(self, key):
+        if key[0] == "infer":
+            path = key[1]
+            old = self.inbox.get(path)
+            if old is not None:
+                old.close()
+            inbox_r, self.inbox[path] = self.ctx.Pipe(duplex=False)
+            port = _metrics_port(self.app, 1 + self.nproc + self.model_paths.index(path))
+            p = self.ctx.Process(target=inference_process, name=f"infer-{path}", daemon=True,
+                                 args=(path, inbox_r, self.app.INFER_MAX_BATCH, self.app.INFER_MAX_WAIT_MS, port))
+            p.start()
+            inbox_r.close()
+            # running camera processes switch to a pipe to the new process
+            for idx in range(self.nproc):
+                if self._alive(("cam", idx)):
+                    cam_end = self._pair(idx, path)
+                    self._send(self.control[idx], ("connect", path, cam_end))
+                    cam_end.close()
+        else:
+            idx = key[1]
+            old = self.control.get(idx)
+            if old is not None:
+                old.close()
+            self.control[idx], child_end = self.ctx.Pipe()
+            channels = {path: self._pair(idx, path) for path in self.model_paths}
+            p = self.ctx.Process(target=camera_process, name=f"proc-{idx}", daemon=True,
+                                 args=(idx, self.cameras, self.slot_specs, list(self.assign[idx]),
+                                       child_end, channels))
+            p.start()
+            child_end.close()
+            for conn in channels.values():
+                conn.close()
+        self.procs[key] = p
+        self.started[key] = time.time()
+
+    def _check_processes(self):
+        now = time.time()
+        for key, p in list(self.procs.items()):
+            if p is not None and p.is_alive():
+                if now - self.started[key] > RESTART_STABLE_SECONDS:
+                    self.backoff[key] = RESTART_BACKOFF_MIN
+                continue
+            if p is not None:
+                # died: schedule a restart
+                delay = self.backoff.get(key, RESTART_BACKOFF_MIN)
+                log.warning("process exited, restarting", process=p.name, pid=p.pid, exitcode=p.exitcode,
+                            delay=round(delay))
+                RESTARTS.labels(p.name).inc()
+                self.procs[key] = None
+                self.restart_at[key] = now + delay
+                self.backoff[key] = min(delay * 2, RESTART_BACKOFF_MAX)
+                self.restarts[key] = self.restarts.get(key, 0) + 1
+            elif now >= self.restart_at.get(key, 0):
+                if key[0] == "cam":
+                    self._before_restart(key[1])
+                self._spawn(key)
+
+    def _before_restart(self, idx):
+        # the replacement starts from self.assign; finish moves it was in the middle of
+        for cam_id, (src, dst) in list(self.moving.items()):
+            if src == idx:
+                self._finish_move(cam_id)
+
+    # ----- load balancing -----
+    def _drain_reports(self):
+        for idx, conn in self.control.items():
+            try:
+                while conn.poll(0):
+                    self._on_report(conn.recv())
+            except (EOFError, OSError):
+                pass          # died; _check_processes restarts it
+
+    def _on_report(self, msg):
+        if msg[0] == "load":
+            _, idx, loads, proc_load, busy = msg
+            self.cam_load.update(loads)
+            self.cam_busy.update(busy)
+            self.proc_load[idx] = proc_load
+            PROC_LOAD.labels(f"proc-{idx}").set(proc_load)
+            for cam_id, load in loads.items():
+                CAM_LOAD.labels(self.cameras[cam_id].get("device_id", cam_id)).set(load)
+        elif msg[0] == "removed" and msg[2] in self.moving:
+            self._finish_move(msg[2])
+        elif msg[0] == "kept" and msg[2] in self.moving:
+            src, _ = self.moving.pop(msg[2])
+            self.assign[src].append(msg[2])
+            self.cam_busy[msg[2]] = True
+
+    def _finish_move(self, cam_id):
+        src, dst = self.moving.pop(cam_id)
+        self.assign[dst].append(cam_id)
+        self._send(self.control[dst], ("add", cam_id))
+        log.info("moved camera", camera=cam_id, src=f"proc-{src}", dst=f"proc-{dst}")
+
+    def _rebalance(self):
+        if self.nproc < 2 or self.moving:
+            return
+        loads = {i: sum(self.cam_load.get(c, 0.0) for c in cams) for i, cams in self.assign.items()}
+        busiest = max(loads, key=loads.get)
+        idlest = min(loads, key=loads.get)
+        gap = loads[busiest] - loads[idlest]
+        if gap < REBALANCE_MIN_GAP or len(self.assign[busiest]) < 2:
+            return
+        movable = [c for c in self.assign[busiest] if not self.cam_busy.get(c)]
+        if not movable:
+            return
+        # the camera whose load best halves the gap; never one that would just flip it
+        cam_id = min(movable, key=lambda c: abs(self.cam_load.get(c, 0.0) - gap / 2))
+        if self.cam_load.get(cam_id, 0.0) >= gap:
+            return
+        self.assign[busiest].remove(cam_id)
+        self.moving[cam_id] = (busiest, idlest)
+        self._send(self.control[busiest], ("remove", cam_id))
+
+    def stats(self):
+        out = {}
+        for idx, cams in self.assign.items():
+            p = self.procs.get(("cam", idx))
+            out[f"proc-{idx}"] = {
+                "pid": p.pid if p is not None else None,
+                "cameras": [self.cameras[c].get("device_id", c) for c in cams],
+                "cpu_load": round(self.proc_load.get(idx, 0.0), 2),
+                "restarts": self.restarts.get(("cam", idx), 0),
+            }
+        for path in self.model_paths:
+            out[f"infer-{path}"] = {"restarts": self.restarts.get(("infer", path), 0)}
+        return out
+
+    # ----- main loop -----
+    def run(self):
+        signal.signal(signal.SIGTERM, _terminate)   # stop cleanly under a service manager too
+        if self.app.METRICS_PORT:
+            metrics.serve_metrics(self.app.METRICS_PORT)
+        for path in self.model_paths:
+            self._spawn(("infer", path))
+        for idx in range(self.nproc):
+            self._spawn(("cam", idx))
+        log.info("started, press Ctrl+C to stop", cameras=len(self.cameras), processes=self.nproc,
+                 inference=len(self.model_paths))
+        try:
+            last_stats = time.time()
+            while True:
+                time.sleep(1)
+                self._drain_reports()
+                self._check_processes()
+                now = time.time()
+                if now - self.last_rebalance >= REBALANCE_INTERVAL:
+                    self.last_rebalance = now
+                    self._rebalance()
+                if self.app.STATS_INTERVAL and now - last_stats >= self.app.STATS_INTERVAL:
+                    last_stats = now
+                    log.info("stats", **self.stats())
+        except KeyboardInterrupt:
+            log.info("shutdown requested, stopping processes")
+        self.shutdown()
+
+    def shutdown(self, timeout=10):
+        cams = [p for k, p in self.procs.items() if k[0] == "cam" and p is not None]
+        for conn in self.control.values():
+            self._send(conn, ("stop",))
+        for p in cams:
+            p.join(timeout=timeout)
+        for conn in self.inbox.values():
+            self._send(conn, None)
+        for k, p in self.procs.items():
+            if p is None:
+                continue
+            if k[0] == "infer":
+                p.join(timeout=timeout)
+            if p.is_alive():
+                p.terminate()
+        for s in self.slots:
+            s.close()
+            s.unlink()
+        log.info("all processes stopped, exiting")
@@ -0,0 +1,189 @@
+"""
+Dispatcher outbox, retries and idempotent alert delivery against a fake backend
+(python -m pytest test_dispatcher.py).
+"""
+from json import dumps, loads
+import pytest
+import dispatcher as dmod
+from dispatcher import Dispatcher, Outbox
+
+
+class Resp:
+    def __init__(self, status, body=None):
+        self.status_code = status
+        self.body = body or {}
+        self.text = dumps(self.body)
+
+    def json(self):
+        return self.body
+
+
+class FakeBackend:
+    """Stands in for requests.Session: answers /api/alerts(/bulk) like the backend,
+    including returning the same id for a repeated idempotency_key."""
+
+    def __init__(self):
+        self.calls = []
+        self.by_key = {}
+        self.fail_next = 0
+        self.bulk = True
+
+    def _alert(self, meta):
+        key = meta.get("idempotency_key")
+        if key not in self.by_key:
+            self.by_key[key] = f"id{len(self.by_key)}"
+        return self.by_key[key]
+
+    def post(self, url, data=None, files=None, json=None, timeout=None):
+        self.calls.append(url)
+        if self.fail_next:
+            self.fail_next -= 1
+            return Resp(503)
+        if url.endswith("/api/alerts"):
+            return Resp(201, {"id": self._alert(data)})
+        if url.endswith("/api/alerts/bulk"):
+            if not self.bulk:
+                return Resp(404)
+            items = loads(data["alerts"])
+            return Resp(201, {"ids": [self._alert(it) for it in items]})
+        return Resp(404)
+
+
+class Handler:
+    def __init__(self):
+        self.posted, self.uploaded = [], []
+
+    def on_alert_posted(self, event_key, aid):
+        self.posted.append((event_key, aid))
+
+    def on_uploaded(self, aid, ok):
+        self.uploaded.append((aid, ok))
+
+
+@pytest.fixture
+def disp(tmp_path):
+    d = Dispatcher("http://backend", outbox_path=str(tmp_path / "outbox.db"), max_jobs=10)
+    d.session = FakeBackend()
+    d.handler = Handler()
+    d.register("cam", d.handler)
+    return d
+
+
+def deliver(d):
+    """One pass of the dispatcher loop over every due job, without the threads."""
+    while True:
+        job = d.outbox.claim()
+        if job is None:
+            return
+        batch = [job] + (d.outbox.claim_more("alert", dmod.ALERT_BULK_MAX - 1) if job["kind"] == "alert" else [])
+        oks = d._do_alert_bulk(batch) if len(batch) > 1 else [getattr(d, "_do_" + job["kind"])(job)]
+        for j, ok in zip(batch, oks):
+            d._finish(j, ok)
+
+
+# ---------- outbox ----------
+
+def test_outbox_dedupe_and_order(tmp_path):
+    box = Outbox(str(tmp_path / "o.db"), 10)
+    a, _ = box.put("status", "cam", {"alert_ids": ["x"]}, dedupe_key="status|cam")
+    dup, _ = box.put("status", "cam", {"alert_ids": ["y"]}, dedupe_key="status|cam")
+    b, _ = box.put("alert", "cam", {"cls": "knife"}, blob=b"jpeg")
+    assert a and dup is None and b
+    first = box.claim()
+    assert first["id"] == a and box.claim()["blob"] == b"jpeg"
+    assert box.claim() is None          # both in flight
+    box.retry(a, 1, 60.0)
+    assert box.claim() is None          # backing off
+    assert box.pending("cam") == 2 and box.depth() == {"status": 1, "alert": 1}
+
+
+def test_outbox_survives_a_restart(tmp_path):
+    path = str(tmp_path / "o.db")
+    Outbox(path, 10).put("alert", "cam", {"cls": "knife"})
+    assert Outbox(path, 10).claim()["payload"] == {"cls": "knife"}
+
+
+def test_full_outbox_evicts_status_then_uploads_never_alerts(tmp_path):
+    box = Outbox(str(tmp_path / "o.db"), 3)
+    box.put("upload", "cam", {"alert_id": "a1", "path": "x.json"})
+    box.put("status", "cam", {"alert_ids": []})
+    box.put("alert", "cam", {})
+    _, evicted = box.put("alert", "cam", {})
+    assert evicted["kind"] == "status"
+    _, evicted = box.put("alert", "cam", {})
+    assert evicted == {"kind": "upload", "device_id": "cam", "payload": {"alert_id": "a1", "path": "x.json"}}
+    jid, evicted = box.put("alert", "cam", {})              # only alerts left: queued past the bound
+    assert jid and evicted is None and box.depth() == {"alert": 4}
+    jid, evicted = box.put("upload", "cam", {"alert_id": "a2", "path": "y.json"})
+    assert jid is None and evicted["payload"]["alert_id"] == "a2"
+
+
+def test_evicted_upload_is_reported_to_the_camera(disp, tmp_path):
+    disp.outbox.max_jobs = 1
+    disp.upload_clip("cam", "a1", str(tmp_path / "clip.json"))
+    disp.post_alert("cam", "e1", {}, b"jpeg")
+    assert disp.handler.uploaded == [("a1", False)]
+
+
+# ---------- delivery ----------
+
+def test_alert_carries_a_stable_idempotency_key(disp, monkeypatch):
+    monkeypatch.setattr(dmod, "BACKOFF_BASE", 0.0)
+    disp.post_alert("cam", "e1", {"cls": "knife"}, b"jpeg")
+    disp.session.fail_next = 1
+    job = disp.outbox.claim()
+    key = job["payload"]["idempotency_key"]
+    disp._finish(job, disp._do_alert(job))                   # 503: retried later
+    job = disp.outbox.claim()
+    assert job["attempts"] == 1 and job["payload"]["idempotency_key"] == key
+    assert disp._do_alert(job)
+    assert disp._do_alert(job)                               # a retry after a lost response
+    assert disp.handler.posted == [("e1", "id0"), ("e1", "id0")]
+    assert list(disp.session.by_key) == [key]
+
+
+def test_keys_differ_per_alert(disp):
+    disp.post_alert("cam", "e1", {}, None)
+    disp.post_alert("cam", "e2", {}, None)
+    jobs = [disp.outbox.claim(), disp.outbox.claim()]
+    assert jobs[0]["payload"]["idempotency_key"] != jobs[1]["payload"]["idempotency_key"]
+
+
+def test_backlog_goes_out_in_one_bulk_request(disp):
+    for i in range(5):
+        disp.post_alert("cam", f"e{i}", {"cls": "knife"}, b"jpeg")
+    deliver(disp)
+    assert disp.session.calls == ["http://backend/api/alerts/bulk"]
+    assert [k for k, _ in disp.handler.posted] == [f"e{i}" for i in range(5)]
+    assert disp.outbox.depth() == {}
+
+
+def test_bulk_falls_back_to_single_posts(disp):
+    disp.session.bulk = False
+    for i in range(3):
+        disp.post_alert("cam", f"e{i}", {}, None)
+    deliver(disp)
+    assert disp.session.calls.count("http://backend/api/alerts") == 3
+    assert len(disp.handler.posted) == 3
+
+
+def test_bulk_counts_only_alerts_that_got_an_id(disp, monkeypatch):
+    for i in range(3):
+        disp.post_alert("cam", f"e{i}", {}, None)
+    jobs = [disp.outbox.claim()] + disp.outbox.claim_more("alert", 5)
+    monkeypatch.setattr(disp.session, "post", lambda *a, **kw: Resp(201, {"ids": ["x0", None]}))
+    assert disp._do_alert_bulk(jobs) == [True, False, False]
+    assert disp.handler.posted == [("e0", "x0")]
+
+
+def test_upload_gives_up_and_tells_the_camera(disp, tmp_path, monkeypatch):
+    monkeypatch.setattr(dmod, "MAX_ATTEMPTS", dict(dmod.MAX_ATTEMPTS, upload=2))
+    monkeypatch.setattr(dmod, "BACKOFF_BASE", 0.0)
+    clip = tmp_path / "clip.mp4"
+    clip.write_bytes(b"mp4")
+    disp.upload_clip("cam", "a1", str(clip))
+    for _ in range(2):
+        disp._finish(disp.outbox.claim(), False)
+    assert disp.handler.uploaded == [("a1", False)]
+    assert disp.pending("cam") == 0
+    assert clip.exists()                                     # kept for a later attempt by hand
@@ -0,0 +1,95 @@
+"""
+EventTracker on synthetic detection streams (python -m pytest test_event_tracker.py).
+"""
+import numpy as np
+from event_tracker import EventTracker
+from motion_gate import MotionGate
+
+NAMES = {0: "guns", 1: "knife", 2: "person"}
+
+
+def tracker(**kw):
+    kw.setdefault("confirm_seconds", 0.2)
+    kw.setdefault("release_seconds", 1.0)
+    kw.setdefault("rearm_seconds", 2.0)
+    return EventTracker(NAMES, {"guns", "knife"}, 0.5, 10.0, **kw)
+
+
+def feed(t, stream):
+    """stream: [(now, [(cls, conf), ...])] -> [(now, class name)] of opened events."""
+    opened = []
+    for now, boxes in stream:
+        cls = np.array([b[0] for b in boxes], np.float32)
+        conf = np.array([b[1] for b in boxes], np.float32)
+        opened += [(now, name) for _, name, _ in t.update(cls, conf, now)]
+    return opened
+
+
+def frames(start, end, fps, boxes):
+    return [(start + i / fps, boxes) for i in range(int(round((end - start) * fps)))]
+
+
+def test_confirms_after_confirm_seconds():
+    t = tracker()
+    opened = feed(t, frames(0.0, 1.0, 10, [(1, 0.9)]))
+    assert opened == [(0.2, "knife")]
+
+
+def test_ignores_non_targets_and_low_confidence():
+    t = tracker()
+    assert feed(t, frames(0.0, 2.0, 10, [(2, 0.99), (1, 0.3)])) == []
+
+
+def test_single_frame_never_confirms():
+    t = tracker()
+    assert feed(t, [(0.0, [(0, 0.9)]), (5.0, [(0, 0.9)]), (10.0, [(0, 0.9)])]) == []
+
+
+def test_gaps_within_release_keep_the_sighting():
+    t = tracker(confirm_seconds=1.0)
+    # seen every 0.8 s: each gap is shorter than release_seconds
+    opened = feed(t, [(i * 0.8, [(1, 0.9)]) for i in range(3)])
+    assert opened == [(1.6, "knife")]
+
+
+def test_gap_longer_than_release_restarts_the_sighting():
+    t = tracker(confirm_seconds=1.0)
+    opened = feed(t, [(0.0, [(1, 0.9)]), (0.9, [(1, 0.9)]), (2.5, [(1, 0.9)]), (3.0, [(1, 0.9)]),
+                      (3.5, [(1, 0.9)])])
+    assert opened == [(3.5, "knife")]
+
+
+def test_event_suppresses_then_rearms():
+    t = tracker()
+    assert feed(t, frames(0.0, 1.0, 10, [(1, 0.9)])) == [(0.2, "knife")]
+    # still in view during the event window: no second event
+    assert feed(t, frames(1.0, 10.0, 10, [(1, 0.9)])) == []
+    assert t.expire(10.5) == ["knife"]
+    # re-armed only rearm_seconds after the event ended
+    assert feed(t, frames(10.5, 12.5, 10, [(1, 0.9)])) == []
+    opened = feed(t, frames(12.5, 13.0, 10, [(1, 0.9)]))
+    assert len(opened) == 1 and opened[0][0] >= 12.5
+
+
+def still_target(hold):
+    """A knife lying still in a static scene behind the motion gate; events opened."""
+    gate = MotionGate(idle_interval=2.0, hold_seconds=3.0)
+    frame = np.zeros((48, 64, 3), np.uint8)
+    gate.should_infer(frame, 1.0)        # background; the scene is static from 4 s on
+    t = tracker()
+    opened = []
+    for i in range(100):
+        now = 10.0 + i / 10.0
+        if gate.should_infer(frame, now):
+            gate.record_inference(0.01, now)
+            opened += feed(t, [(now, [(1, 0.9)])])
+            if hold and t.last_sighting() == now:
+                gate.hold(now)
+    return opened
+
+
+def test_still_target_behind_motion_gate_confirms():
+    # heartbeats alone are further apart than release_seconds: never confirmed
+    assert still_target(hold=False) == []
+    now, name = still_target(hold=True)[0]
+    assert name == "knife" and now < 10.5
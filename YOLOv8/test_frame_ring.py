@@ -0,0 +1,127 @@
+"""
+JpegRing / ArenaRing windowing, budgets and clip references (python -m pytest test_frame_ring.py).
+"""
+import numpy as np
+import cv2
+import pytest
+from frame_ring import JpegRing, ArenaRing, MemoryBudget, make_ring, measured_fps
+
+SHAPE = (48, 64, 3)
+
+
+def frame(v):
+    return np.full(SHAPE, v, np.uint8)
+
+
+def fill(ring, n, fps=10, start=100.0):
+    for i in range(n):
+        ring.append(frame=frame(i % 250), ts=start + i / fps)
+
+
+def mean(jpeg):
+    return cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR).mean()
+
+
+@pytest.fixture(params=["jpeg", "arena"])
+def ring(request):
+    budget = MemoryBudget(None)
+    if request.param == "jpeg":
+        return JpegRing(2.0, process_budget=budget)
+    return ArenaRing(2.0, max_fps=10, shape=SHAPE, process_budget=budget)
+
+
+def test_keeps_only_the_last_seconds(ring):
+    fill(ring, 50)                      # 5 s at 10 fps
+    ts = [t for t, _ in ring.encoded()]
+    assert ts[0] >= ts[-1] - 2.0 - 1e-9
+    assert ts[-1] == pytest.approx(104.9)
+    assert ts == sorted(ts)
+
+
+def test_arena_drops_frames_older_than_seconds_after_a_rate_drop():
+    ring = ArenaRing(2.0, max_fps=10, shape=SHAPE, process_budget=MemoryBudget(None))
+    fill(ring, 20, fps=10, start=100.0)         # fills the 20 slots
+    fill(ring, 3, fps=1, start=110.0)           # slow frames: the old ones are out of the window
+    assert [t for t, _ in ring.encoded()] == [110.0, 111.0, 112.0]
+
+
+def test_encoded_since(ring):
+    fill(ring, 20)
+    recs = ring.encoded(since=101.0)
+    assert recs[0][0] == pytest.approx(101.0)
+    assert all(isinstance(j, bytes) for _, j in recs)
+    # content survives the round trip (JPEG is lossy, flat frames nearly exact)
+    assert mean(recs[0][1]) == pytest.approx(10, abs=2)
+
+
+def test_refs_resolve_later(ring):
+    fill(ring, 20)
+    refs = ring.refs(since=101.5)
+    recs = ring.resolve(refs)
+    assert [t for t, _ in recs] == pytest.approx([101.5 + i / 10 for i in range(5)])
+
+
+def test_arena_skips_slots_overwritten_before_resolve():
+    ring = ArenaRing(2.0, max_fps=10, shape=SHAPE, process_budget=MemoryBudget(None))
+    fill(ring, 20)
+    refs = ring.refs()
+    fill(ring, 5, start=102.0)                  # overwrites the 5 oldest slots
+    recs = ring.resolve(refs)
+    assert len(recs) == 15
+    assert recs[0][0] == pytest.approx(100.5)
+
+
+def test_jpeg_ring_reuses_given_bytes():
+    ring = JpegRing(2.0, process_budget=MemoryBudget(None))
+    rec = ring.append(jpeg=b"\xff\xd8abc", ts=1.0)
+    assert ring.snapshot()[0] is rec and ring.nbytes == 5
+
+
+def test_jpeg_ring_camera_budget_evicts_oldest():
+    ring = JpegRing(100.0, budget_bytes=10, process_budget=MemoryBudget(None))
+    for i in range(5):
+        ring.append(jpeg=bytes(4), ts=1.0 + i)
+    assert len(ring) == 2 and ring.nbytes == 8
+    assert ring.evicted_for_budget == 3
+
+
+def test_jpeg_ring_process_budget_is_shared():
+    budget = MemoryBudget(12)
+    a, b = JpegRing(100.0, process_budget=budget), JpegRing(100.0, process_budget=budget)
+    for i in range(3):
+        a.append(jpeg=bytes(4), ts=1.0 + i)
+    b.append(jpeg=bytes(4), ts=1.0)           # a ring always keeps its newest frame
+    a.append(jpeg=bytes(4), ts=4.0)           # a makes room for b's share
+    assert budget.used <= 12 and len(a) == 2 and len(b) == 1
+    a.close()
+    b.close()
+    assert budget.used == 0
+
+
+def test_arena_is_sized_by_rate_and_budget():
+    budget = MemoryBudget(None)
+    ring = ArenaRing(3.0, max_fps=5, shape=SHAPE, process_budget=budget)
+    assert ring.maxlen == 15 and budget.used == ring.nbytes
+    small = ArenaRing(3.0, max_fps=5, shape=SHAPE, budget_bytes=4 * int(np.prod(SHAPE)), process_budget=budget)
+    assert small.maxlen == 4
+    ring.close()
+    ring.close()                                # only released once
+    assert budget.used == small.nbytes
+
+
+def test_arena_resizes_other_shapes():
+    ring = ArenaRing(1.0, max_fps=5, shape=SHAPE, process_budget=MemoryBudget(None))
+    ring.append(frame=np.zeros((480, 640, 3), np.uint8), ts=1.0)
+    assert len(ring) == 1
+
+
+def test_make_ring_modes():
+    assert isinstance(make_ring("jpeg", 1.0, process_budget=MemoryBudget(None)), JpegRing)
+    assert isinstance(make_ring("arena", 1.0, 5, shape=SHAPE, quality=70, process_budget=MemoryBudget(None)), ArenaRing)
+    with pytest.raises(ValueError):
+        make_ring("deque", 1.0)
+
+
+def test_measured_fps():
+    assert measured_fps([(0.0, None), (0.5, None), (1.0, None)]) == 2.0
+    assert measured_fps([(0.0, None)], default=7) == 7
@@ -0,0 +1,137 @@
+"""
+allocate(), Pace and the shedding step of FrameScheduler (python -m pytest test_frame_scheduler.py).
+"""
+import threading
+import pytest
+import frame_scheduler as fs
+from frame_scheduler import allocate, Pace, FrameScheduler
+
+
+def approx(values):
+    return pytest.approx(values, abs=1e-6)
+
+
+def test_allocate_splits_by_weight():
+    # floors first, the remaining 10 frames/s 1:2
+    assert allocate(12, [(1, 100, 1), (1, 100, 2)]) == approx([1 + 10 / 3, 1 + 20 / 3])
+
+
+def test_allocate_hands_capped_excess_to_the_others():
+    # the first camera caps at 3, the rest goes to the second
+    assert allocate(20, [(1, 3, 1), (1, 100, 1)]) == approx([3, 17])
+
+
+def test_allocate_stops_at_the_ceilings():
+    assert allocate(100, [(1, 5, 1), (2, 10, 3)]) == approx([5, 10])
+
+
+def test_allocate_always_grants_floors():
+    assert allocate(1, [(2, 10, 1), (3, 10, 1)]) == approx([2, 3])
+
+
+def test_allocate_zero_weights_share_evenly():
+    assert allocate(10, [(1, 10, 0), (1, 10, 0)]) == approx([5, 5])
+
+
+def pace(**kw):
+    kw.setdefault("camera", "test-cam")
+    kw.setdefault("fps", 10)
+    kw.setdefault("min_fps", 1)
+    kw.setdefault("max_fps", 20)
+    return Pace(**kw)
+
+
+def test_pace_ceiling_and_weight():
+    p = pace(priority=2.0)
+    assert (p.ceiling(), p.weight()) == (10, 2.0)
+    p.quiet = True
+    assert p.ceiling() == 10 * fs.SCHED_QUIET_FACTOR
+    p.hot = True
+    assert (p.ceiling(), p.weight()) == (20, 2.0 * fs.SCHED_HOT_WEIGHT)
+
+
+def test_pace_clamps_min_and_max_around_fps():
+    p = pace(fps=5, min_fps=8, max_fps=2)
+    assert (p.min_fps, p.max_fps) == (5, 5)
+
+
+def test_pace_wait_keeps_a_deadline_schedule():
+    p = pace(fps=50)
+    stop = threading.Event()
+    p.wait(stop)                      # first call starts the schedule
+    start = p.deadline
+    for _ in range(3):
+        p.wait(stop)
+    assert p.deadline == pytest.approx(start + 3 * 0.02)
+
+
+def test_pace_wait_restarts_when_far_behind(monkeypatch):
+    p = pace(fps=10)
+    p.deadline = 100.0
+    monkeypatch.setattr(fs.time, "time", lambda: 105.0)
+    p.wait(threading.Event())
+    assert p.deadline == pytest.approx(105.1)   # no burst of catch-up frames
+
+
+def test_pace_counts_late_and_dropped_frames():
+    p = pace(fps=10)
+    p.done(0.05)
+    p.done(0.5)          # overran the 0.1 s interval
+    p.dropped()
+    assert p.take(2.0) == (2, 2)
+    assert p.actual == 1.0
+    assert p.take(1.0) == (0, 0)
+
+
+def scheduler(*paces):
+    s = FrameScheduler()           # not started: rebalance() is driven by hand
+    for p in paces:
+        s.paces[p.camera] = p
+    return s
+
+
+def run(s, p, steps, cpu, frames=10, late=0):
+    for _ in range(steps):
+        for _ in range(frames):
+            p.done(0.2 if late else 0.0)
+            late = max(0, late - 1)
+        s.rebalance(1.0, cpu)
+
+
+def test_overload_sheds_then_recovers():
+    p = pace(camera="test-shed", fps=10)
+    s = scheduler(p)
+    run(s, p, 3, cpu=2.0)
+    assert s.level < 1.0 and s.shed_events == 1
+    assert p.min_fps <= p.target < 10
+    run(s, p, 30, cpu=0.1)
+    assert s.level == 1.0 and p.target == pytest.approx(10)
+
+
+def test_shedding_never_goes_below_the_floors():
+    a = pace(camera="test-a", fps=10, min_fps=4)
+    b = pace(camera="test-b", fps=10, min_fps=2)
+    s = scheduler(a, b)
+    for _ in range(40):
+        s.rebalance(1.0, 5.0)
+    assert a.target >= 4 - 1e-9 and b.target >= 2 - 1e-9
+    assert a.target + b.target == pytest.approx(6)
+
+
+def test_hot_camera_gets_the_budget_first():
+    hot = pace(camera="test-hot", fps=10, max_fps=20)
+    cold = pace(camera="test-cold", fps=10)
+    hot.hot = True
+    s = scheduler(hot, cold)
+    s.level, s.pressure = 0.5, 0.8
+    s.rebalance(1.0, 0.8)        # between the marks: level stays
+    assert hot.target > cold.target
+    assert hot.target + cold.target == pytest.approx((20 + 10) * 0.5)
+
+
+def test_register_rejects_non_positive_rates():
+    s = FrameScheduler()
+    with pytest.raises(ValueError):
+        s.register("test-bad", 0)
+    with pytest.raises(ValueError):
+        s.register("test-bad", 5, min_fps=0)
@@ -0,0 +1,98 @@
+"""
+TilePlan crops, box merging and nms (python -m pytest test_tiling.py).
+"""
+import numpy as np
+import pytest
+from tiling import TilePlan, nms, slots_for
+
+TILE = (640, 480)
+
+
+def boxes(*rows):
+    return np.array(rows, np.float32).reshape(-1, 6)
+
+
+def test_nms_keeps_the_most_confident_of_overlapping_boxes():
+    data = boxes([0, 0, 10, 10, 0.5, 1], [1, 1, 10, 10, 0.9, 1], [50, 50, 60, 60, 0.4, 1])
+    out = nms(data)
+    assert out[:, 4].tolist() == pytest.approx([0.9, 0.4])
+
+
+def test_nms_is_class_wise():
+    data = boxes([0, 0, 10, 10, 0.9, 0], [0, 0, 10, 10, 0.8, 1])
+    assert len(nms(data)) == 2
+
+
+def test_nms_merges_a_box_cut_at_a_tile_edge():
+    # the cut-off half lies inside the whole box: covered by intersection over the smaller box
+    data = boxes([100, 100, 200, 200, 0.8, 0], [100, 100, 150, 200, 0.7, 0])
+    out = nms(data)
+    assert len(out) == 1 and out[0].tolist() == pytest.approx([100, 100, 200, 200, 0.8, 0])
+
+
+def test_nms_small_inputs():
+    assert len(nms(boxes())) == 0
+    assert len(nms(boxes([0, 0, 1, 1, 0.5, 0]))) == 1
+
+
+def test_grid_covers_the_frame_with_overlap():
+    plan = TilePlan(tiles=[2, 2], overlap=0.2)
+    assert [c.name for c in plan.crops] == ["r0c0", "r0c1", "r1c0", "r1c1"]
+    a, b = plan.crops[0].rect, plan.crops[1].rect
+    assert a[0] == 0.0 and b[2] == pytest.approx(1.0)
+    assert (a[2] - b[0]) / (a[2] - a[0]) == pytest.approx(0.2)
+
+
+def test_tiles_touching_no_roi_are_masked():
+    plan = TilePlan(roi=[{"name": "door", "rect": [0.0, 0.0, 0.3, 0.3]}], tiles=[2, 2])
+    assert [c.name for c in plan.crops] == ["r0c0"]
+    assert plan.masked == 3
+    assert plan.crops[0].rois == [("door", 1.0)]
+
+
+def test_roi_without_tiles_is_its_own_crop():
+    plan = TilePlan(roi=[[0.5, 0.5, 1.0, 1.0]])
+    assert [(c.name, c.rect) for c in plan.crops] == [("roi0", (0.5, 0.5, 1.0, 1.0))]
+    assert plan.decode_size() == (1280, 960)
+
+
+def test_bad_roi_is_rejected():
+    with pytest.raises(ValueError):
+        TilePlan(roi=[[0.5, 0.5, 0.2, 1.0]])
+
+
+def test_merge_maps_crop_boxes_to_frame_coordinates():
+    plan = TilePlan(roi=[[0.5, 0.5, 1.0, 1.0]])
+    # a box in the middle of the crop (tile pixels) -> the middle of the bottom-right quarter
+    out = plan.merge([boxes([310, 230, 330, 250, 0.9, 0])], 2000, 1000)
+    assert out[0, :4].tolist() == pytest.approx([1484.375, 739.583, 1515.625, 760.417], abs=1e-2)
+
+
+def test_merge_deduplicates_across_tiles_and_drops_boxes_outside_rois():
+    plan = TilePlan(roi=[[0.0, 0.0, 1.0, 0.5]], tiles=[2, 1], overlap=0.5)
+    left, right = plan.crops
+    # one object in the overlap seen by both tiles, plus one centred below the ROI
+    def in_tile(crop, x1, y1, x2, y2, conf):
+        cx1, cy1, cx2, cy2 = crop.rect
+        sx, sy = TILE[0] / (cx2 - cx1), TILE[1] / (cy2 - cy1)
+        return [(x1 - cx1) * sx, (y1 - cy1) * sy, (x2 - cx1) * sx, (y2 - cy1) * sy, conf, 0]
+    obj = (0.45, 0.1, 0.55, 0.2)
+    below = (0.1, 0.8, 0.2, 0.9)
+    out = plan.merge([boxes(in_tile(left, *obj, 0.8), in_tile(left, *below, 0.9)),
+                      boxes(in_tile(right, *obj, 0.7))], 1000, 1000)
+    assert len(out) == 1
+    assert out[0].tolist() == pytest.approx([450, 100, 550, 200, 0.8, 0], abs=1e-2)
+
+
+def test_merge_of_no_boxes():
+    plan = TilePlan(tiles=[2, 2])
+    assert plan.merge([boxes()] * 4, 100, 100).shape == (0, 6)
+
+
+def test_cut_and_slots():
+    plan = TilePlan(tiles=[3, 2])
+    crops = plan.cut(np.zeros((1080, 1920, 3), np.uint8))
+    assert len(crops) == 6 and all(c.shape[0] > 0 and c.shape[1] > 0 for c in crops)
+    assert slots_for({"tiles": [3, 2]}, 4) == 24
+    assert slots_for({}, 4) == 4
+    assert not TilePlan().active
@@ -0,0 +1,236 @@
+"""
+Region-of-interest and tiled inference for high-resolution cameras.
+- By default a frame is squashed to 640x480 for the model, so on a 4K camera
+  a distant knife is a handful of pixels. Raising the resolution of the whole
+  frame costs too much; these restrict / split what the model looks at.
+- "roi" (per camera): the parts of the image that matter, as normalized
+  [x1, y1, x2, y2] rectangles or {"name": ..., "rect": [...]}. Without tiling
+  each ROI is cut from the frame at up to full resolution and inferred as a
+  crop of its own.
+- "tiles": [cols, rows] runs the model on a grid of overlapping crops
+  ("tile_overlap", default TILE_OVERLAP) of the full-resolution frame; tiles
+  that touch no ROI are skipped. All crops of a frame are submitted at once,
+  so they share an inference batch.
+- Boxes are mapped back to frame coordinates, dropped when their centre lies
+  outside every ROI and merged across crops by class-wise NMS in NumPy (a box
+  cut at a tile edge is mostly inside the whole box from the next tile).
+- Each crop's share of the frame's inference time, its frames and the boxes
+  it found are counted per crop and per ROI (metrics + camera stats), so a
+  tile that costs CPU and never finds anything shows up.
+"""
+import threading
+import numpy as np
+import cv2
+import metrics
+
+# Model input per crop; the shared-memory slot shape, so crops go in without a resize
+TILE_SIZE = (640, 480)
+TILE_OVERLAP = 0.2
+# Boxes of one class are merged when their intersection covers this much of the smaller one
+MERGE_OVERLAP = 0.6
+
+CROP_SECONDS = metrics.counter("camera_crop_inference_seconds_total", "Inference time attributed to each crop",
+                               ("camera", "crop"))
+CROP_FRAMES = metrics.counter("camera_crop_frames_total", "Frames inferred per crop", ("camera", "crop"))
+CROP_BOXES = metrics.counter("camera_crop_boxes_total", "Boxes a crop found (before merging)", ("camera", "crop"))
+ROI_SECONDS = metrics.counter("camera_roi_inference_seconds_total", "Inference time of the crops covering an ROI "
+                              "(split by overlap)", ("camera", "roi"))
+ROI_BOXES = metrics.counter("camera_roi_boxes_total", "Merged boxes centred in an ROI", ("camera", "roi"))
+TILES_MASKED = metrics.gauge("camera_tiles_masked", "Grid tiles skipped because they touch no ROI", ("camera",))
+
+
+def _rect(value):
+    x1, y1, x2, y2 = (float(v) for v in value)
+    if not (0.0 <= x1 < x2 <= 1.0 and 0.0 <= y1 < y2 <= 1.0):
+        raise ValueError(f"ROI / crop {value!r} is not a normalized [x1, y1, x2, y2] rectangle")
+    return x1, y1, x2, y2
+
+
+def _overlap(a, b):
+    """Area of the intersection of two normalized rectangles."""
+    return max(0.0, min(a[2], b[2]) - max(a[0], b[0])) * max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+
+
+def _axis(count, overlap):
+    """Start offsets and size of count windows covering [0, 1] with the given overlap."""
+    size = 1.0 / (count - (count - 1) * overlap)
+    step = size * (1.0 - overlap)
+    return [min(i * step, 1.0 - size) for i in range(count)], size
+
+
+def _numpy(x):
+    return x.cpu().numpy() if hasattr(x, "cpu") else np.asarray(x)
+
+
+def boxes_array(result):
+    """(n, 6) float32 x1 y1 x2 y2 conf cls from an ultralytics or RemoteResult result."""
+    b = result.boxes
+    if b is None or len(b) == 0:
+        return np.zeros((0, 6), np.float32)
+    return np.concatenate([_numpy(b.xyxy), _numpy(b.conf)[:, None], _numpy(b.cls)[:, None]], axis=1).astype(np.float32)
+
+
+def nms(data, overlap=MERGE_OVERLAP):
+    """Class-wise NMS on (n, 6) boxes; overlap is intersection over the smaller box."""
+    if len(data) < 2:
+        return data
+    data = data[np.argsort(-data[:, 4], kind="stable")]
+    # boxes of different classes are moved apart so they never intersect
+    b = data[:, :4] + data[:, 5:6] * (data[:, :4].max() + 1.0)
+    area = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    w = np.clip(np.minimum(b[:, None, 2], b[None, :, 2]) - np.maximum(b[:, None, 0], b[None, :, 0]), 0, None)
+    h = np.clip(np.minimum(b[:, None, 3], b[None, :, 3]) - np.maximum(b[:, None, 1], b[None, :, 1]), 0, None)
+    cover = (w * h) / np.maximum(np.minimum(area[:, None], area[None, :]), 1e-9)
+    keep = np.ones(len(data), bool)
+    for i in range(len(data)):
+        if keep[i]:
+            keep[i + 1:] &= cover[i, i + 1:] <= overlap
+    return data[keep]
+
+
+class Crop:
+    def __init__(self, name, rect, rois):
+        self.name = name
+        self.rect = rect          # normalized x1 y1 x2 y2
+        self.rois = rois          # [(roi name, share of this crop's cost)]
+
+
+class TilePlan:
+    """Which crops of a frame go to the model, and how their boxes come back."""
+
+    def __init__(self, roi=None, tiles=None, overlap=TILE_OVERLAP, tile_size=TILE_SIZE):
+        self.tile_size = tuple(tile_size)
+        self.rois = []
+        for i, r in enumerate(roi or []):
+            if isinstance(r, dict):
+                self.rois.append((str(r.get("name", f"roi{i}")), _rect(r["rect"])))
+            else:
+                self.rois.append((f"roi{i}", _rect(r)))
+        self.masked = 0
+        if tiles:
+            cols, rows = (int(v) for v in tiles)
+            xs, tw = _axis(cols, overlap)
+            ys, th = _axis(rows, overlap)
+            rects = [(f"r{r}c{c}", (x, y, x + tw, y + th)) for r, y in enumerate(ys) for c, x in enumerate(xs)]
+        else:
+            rects = list(self.rois)
+        self.crops = []
+        for name, rect in rects:
+            touched = [(roi, _overlap(rect, rr)) for roi, rr in self.rois]
+            touched = [(roi, a) for roi, a in touched if a > 0]
+            if self.rois and not touched:
+                self.masked += 1
+                continue
+            total = sum(a for _, a in touched)
+            self.crops.append(Crop(name, rect, [(roi, a / total) for roi, a in touched]))
+
+    @classmethod
+    def from_config(cls, cam_cfg):
+        return cls(cam_cfg.get("roi"), cam_cfg.get("tiles"), cam_cfg.get("tile_overlap", TILE_OVERLAP))
+
+    @property
+    def active(self):
+        return bool(self.crops)
+
+    def decode_size(self):
+        """Frame size at which every crop still has at least tile_size pixels."""
+        tw, th = self.tile_size
+        return (int(max(tw / (c.rect[2] - c.rect[0]) for c in self.crops)),
+                int(max(th / (c.rect[3] - c.rect[1]) for c in self.crops)))
+
+    def cut(self, frame):
+        """Views of frame for every crop (not yet resized to tile_size)."""
+        h, w = frame.shape[:2]
+        out = []
+        for c in self.crops:
+            x1, y1, x2, y2 = c.rect
+            out.append(frame[int(y1 * h):max(int(y1 * h) + 1, int(round(y2 * h))),
+                             int(x1 * w):max(int(x1 * w) + 1, int(round(x2 * w)))])
+        return out
+
+    def resize(self, crop):
+        return cv2.resize(crop, self.tile_size)
+
+    def merge(self, per_crop, width, height):
+        """Boxes of every crop (in tile_size pixels) -> (n, 6) boxes in a width x height frame."""
+        tw, th = self.tile_size
+        parts = []
+        for c, data in zip(self.crops, per_crop):
+            if not len(data):
+                continue
+            x1, y1, x2, y2 = c.rect
+            d = data.copy()
+            d[:, [0, 2]] = (x1 + d[:, [0, 2]] / tw * (x2 - x1)) * width
+            d[:, [1, 3]] = (y1 + d[:, [1, 3]] / th * (y2 - y1)) * height
+            parts.append(d)
+        if not parts:
+            return np.zeros((0, 6), np.float32)
+        data = np.concatenate(parts)
+        if self.rois:
+            data = data[self.in_roi(data, width, height).any(axis=1)]
+        return nms(data)
+
+    def in_roi(self, data, width, height):
+        """(n, rois) bool: box centre inside each ROI."""
+        cx = (data[:, 0] + data[:, 2]) / (2.0 * width)
+        cy = (data[:, 1] + data[:, 3]) / (2.0 * height)
+        r = np.array([rect for _, rect in self.rois], np.float32)
+        return ((cx[:, None] >= r[None, :, 0]) & (cx[:, None] < r[None, :, 2]) &
+                (cy[:, None] >= r[None, :, 1]) & (cy[:, None] < r[None, :, 3]))
+
+
+def slots_for(cam_cfg, per_frame):
+    """Shared-memory slots a camera needs: per_frame for every crop it infers."""
+    return per_frame * max(1, len(TilePlan.from_config(cam_cfg).crops))
+
+
+class CropCosts:
+    """Per-crop / per-ROI cost and yield of one camera's tiled inference."""
+
+    def __init__(self, camera, plan):
+        self.camera = camera
+        self.plan = plan
+        self.lock = threading.Lock()
+        self.crops = {c.name: {"frames": 0, "seconds": 0.0, "boxes": 0} for c in plan.crops}
+        self.rois = {name: {"seconds": 0.0, "boxes": 0} for name, _ in plan.rois}
+        self._m = {c.name: (CROP_FRAMES.labels(camera, c.name), CROP_SECONDS.labels(camera, c.name),
+                            CROP_BOXES.labels(camera, c.name)) for c in plan.crops}
+        self._m_roi = {name: (ROI_SECONDS.labels(camera, name), ROI_BOXES.labels(camera, name))
+                       for name, _ in plan.rois}
+        TILES_MASKED.labels(camera).set(plan.masked)
+
+    def add(self, seconds, per_crop, merged, width, height):
+        """One frame: its inference time (split evenly, the crops are the same size),
+        the boxes of every crop and the merged boxes."""
+        share = seconds / max(1, len(self.plan.crops))
+        in_roi = self.plan.in_roi(merged, width, height).sum(axis=0) if self.rois and len(merged) else None
+        with self.lock:
+            for c, data in zip(self.plan.crops, per_crop):
+                s = self.crops[c.name]
+                s["frames"] += 1
+                s["seconds"] += share
+                s["boxes"] += len(data)
+                frames, secs, boxes = self._m[c.name]
+                frames.inc()
+                secs.inc(share)
+                boxes.inc(len(data))
+                for roi, part in c.rois:
+                    self.rois[roi]["seconds"] += share * part
+                    self._m_roi[roi][0].inc(share * part)
+            if in_roi is not None:
+                for (name, _), n in zip(self.plan.rois, in_roi):
+                    self.rois[name]["boxes"] += int(n)
+                    self._m_roi[name][1].inc(int(n))
+
+    def close(self):
+        """Drop this camera's series (the camera moved or stopped)."""
+        for m in (CROP_SECONDS, CROP_FRAMES, CROP_BOXES, ROI_SECONDS, ROI_BOXES, TILES_MASKED):
+            m.remove_prefix(self.camera)
+
+    def stats(self):
+        with self.lock:
+            crops = {name: {"frames": s["frames"], "boxes": s["boxes"],
+                            "ms_per_frame": round(s["seconds"] / s["frames"] * 1000, 2) if s["frames"] else 0.0}
+                     for name, s in self.crops.items()}
+            rois = {name: {"seconds": round(s["seconds"], 2), "boxes": s["boxes"]} for name, s in self.rois.items()}
+        return {"crops": crops, "rois": rois, "masked_tiles": self.plan.masked}
@@ -1,24 +1,71 @@
 """
 Multi-camera YOLO alert sender.
 - Each camera runs in its own thread.
-- Uses snapshot (/shot.jpg) method for reliability.
-- One alert per EVENT_WINDOW_SECONDS per (device|location|class).
+- Frames come from a pluggable source (frame_sources.py): keep-alive /shot.jpg
+  poller (default), MJPEG /video stream, or file replay. Only the newest
+  frame is processed; stale ones are dropped.
+- One alert per EVENT_WINDOW_SECONDS per (device|location|class); gating and
+  debouncing of the detections live in EventTracker (event_tracker.py).
+- Cameras sharing a model_path share one batched InferenceService; the
+  runtime key picks the PyTorch weights or an export made with model_tool.py.
+- With WORKER_PROCESSES > 0 the cameras are spread over worker processes by
+  a supervisor (supervisor.py); frames reach the per-model inference process
+  through shared memory, crashed processes are restarted and cameras are
+  rebalanced by load. WORKER_PROCESSES = 0 runs everything as threads here.
+- Alerts, status checks and clip uploads go through a background Dispatcher
+  with a persistent outbox; the detection loop never waits on the backend.
+- Review decisions arrive through the backend change feed (StatusFeed);
+  the batch status lookup is only a fallback / periodic reconciliation.
+- The evidence clip is prepared when the event is created (pre-trigger
+  window + POST_SECONDS after it), so a confirmation just uploads it. Clips
+  are content-addressed segments (evidence_segments.py): overlapping clips
+  share them and the upload skips segments the backend already has.
+- A motion gate (motion_gate.py) skips inference on static scenes and goes
+  back to full rate as soon as something moves.
+- Per camera, fetch (source thread), decode/preprocess and inference/events
+  run as overlapping stages with a bounded queue in between; JPEGs are
+  decoded at reduced size when possible and resized once (pipeline.py).
+- Stage latencies, frame outcomes, ring occupancy and outstanding alerts are
+  metrics (metrics.py) served on /metrics at METRICS_PORT; logs are logfmt.
+- Cameras are paced on a deadline by a per-process FrameScheduler
+  (frame_scheduler.py) that sheds frames under CPU pressure by priority:
+  cameras with an active event / recent detection get up to max_fps, quiet
+  ones fewer. The evidence ring holds PRE_SECONDS of frames at any rate.
+- Per camera "roi" / "tiles" (tiling.py) run the model on full-resolution
+  crops instead of the squashed frame: the ROIs, or a grid of overlapping
+  tiles minus those outside every ROI, batched together and merged by NMS.
+  Crop / ROI cost and yield are metrics and part of the camera stats.
 """
-import time, os, base64, requests, cv2, uuid, threading
-import numpy as np
-from collections import deque
-from ultralytics import YOLO
+import time, cv2, threading
+import metrics
+from inference_service import get_inference_service, all_services, shutdown_all, resolve_model_path
+from inference_proc import RemoteResult
+from frame_sources import make_frame_source
+from frame_ring import make_ring, PROCESS_BUDGET
+from frame_scheduler import SCHEDULER, SCHED_HOT_SECONDS
+from dispatcher import Dispatcher
+from status_feed import StatusFeed
+from clip_builder import ClipBuilder
+import evidence_segments
+from motion_gate import MotionGate
+from event_tracker import EventTracker
+from pipeline import decode_scaled, LatestQueue, StageTimes, FrameWork
+from tiling import TilePlan, CropCosts, boxes_array
 
 # --------- GLOBAL CONFIG ----------
 BACKEND = "http://10.232.133.20:8000"  
 
 # Default model path
 DEFAULT_MODEL_PATH = "best.pt"  
+# Inference runtime: "torch" (the .pt itself), "onnx", "onnx-int8" or "openvino"
+# (exports of the .pt, see model_tool.py). Per camera: "runtime"
+DEFAULT_RUNTIME = "torch"
 
 # Cameras: add/modify entries here
 # stream: full '/video' URL from IP Webcam
+# source: "snapshot" (default, polls /shot.jpg), "mjpeg" (reads /video) or "file" (replay "path")
 # device_id / location: label strings used for dedupe/storage
-# optionally override model_path per camera
+# optionally override model_path / runtime per camera
 CAMERAS = [
     {"stream": "http://10.232.133.189:8080", "device_id": "phone_cam_1", "location": "Main Gate"},
     {"stream": "http://10.232.133.99:8080", "device_id": "phone_cam_2", "location": "Parking Lot", "model_path": "best.pt"}
@@ -26,156 +73,464 @@ CAMERAS = [
 
 # Detection tuning (common)
 CONF_THRESHOLD = 0.35
-CONSECUTIVE_REQUIRED = 2
-FPS = 5  # used to size ring buffer and approximate timing
-
-# Event window: send only 1 alert per device|location|class per this interval
+FPS = 5  # nominal rate per camera; the scheduler moves it between min_fps and max_fps
+# Per camera (optional): "priority" (weight when frames are shed, default 1),
+# "min_fps" (default frame_scheduler.SCHED_MIN_FPS) and "max_fps" (rate with an
+# active event, default fps * frame_scheduler.SCHED_HOT_FPS_FACTOR)
+# A class must be seen for CONFIRM_SECONDS (gaps up to RELEASE_SECONDS allowed)
+# before it opens an event. Per camera: confirm_seconds / release_seconds, or
+# the older consecutive_required (frames, converted using the camera fps)
+CONFIRM_SECONDS = 0.2
+RELEASE_SECONDS = 1.0
+
+# Event window: send only 1 alert per device|location|class per this interval,
+# and not again until REARM_SECONDS after the window ended
 EVENT_WINDOW_SECONDS = 30
-
-# How many seconds to keep as post-trigger (we default 0 because ring already stores pre-30s)
-POST_SECONDS = 0
-
-# Max retries to post alert if first attempt fails
-ALERT_POST_RETRIES = 3
-ALERT_POST_RETRY_DELAY = 2.0
+REARM_SECONDS = 2.0
+
+# Evidence clip = PRE_SECONDS before the trigger (the ring) + POST_SECONDS after it
+PRE_SECONDS = 30
+POST_SECONDS = 10
+
+# Alert snapshot encoding (overridable per camera as alert_jpeg_quality / alert_max_width)
+ALERT_JPEG_QUALITY = 80
+ALERT_MAX_WIDTH = 640
+
+# Background delivery: jobs are kept in DISPATCH_OUTBOX (survives restarts)
+# and retried with exponential backoff by DISPATCH_WORKERS threads
+DISPATCH_OUTBOX = "outbox.db"
+DISPATCH_WORKERS = 2
+DISPATCH_MAX_JOBS = 2000
+# How often each camera asks for the status of its outstanding alerts:
+# STATUS_CHECK_INTERVAL while the change feed is down, otherwise only a
+# reconciliation every STATUS_RECONCILE_INTERVAL
+STATUS_CHECK_INTERVAL = 5
+STATUS_RECONCILE_INTERVAL = 60
+# Print dispatcher/inference stats every this many seconds
+STATS_INTERVAL = 30
 
 # Target classes 
 TARGET_CLASSES = set(["guns", "knife"])
+
+# Evidence ring: "jpeg" stores encoded frames (reusing the camera's JPEG when
+# no resize is needed), "arena" keeps raw frames in one preallocated array
+RING_MODE = "jpeg"
+RING_JPEG_QUALITY = 85
+RING_CAMERA_BUDGET_MB = 64     # per camera
+RING_PROCESS_BUDGET_MB = 1024  # all cameras in this process
+PROCESS_BUDGET.limit = RING_PROCESS_BUDGET_MB * 1024 * 1024
+
+# Shared inference batching: a batch is flushed when it holds INFER_MAX_BATCH
+# frames or INFER_MAX_WAIT_MS after its first frame arrived, whichever is first
+INFER_MAX_BATCH = 8
+INFER_MAX_WAIT_MS = 15
+
+# Motion gating: skip inference while the scene is static. Per camera:
+# motion_gating (bool), motion_sensitivity ("low"/"medium"/"high"), and the
+# finer motion_pixel_threshold / motion_min_area / motion_hold_seconds /
+# motion_idle_interval (see motion_gate.py for the defaults)
+MOTION_GATING = True
+MOTION_SENSITIVITY = "medium"
+
+# ROI / tiled inference is configured per camera (see tiling.py):
+#   "roi": [[x1, y1, x2, y2], ...] or [{"name": "door", "rect": [...]}, ...]  (normalized 0..1)
+#   "tiles": [cols, rows], "tile_overlap": 0.2
+# Cameras without either infer the whole frame squashed to 640x480.
+
+# Frames waiting between preprocessing and inference, per camera (oldest dropped)
+PIPELINE_QUEUE_SIZE = 1
+
+# Worker processes for the cameras (0 = one thread per camera in this process)
+WORKER_PROCESSES = 2
+
+# /metrics (and /debug/profile) on this port, on localhost; with worker processes
+# the supervisor uses it and the processes take the following ports (0 disables)
+METRICS_PORT = 9108
 # ------------------------------------------------
 
-# Utility: create shot URL from /video
-def to_shot_url(video_url):
-    if "/video" in video_url:
-        return video_url.replace("/video", "/shot.jpg")
-    return video_url.rstrip("/") + "/shot.jpg"
-
-# Helper: save ring to mp4
-def save_ring_to_mp4(outpath=None, ring_frames=None, fps=FPS):
-    if ring_frames is None or len(ring_frames) == 0:
-        return None
-    if outpath is None:
-        outpath = f"clip_{int(time.time())}_{uuid.uuid4().hex[:8]}.mp4"
-    h, w = ring_frames[0].shape[:2]
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-    try:
-        out = cv2.VideoWriter(outpath, fourcc, fps, (w, h))
-        for f in ring_frames:
-            out.write(f)
-        out.release()
-        return outpath
-    except Exception as e:
-        print("save_ring_to_mp4 exception:", e)
-        try: out.release()
-        except: pass
-        return None
-
-# Upload clip helper (shared)
-def upload_clip_to_backend(alert_id, filepath, backend_base=BACKEND):
-    if not os.path.exists(filepath):
-        print("upload: file not found", filepath)
-        return False
-    files = {"file": open(filepath, "rb")}
-    data = {"alert_id": alert_id}
-    try:
-        r = requests.post(f"{backend_base}/api/upload_evidence", files=files, data=data, timeout=60)
-        print("Upload response:", r.status_code, r.text)
-        files["file"].close()
-        return r.status_code == 200 or r.status_code == 201
-    except Exception as e:
-        print("Upload exception:", e)
-        try: files["file"].close()
-        except: pass
-        return False
+def camera_model_path(cam_cfg):
+    """Weights file a camera runs: its model_path on its runtime."""
+    return resolve_model_path(cam_cfg.get("model_path", DEFAULT_MODEL_PATH), cam_cfg.get("runtime", DEFAULT_RUNTIME))
+
+
+log = metrics.get_logger("camera")
+STAGE_SECONDS = metrics.histogram("camera_stage_seconds", "Per-frame time spent in each pipeline stage",
+                                  ("camera", "stage"))
+FRAMES = metrics.counter("camera_frames_total", "Frames by outcome (inferred, skipped_motion, dropped_queue, "
+                         "dropped_slot, decode_error, infer_error)", ("camera", "outcome"))
+EVENTS = metrics.counter("camera_events_total", "Detection events opened", ("camera", "cls"))
+RING_FRAMES = metrics.gauge("camera_ring_frames", "Frames held in the evidence ring", ("camera",))
+RING_BYTES = metrics.gauge("camera_ring_bytes", "Bytes held by the evidence ring", ("camera",))
+OUTSTANDING = metrics.gauge("camera_outstanding_alerts", "Alerts posted and not yet resolved", ("camera",))
+ACTIVE_EVENTS = metrics.gauge("camera_active_events", "Events inside their window", ("camera",))
+
 
 # Worker class for each camera
+def local_inference(model_path):
+    return get_inference_service(model_path, max_batch=INFER_MAX_BATCH, max_wait_ms=INFER_MAX_WAIT_MS)
+
+
 class CameraWorker(threading.Thread):
-    def __init__(self, cam_cfg):
+    def __init__(self, cam_cfg, dispatcher, status_feed, inference=local_inference, frame_slots=None):
         super().__init__(daemon=True)
         self.stream = cam_cfg["stream"]
-        self.shot_url = to_shot_url(self.stream)
         self.device_id = cam_cfg.get("device_id", "device")
         self.location = cam_cfg.get("location", "location")
-        self.model_path = cam_cfg.get("model_path", DEFAULT_MODEL_PATH)
+        self.model_path = camera_model_path(cam_cfg)
         self.fps = cam_cfg.get("fps", FPS)
         self.conf_threshold = cam_cfg.get("conf_threshold", CONF_THRESHOLD)
-        self.consecutive_required = cam_cfg.get("consecutive_required", CONSECUTIVE_REQUIRED)
+        if "consecutive_required" in cam_cfg:
+            self.confirm_seconds = max(0, cam_cfg["consecutive_required"] - 1) / float(self.fps)
+        else:
+            self.confirm_seconds = cam_cfg.get("confirm_seconds", CONFIRM_SECONDS)
+        self.release_seconds = cam_cfg.get("release_seconds", RELEASE_SECONDS)
         self.target_classes = cam_cfg.get("target_classes", TARGET_CLASSES)
+        self.alert_jpeg_quality = cam_cfg.get("alert_jpeg_quality", ALERT_JPEG_QUALITY)
+        self.alert_max_width = cam_cfg.get("alert_max_width", ALERT_MAX_WIDTH)
+        self.source = make_frame_source(cam_cfg, self.fps)
+        self.pace = SCHEDULER.register(self.device_id, self.fps, min_fps=cam_cfg.get("min_fps"),
+                                       max_fps=cam_cfg.get("max_fps"), priority=cam_cfg.get("priority", 1.0))
+        self.source_fps = self.fps
+        self.tile_plan = TilePlan.from_config(cam_cfg)
+        self.crop_costs = CropCosts(self.device_id, self.tile_plan) if self.tile_plan.active else None
+        # decode at the resolution the crops need (the ring / alerts stay at 640x480)
+        self.decode_size = self.tile_plan.decode_size() if self.tile_plan.active else (640, 480)
+        gate_kw = {k: cam_cfg["motion_" + k] for k in ("pixel_threshold", "min_area", "hold_seconds", "idle_interval")
+                   if "motion_" + k in cam_cfg}
+        self.motion = MotionGate(sensitivity=cam_cfg.get("motion_sensitivity", MOTION_SENSITIVITY),
+                                 enabled=cam_cfg.get("motion_gating", MOTION_GATING), **gate_kw)
         # per-camera runtime state
-        self.ring = deque(maxlen=self.fps * 30)
-        self.consec = {}
-        self.active_events = {}   # key -> event dict
-        self.last_event_end = {}
-        self.alert_map = {}       # alert_id -> timestamp
+        self.ring = make_ring(cam_cfg.get("ring_mode", RING_MODE), PRE_SECONDS, max_fps=self.pace.max_fps,
+                              quality=cam_cfg.get("ring_jpeg_quality", RING_JPEG_QUALITY),
+                              budget_bytes=cam_cfg.get("ring_budget_mb", RING_CAMERA_BUDGET_MB) * 1024 * 1024)
+        self.clips = ClipBuilder(self.ring, self.fps, pre_seconds=PRE_SECONDS,
+                                 post_seconds=cam_cfg.get("post_seconds", POST_SECONDS),
+                                 on_ready=self._upload_prepared_clip, name=f"{self.device_id}-clips")
+        self.tracker = None       # EventTracker, built once the model's class names are known
+        self.active_events = {}   # key -> event dict (the tracker's)
+        self.alert_map = {}       # alert_id -> trigger timestamp (None if unknown)
+        self.uploading = set()    # alert ids with a clip queued for upload
+        self.alert_lock = threading.Lock()
+        self.last_status_check = 0.0
         self.model = None
+        self.inference = inference      # model_path -> object with predict() / names
+        self.frame_slots = frame_slots  # shared-memory FrameSlots when inference runs in another process
+        self.cpu_pre = 0.0              # CPU time of the preprocess / inference threads,
+        self.cpu_infer = 0.0            # used by the supervisor to balance load
+        self.frames_done = 0
+        # preprocess -> inference hand-off; newest frames win when inference lags
+        self.frames_q = LatestQueue(maxsize=PIPELINE_QUEUE_SIZE, on_drop=self._drop)
+        self.stage_times = StageTimes()
+        self.slot_dropped = 0
         self.shutdown_flag = threading.Event()
         # startup banner identity
         self.name = f"{self.device_id}-{self.location}"
+        # results of queued jobs come back through the on_* callbacks below
+        self.dispatcher = dispatcher
+        dispatcher.register(self.device_id, self)
+        self.status_feed = status_feed
+        self.log = log.bind(camera=self.name)
+        self._stage_hist = {}
+        self._outcomes = {}
+        RING_FRAMES.labels(self.device_id).set_function(lambda: len(self.ring))
+        RING_BYTES.labels(self.device_id).set_function(lambda: self.ring.nbytes)
+        OUTSTANDING.labels(self.device_id).set_function(lambda: len(self.alert_map))
+        ACTIVE_EVENTS.labels(self.device_id).set_function(lambda: len(self.active_events))
+
+    @property
+    def cpu_seconds(self):
+        return self.cpu_pre + self.cpu_infer
+
+    def outstanding(self):
+        """Events, alerts, clips and queued jobs whose state only lives in this process
+        (and its outbox); the supervisor doesn't move a camera while there are any."""
+        with self.alert_lock:
+            n = len(self.alert_map) + len(self.uploading)
+        return n + len(self.active_events) + self.clips.pending() + self.dispatcher.pending(self.device_id)
 
     def load_model(self):
-        print(f"[{self.name}] Loading model: {self.model_path}")
-        self.model = YOLO(self.model_path)
-        print(f"[{self.name}] Loaded model. class names:", self.model.names)
+        # shared per model_path; only the first camera actually loads the weights
+        self.model = self.inference(self.model_path)
+        self.log.info("using model", model=self.model_path, names=self.model.names)
         
         # If desired, auto-check and warn:
         model_names = set([v for k,v in self.model.names.items()]) if isinstance(self.model.names, dict) else set(self.model.names)
         missing = [c for c in self.target_classes if c not in model_names]
         if missing:
-            print(f"[{self.name}] WARNING: target_classes {self.target_classes} contains items not in model.names {model_names}. Update camera config if needed.")
-
-    def send_alert(self, frame, cls, conf):
-        """Post to backend. returns alert_id or None."""
-        _, buf = cv2.imencode('.jpg', frame)
-        b64 = base64.b64encode(buf.tobytes()).decode('utf-8')
-        payload = {
+            self.log.warning("target classes not in model names, update camera config if needed",
+                             target_classes=sorted(self.target_classes), model_names=sorted(model_names))
+        self.tracker = EventTracker(self.model.names, self.target_classes, self.conf_threshold, EVENT_WINDOW_SECONDS,
+                                    key_prefix=f"{self.device_id}|{self.location}|",
+                                    confirm_seconds=self.confirm_seconds, release_seconds=self.release_seconds,
+                                    rearm_seconds=REARM_SECONDS)
+        self.active_events = self.tracker.events
+
+    def send_alert(self, frame, cls, conf, event_key):
+        """Queue alert for background delivery; on_alert_posted() fires once it is accepted."""
+        h, w = frame.shape[:2]
+        if self.alert_max_width and w > self.alert_max_width:
+            frame = cv2.resize(frame, (self.alert_max_width, int(h * self.alert_max_width / w)))
+        _, buf = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(self.alert_jpeg_quality)])
+        meta = {
             "device_id": self.device_id,
             "location": self.location,
             "cls": cls,
             "confidence": float(conf),
             "timestamp": time.time(),
-            "frame_b64": b64
         }
-        try:
-            r = requests.post(BACKEND + "/api/alerts", json=payload, timeout=5)
-            if r.status_code == 201:
-                res = r.json(); aid = res.get("id")
-                print(f"[{self.name}] Sent alert id={aid} for {cls}")
-                self.alert_map[aid] = time.time()
-                return aid
-            else:
-                print(f"[{self.name}] Alert POST failed:", r.status_code, r.text)
-                return None
-        except Exception as e:
-            print(f"[{self.name}] Alert POST exception:", e)
-            return None
+        self.dispatcher.post_alert(self.device_id, event_key, meta, buf.tobytes())
 
     def check_for_confirmed_alerts_and_upload(self):
-        # poll own alert_map only
-        to_upload = []
-        for aid in list(self.alert_map.keys()):
-            try:
-                r = requests.get(f"{BACKEND}/api/alerts/{aid}/status", timeout=3)
-                if r.status_code == 200:
-                    st = r.json().get("status")
-                    if st in ("confirm","confirmed"):
-                        to_upload.append(aid)
-                    elif st in ("reject","rejected"):
-                        self.alert_map.pop(aid, None)
-            except Exception:
-                pass
-        for aid in to_upload:
-            print(f"[{self.name}] Confirmed alert detected: {aid}, saving clip...")
-            tmp = save_ring_to_mp4(outpath=None, ring_frames=list(self.ring), fps=self.fps)
-            if tmp:
-                ok = upload_clip_to_backend(aid, tmp)
-                if ok:
-                    print(f"[{self.name}] Uploaded evidence for {aid}")
-                    try: os.remove(tmp)
-                    except: pass
-                    self.alert_map.pop(aid, None)
+        # poll own alert_map only; answers arrive in on_status()
+        with self.alert_lock:
+            pending = [aid for aid in self.alert_map if aid not in self.uploading]
+        self.dispatcher.check_status(self.device_id, pending)
+
+    # ----- dispatcher callbacks (run on dispatcher threads) -----
+    def on_alert_posted(self, event_key, aid):
+        self.log.info("sent alert", aid=aid, event=event_key)
+        clip = self.clips.bind(event_key, aid)
+        with self.alert_lock:
+            self.alert_map[aid] = clip.trigger_ts if clip is not None else None
+        self.status_feed.watch(aid, self)
+        ev = self.active_events.get(event_key)
+        if ev is not None:
+            ev["alert_id"] = aid
+            ev["posted"] = True
+
+    def on_status(self, aid, st):
+        if st in ("reject", "rejected"):
+            with self.alert_lock:
+                self.alert_map.pop(aid, None)
+            self.status_feed.unwatch(aid)
+            self.clips.discard(aid)
+            return
+        if st not in ("confirm", "confirmed"):
+            return
+        with self.alert_lock:
+            if aid in self.uploading or aid not in self.alert_map:
+                return
+            self.uploading.add(aid)
+            trigger_ts = self.alert_map[aid]
+        clip = self.clips.confirm(aid)
+        if clip:
+            self.log.info("alert confirmed, uploading prepared clip", aid=aid)
+            self._upload_prepared_clip(clip)
+            return
+        if clip is None:
+            self.log.info("alert confirmed, clip uploads when post-trigger capture ends", aid=aid)
+            return
+        # no prepared clip (expired or failed): the ring, but only if it still holds the event
+        records = self._ring_window(trigger_ts)
+        if not records:
+            self.log.error("alert confirmed but its footage is gone, no evidence uploaded", aid=aid)
+            with self.alert_lock:
+                self.uploading.discard(aid)
+                self.alert_map.pop(aid, None)
+            self.status_feed.unwatch(aid)
+            return
+        self.log.info("alert confirmed, saving clip from the ring", aid=aid)
+        tmp = evidence_segments.spool_clip(records)
+        if tmp:
+            self.dispatcher.upload_clip(self.device_id, aid, tmp)
+        else:
+            self.log.error("failed to save clip", aid=aid)
+            with self.alert_lock:
+                self.uploading.discard(aid)
+
+    def _ring_window(self, trigger_ts):
+        """Ring records around trigger_ts, or None unless the ring still covers it."""
+        records = self.ring.encoded(trigger_ts - PRE_SECONDS) if trigger_ts is not None else []
+        if not records or not records[0][0] <= trigger_ts <= records[-1][0]:
+            return None
+        return [r for r in records if r[0] <= trigger_ts + self.clips.post_seconds]
+
+    def _upload_prepared_clip(self, clip):
+        self.dispatcher.upload_clip(self.device_id, clip.alert_id, clip.path)
+        self.clips.done(clip.alert_id)
+
+    def on_uploaded(self, aid, ok):
+        with self.alert_lock:
+            self.uploading.discard(aid)
+            if ok:
+                self.alert_map.pop(aid, None)
+        if ok:
+            self.status_feed.unwatch(aid)
+            self.log.info("uploaded evidence", aid=aid)
+        else:
+            self.log.error("evidence upload failed", aid=aid)
+
+    def stats(self):
+        s = {"motion": self.motion.stats(), "stages": self.stage_times.stats(), "rate": self.pace.stats(),
+             "queue_dropped": self.frames_q.dropped, "slot_dropped": self.slot_dropped}
+        if self.crop_costs is not None:
+            s["crops"] = self.crop_costs.stats()
+        return s
+
+    def _count(self, outcome):
+        c = self._outcomes.get(outcome)
+        if c is None:
+            c = self._outcomes[outcome] = FRAMES.labels(self.device_id, outcome)
+        c.inc()
+
+    def _record_times(self, times):
+        self.stage_times.add(times)
+        for stage, dt in times.items():
+            h = self._stage_hist.get(stage)
+            if h is None:
+                h = self._stage_hist[stage] = STAGE_SECONDS.labels(self.device_id, stage)
+            h.observe(dt)
+
+    def _release(self, work):
+        if self.frame_slots is not None:
+            self.frame_slots.release(work.frame)
+            for crop in work.crops or ():
+                self.frame_slots.release(crop)
+
+    def _drop(self, work):
+        self._count("dropped_queue")
+        self.pace.dropped()
+        self._release(work)
+
+    def _slot_drop(self):
+        self.slot_dropped += 1
+        self._count("dropped_slot")
+        self.pace.dropped()
+
+    def _cut(self, frame):
+        """Model inputs for the tile plan's crops, resized straight into shared-memory
+        slots when inference runs in another process; None when the slots ran out."""
+        views = self.tile_plan.cut(frame)
+        if self.frame_slots is None:
+            return [self.tile_plan.resize(v) for v in views]
+        crops = []
+        for v in views:
+            slot = self.frame_slots.put(v)
+            if slot is None:
+                for c in crops:
+                    self.frame_slots.release(c)
+                return None
+            crops.append(slot)
+        return crops
+
+    def _predict_crops(self, work):
+        """Infer all crops of a frame in one go and merge their boxes into a frame-sized result."""
+        t0 = time.time()
+        per_crop = [boxes_array(r) for r in self.model.predict_many(work.crops)]
+        h, w = work.frame.shape[:2]
+        merged = self.tile_plan.merge(per_crop, w, h)
+        self.crop_costs.add(time.time() - t0, per_crop, merged, w, h)
+        return RemoteResult(merged, self.model.names)
+
+    def _update_pace(self, now):
+        """Tell the scheduler whether this camera is hot (event / recent detection) or quiet."""
+        seen = self.tracker.last_sighting()
+        self.pace.hot = bool(self.active_events) or (seen is not None and now - seen <= SCHED_HOT_SECONDS)
+        self.pace.quiet = self.motion.static(now)
+
+    def preprocess_loop(self):
+        """Stage 2: decode at reduced size, resize once, ring/clips, motion gate."""
+        last_seq = 0
+        while not self.shutdown_flag.is_set():
+            # on the scheduler's deadline, not a fixed sleep after the work
+            self.pace.wait(self.shutdown_flag)
+            if self.pace.target != self.source_fps:
+                self.source_fps = self.pace.target
+                self.source.set_fps(self.source_fps)
+            # newest frame only; anything older was dropped by the source
+            packet = self.source.get(last_seq, timeout=2.0)
+            if packet is None:
+                continue
+            last_seq = packet.seq
+            cpu0 = time.thread_time()
+            t0 = time.time()
+            times = {"source_wait": t0 - packet.ts}
+            frame = packet.image
+            if frame is None:
+                frame = decode_scaled(packet.jpeg, *self.decode_size)
+                if frame is None:
+                    self._count("decode_error")
+                    self.log.debug("frame did not decode", seq=packet.seq)
+                    continue
+            t1 = time.time()
+            times["decode"] = t1 - t0
+
+            # static frames skip the model (the gate works on any frame size)
+            infer = self.motion.should_infer(frame, t1)
+            if not infer:
+                self._count("skipped_motion")
+
+            # ROI / tiled cameras infer full-resolution crops instead of the resized frame
+            crops = None
+            if infer and self.tile_plan.active:
+                crops = self._cut(frame)
+                if crops is None:
+                    self._slot_drop()
+                    infer = False
+
+            # resize once & add to ring; the fetched JPEG is stored as-is when already 640x480
+            resized = frame.shape[:2] != (480, 640)
+            if infer and crops is None and self.frame_slots is not None:
+                # the frame the inference process reads, resized straight into shared memory
+                slot = self.frame_slots.put(frame)
+                if slot is None:
+                    self._slot_drop()
+                    infer = False
+                    if resized:
+                        frame = cv2.resize(frame, (640, 480))
                 else:
-                    print(f"[{self.name}] Upload failed for {aid}")
+                    frame = slot
+            elif resized:
+                frame = cv2.resize(frame, (640, 480))
+            if resized:
+                record = self.ring.append(frame=frame, ts=packet.ts)
             else:
-                print(f"[{self.name}] Failed to save clip for {aid}")
+                record = self.ring.append(frame=frame, jpeg=packet.jpeg, ts=packet.ts)
+            # post-trigger frames for clips of recent events
+            if record and self.clips.is_capturing():
+                self.clips.on_frame(record if record[1] is not None else (record[0], self.ring.encode(frame)))
+            times["preprocess"] = time.time() - t1
+
+            if infer:
+                self.frames_q.put(FrameWork(packet, frame, times, crops))
+            else:
+                self._record_times(times)
+            self.cpu_pre += time.thread_time() - cpu0
+            self.pace.done(time.time() - t0)
+
+    def handle_frame(self, work):
+        """Stage 3: inference and events for one preprocessed frame."""
+        times = work.times
+        t0 = time.time()
+        times["queue"] = t0 - work.queued_at
+        try:
+            result = self.model.predict(work.frame) if work.crops is None else self._predict_crops(work)
+        except Exception as e:
+            self.log.error("model predict failed", error=e)
+            self._count("infer_error")
+            self._release(work)
+            time.sleep(0.2)
+            return
+        now = time.time()
+        times["infer"] = now - t0
+        self.motion.record_inference(now - t0, now)
+        # create events; the alert is delivered in the background and the
+        # event suppresses further alerts for the window either way
+        for key, cls_name, conf in self.tracker.update(result.boxes.cls, result.boxes.conf, now):
+            self.log.info("created event", event=key, conf=round(conf, 3), ts=now)
+            EVENTS.labels(self.device_id, cls_name).inc()
+            self.clips.start(key, now)
+            self.send_alert(work.frame, cls_name, conf, key)
+        if self.tracker.last_sighting() == now:
+            # a target in view: full rate, or a still one is only seen every idle_interval and never confirmed
+            self.motion.hold(now)
+        self._release(work)
+        end = time.time()
+        times["events"] = end - now
+        times["total"] = end - work.packet.ts
+        self._record_times(times)
+        self._count("inferred")
+        self.frames_done += 1
 
     def run(self):
 
@@ -183,154 +538,97 @@ class CameraWorker(threading.Thread):
         try:
             self.load_model()
         except Exception as e:
-            print(f"[{self.name}] model load failed:", e)
+            self.log.error("model load failed", error=e)
             return
 
-        # main loop
-        while not self.shutdown_flag.is_set():
-            # fetch single shot frame
-            try:
-                r = requests.get(self.shot_url, timeout=6)
-                if r.status_code != 200:
-                    # print(f"[{self.name}] Shot request failed:", r.status_code)
-                    time.sleep(0.2)
-                    continue
-                arr = np.frombuffer(r.content, np.uint8)
-                frame = cv2.imdecode(arr, cv2.IMREAD_COLOR)
-                if frame is None:
-                    # print(f"[{self.name}] Warning: decoded frame is None")
-                    time.sleep(0.2)
-                    continue
-            except Exception as e:
-                # print(f"[{self.name}] Shot request exception:", e)
-                time.sleep(0.2)
-                continue
-
-            # resize & add to ring
-            frame = cv2.resize(frame, (640, 480))
-            self.ring.append(frame.copy())
-
-            # inference and detection processing
-            try:
-                results = self.model.predict(source=frame, verbose=False)
-            except Exception as e:
-                print(f"[{self.name}] Model predict exception:", e)
-                time.sleep(0.2)
-                continue
+        # stage 1: frame source runs on its own reader thread; stage 2 on another
+        self.source.start()
+        preprocess = threading.Thread(target=self.preprocess_loop, name=f"{self.name}-pre", daemon=True)
+        preprocess.start()
 
-            boxes = results[0].boxes
-            # per-frame dedupe set
-            seen_this_frame = set()
-            for box in boxes:
-                cls_idx = int(box.cls[0])
-                cls_name = self.model.names[cls_idx]
-                if cls_name in seen_this_frame:
-                    continue
-                seen_this_frame.add(cls_name)
-                conf = float(box.conf[0])
-                # debug
-                # print(f"[{self.name}] Detected class='{cls_name}' conf={conf:.3f}")
-
-                # gating
-                if cls_name not in self.target_classes or conf < self.conf_threshold:
-                    self.consec[cls_name] = 0
-                    continue
-                self.consec[cls_name] = self.consec.get(cls_name, 0) + 1
-                if self.consec[cls_name] < self.consecutive_required:
-                    continue
-
-                # create event key
-                key = f"{self.device_id}|{self.location}|{cls_name}"
-                now = time.time()
-                ev = self.active_events.get(key)
-
-                # if an active event exists and is within window skip
-                if ev and (now - ev["start_ts"] <= EVENT_WINDOW_SECONDS):
-                    pass
-                    self.consec[cls_name] = 0
-                    continue
-
-                # if last event just ended very recently, skip to avoid immediate re-creation
-                last_end = self.last_event_end.get(key)
-                if last_end and (now - last_end) < 2.0:
-                    pass
-                    self.consec[cls_name] = 0
-                    continue
-
-                # create event
-                ev = {"start_ts": now, "alert_id": None, "posted": False, "post_attempts": 0, "last_post_attempt_ts": 0.0}
-                self.active_events[key] = ev
-                print(f"[{self.name}] created event for {key} at {now}")
-
-                # try to post alert bounded times
-                while ev["post_attempts"] < ALERT_POST_RETRIES and not ev["posted"]:
-                    if ev["post_attempts"] > 0:
-                        # throttle
-                        sleep_needed = ALERT_POST_RETRY_DELAY - (time.time() - ev["last_post_attempt_ts"])
-                        if sleep_needed > 0:
-                            time.sleep(sleep_needed)
-                    ev["post_attempts"] += 1
-                    ev["last_post_attempt_ts"] = time.time()
-                    print(f"[{self.name}] attempt POST {ev['post_attempts']} for {key}")
-                    aid = self.send_alert(frame, cls_name, conf)
-                    if aid:
-                        ev["alert_id"] = aid
-                        ev["posted"] = True
-                        print(f"[{self.name}] POST succeeded for {key} -> {aid}")
-                        break
-                    else:
-                        print(f"[{self.name}] POST failed attempt {ev['post_attempts']} for {key}")
-
-                if not ev["posted"]:
-                    print(f"[{self.name}] POST unsuccessful after retries for {key}. Event will still suppress further alerts for window.")
-
-                # reset consec for class so it doesn't immediately re-trigger
-                self.consec[cls_name] = 0
+        # main loop: stage 3
+        while not self.shutdown_flag.is_set():
+            work = self.frames_q.get(timeout=0.5)
+            cpu0 = time.thread_time()
+            if work is not None:
+                self.handle_frame(work)
 
             # cleanup expired events
             now = time.time()
-            expired = []
-            for key, ev in list(self.active_events.items()):
-                if now - ev["start_ts"] > EVENT_WINDOW_SECONDS:
-                    print(f"[{self.name}] event window ended for {key}")
-                    self.last_event_end[key] = now
-                    expired.append(key)
-            for k in expired:
-                self.active_events.pop(k, None)
-
-            # every few seconds, check for confirmed alerts and upload (per-camera)
-            if int(time.time()) % 5 == 0:
+            for key in self.tracker.expire(now):
+                self.log.info("event window ended", event=key)
+            self._update_pace(now)
+
+            # confirmations normally arrive via the change feed; poll only as a fallback
+            interval = STATUS_RECONCILE_INTERVAL if self.status_feed.healthy else STATUS_CHECK_INTERVAL
+            if now - self.last_status_check >= interval:
+                self.last_status_check = now
                 self.check_for_confirmed_alerts_and_upload()
-
-            # sleep to roughly match FPS
-            time.sleep(1.0 / max(1, self.fps))
+                self.clips.expire(now)
+            self.cpu_infer += time.thread_time() - cpu0
 
         # shutdown cleanup
-        print(f"[{self.name}] shutting down worker.")
+        preprocess.join(timeout=5)
+        self.frames_q.drain()
+        self.source.stop()
+        SCHEDULER.unregister(self.device_id)
+        # the metric closures would keep this worker (and its ring) alive after a move
+        for m in (RING_FRAMES, RING_BYTES, OUTSTANDING, ACTIVE_EVENTS, FRAMES, STAGE_SECONDS, EVENTS):
+            m.remove_prefix(self.device_id)
+        if self.crop_costs is not None:
+            self.crop_costs.close()
+        self.ring.close()
+        self.log.info("worker stopped", **self.source.stats())
 
 # ---------- MAIN ----------
 def main():
-    # create and start workers
-    workers = []
-    for cam in CAMERAS:
-        w = CameraWorker(cam)
-        workers.append(w)
+    mlog = metrics.get_logger("main")
+    if WORKER_PROCESSES > 0:
+        from supervisor import Supervisor
+        Supervisor(CAMERAS, WORKER_PROCESSES).run()
+        return
+    dispatcher = Dispatcher(BACKEND, outbox_path=DISPATCH_OUTBOX, workers=DISPATCH_WORKERS, max_jobs=DISPATCH_MAX_JOBS)
+    status_feed = StatusFeed(BACKEND)
+    status_feed.start()
+    if METRICS_PORT:
+        metrics.serve_metrics(METRICS_PORT)
+
+    # create workers first so their handlers are registered before any
+    # jobs left in the outbox from a previous run are delivered
+    workers = [CameraWorker(cam, dispatcher, status_feed) for cam in CAMERAS]
+    dispatcher.start()
+    for w in workers:
         w.start()
         # small stagger to avoid simultaneous heavy startup
         time.sleep(0.5)
 
-    print("Started all camera workers. Press Ctrl+C to stop.")
+    mlog.info("started all camera workers, press Ctrl+C to stop", cameras=len(workers))
     try:
+        last_stats = time.time()
         while True:
             time.sleep(1)
+            if STATS_INTERVAL and time.time() - last_stats >= STATS_INTERVAL:
+                last_stats = time.time()
+                mlog.info("dispatcher stats", **dispatcher.stats())
+                mlog.info("scheduler stats", **SCHEDULER.stats())
+                for w in workers:
+                    w.log.info("stats", **w.stats())
     except KeyboardInterrupt:
-        print("Shutdown requested. Stopping workers...")
+        mlog.info("shutdown requested, stopping workers")
         for w in workers:
             w.shutdown_flag.set()
         # allow workers to exit
         for w in workers:
             w.join(timeout=5)
-        print("All workers stopped. Exiting.")
+        for w in workers:
+            w.log.info("final stats", **w.stats())
+        for svc in all_services():
+            mlog.info("inference final stats", **svc.stats())
+        shutdown_all()
+        status_feed.stop()
+        dispatcher.stop()
+        mlog.info("dispatcher final stats", **dispatcher.stats())
+        mlog.info("all workers stopped, exiting")
 
 if __name__ == "__main__":
     main()
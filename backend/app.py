@@ -1,99 +1,494 @@
-import os, sqlite3, uuid, time
-from flask import Flask, request, jsonify, render_template, send_file
-from cryptography.fernet import Fernet
+import os, math, uuid, time, json, threading, base64, binascii
+from collections import OrderedDict
+from flask import Flask, Request, request, g, jsonify, render_template, send_file, Response, stream_with_context
 from pathlib import Path
+from werkzeug.utils import secure_filename
+import settings     # first: puts the shared YOLOv8 modules (metrics.py) on the path
+from settings import EVIDENCE_DIR, PROFILING
+import evidence_crypto
+from db import store_snapshot
+import metrics
+import evidence_store
+import jobs
+import worker
 
+
+class EvidenceRequest(Request):
+    """Evidence uploads are encrypted segment by segment as the multipart body
+    is parsed, straight into EVIDENCE_DIR; no plaintext temp file is written."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.path != "/api/upload_evidence":
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        name = f"{int(time.time())}_{uuid.uuid4().hex[:8]}_{secure_filename(filename or 'clip.mp4')}.enc"
+        return evidence_crypto.EncryptingWriter(str(EVIDENCE_DIR / name), stream_key)
+
+
+# The API keeps no state of its own: database, evidence storage, key and job
+# queue are shared (settings.py) and slow or periodic work is queued for the
+# workers (worker.py), so any number of these processes can run (wsgi.py).
 app = Flask(__name__, template_folder="templates")
-DB = "app.db"
-EVIDENCE_DIR = Path("evidence")
-EVIDENCE_DIR.mkdir(exist_ok=True)
+app.request_class = EvidenceRequest
 
+log = metrics.get_logger("backend")
+REQUEST_SECONDS = metrics.histogram("http_request_seconds", "Request handling time", ("route", "method", "status"))
+DB_SECONDS = metrics.histogram("db_query_seconds", "Database time (queries + writes) per request", ("route",))
+DB_QUERIES = metrics.counter("db_queries_total", "Queries and writes", ("route",))
+CRYPTO_BYTES = metrics.counter("evidence_crypto_bytes_total", "Evidence bytes encrypted / decrypted", ("op",))
+CRYPTO_SECONDS = metrics.counter("evidence_crypto_seconds_total", "Time spent in AES-GCM", ("op",))
+PENDING_ALERTS = metrics.gauge("alerts_pending", "Alerts waiting for review")
+LIST_REQUESTS = metrics.counter("alert_list_requests_total", "GET /api/alerts by outcome (not_modified, hit, miss)", ("result",))
+for _op in ("encrypt", "decrypt"):
+    CRYPTO_BYTES.labels(_op).set_function(lambda op=_op: evidence_crypto.STATS[op + "_bytes"])
+    CRYPTO_SECONDS.labels(_op).set_function(lambda op=_op: evidence_crypto.STATS[op + "_seconds"])
 
-from cryptography.fernet import Fernet
-from pathlib import Path
+services = settings.Services(log)
+db, store, queue = services.db, services.store, services.queue
+fernet, stream_key = services.fernet, services.stream_key
+# nobody else sees an in-process queue, and `python app.py` is the whole backend
+# in one process: then this process runs the jobs itself
+if isinstance(queue, jobs.MemoryQueue) or __name__ == "__main__":
+    worker.start(services)
+
+ALERT_COLS = "id, device_id, location, cls, confidence, status, timestamp, snapshot_sha"
+PAGE_DEFAULT = 100
+PAGE_MAX = 500
+BULK_MAX = 200
+# Rendered GET /api/alerts bodies kept (per query string) for the change cursor they were rendered at
+LIST_CACHE_SIZE = 64
+
+# ---------- request values ----------
+
+class BadParam(ValueError):
+    """A malformed or out-of-range query / form value; answered with a 400."""
+
+@app.errorhandler(BadParam)
+def _bad_param(e):
+    return jsonify({"error": str(e)}), 400
+
+def number(name, raw, kind=int, default=None, lo=None, hi=None):
+    """raw (a query / form / header value) as kind, clamped to [lo, hi]; default when absent."""
+    if raw is None or raw == "":
+        return default
+    try:
+        value = kind(raw)
+    except (TypeError, ValueError):
+        raise BadParam(f"{name}: {'an integer' if kind is int else 'a number'} expected, got {str(raw)[:40]!r}")
+    if not math.isfinite(value):
+        raise BadParam(f"{name}: a finite number expected")
+    if lo is not None:
+        value = max(lo, value)
+    if hi is not None:
+        value = min(hi, value)
+    return value
+
+def json_body():
+    """The request's JSON object (a dict)."""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        raise BadParam("a JSON object body expected")
+    return data
+
+def b64_frame(raw):
+    """JPEG bytes of a frame_b64 value; None when absent."""
+    if not raw:
+        return None
+    try:
+        return base64.b64decode(raw, validate=True)
+    except (binascii.Error, ValueError, TypeError):
+        raise BadParam("frame_b64: base64 expected")
+
+def alert_items(raw):
+    """The alerts of a bulk request: a list of at most BULK_MAX objects."""
+    if isinstance(raw, str):
+        try:
+            raw = json.loads(raw)
+        except ValueError:
+            raise BadParam("alerts: a JSON list expected")
+    if not isinstance(raw, list) or not all(isinstance(it, dict) for it in raw):
+        raise BadParam("alerts: a list of objects expected")
+    if len(raw) > BULK_MAX:
+        raise BadParam(f"at most {BULK_MAX} alerts per request")
+    return raw
+
+# ---------- metrics ----------
+
+def _on_query(seconds):
+    # db time is attributed to the request that ran the query
+    try:
+        g.db_seconds += seconds
+        g.db_queries += 1
+    except (RuntimeError, AttributeError):
+        pass      # outside a request (startup, background threads)
+
+db.on_query = _on_query
+PENDING_ALERTS.set_function(lambda: db.scalar("SELECT COUNT(*) FROM alerts WHERE status='pending'"))
+
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
+    g.db_seconds = 0.0
+    g.db_queries = 0
 
+@app.after_request
+def _observe_request(resp):
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if "t0" in g:
+        REQUEST_SECONDS.labels(route, request.method, resp.status_code).observe(time.perf_counter() - g.t0)
+        if g.db_queries:
+            DB_SECONDS.labels(route).observe(g.db_seconds)
+            DB_QUERIES.labels(route).inc(g.db_queries)
+    return resp
 
-KEY_FILE = Path("fernet.key")
-if not KEY_FILE.exists():
-
-    key = Fernet.generate_key()
-    KEY_FILE.write_bytes(key)
-    print("No key found, generated new key in fernet.key")
-else:
-    key = KEY_FILE.read_bytes()
-
-fernet = Fernet(key)
-print("Fernet key loaded:", key.decode())
-
-
-def init_db():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS alerts (
-                    id TEXT PRIMARY KEY,
-                    device_id TEXT,
-                    location TEXT,
-                    cls TEXT,
-                    confidence REAL,
-                    status TEXT,
-                    timestamp REAL,
-                    frame_b64 TEXT
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS evidence (
-                    id TEXT PRIMARY KEY,
-                    alert_id TEXT,
-                    filename TEXT,
-                    timestamp REAL
-                )''')
-    conn.commit(); conn.close()
-init_db()
+@app.route("/metrics")
+def metrics_endpoint():
+    """This process's metrics only; under gunicorn scrape each worker's METRICS_PORT (gunicorn.conf.py)."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/debug/profile")
+def debug_profile():
+    """Sample all threads for ?seconds=N and return folded stacks (ENABLE_PROFILING=1 only)."""
+    if not PROFILING:
+        return "profiling disabled", 404
+    folded = metrics.PROFILER.profile(request.args.get("seconds", 10))
+    if folded is None:
+        return "profiler already running", 409
+    return Response(folded, mimetype="text/plain")
+
+def alert_row_to_dict(r):
+    return {"id": r[0], "device_id": r[1], "location": r[2], "cls": r[3], "confidence": r[4], "status": r[5],
+            "timestamp": r[6], "snapshot_url": f"/api/alerts/{r[0]}/snapshot" if r[7] else None,
+            "thumbnail_url": f"/api/alerts/{r[0]}/thumbnail" if r[7] else None}
+
+# ---------- change feed ----------
+# Long-poll and SSE clients wait on this; writers notify after commit.
+CHANGES = threading.Condition()
+change_gen = 0   # bumped on every notify so a waiter can't miss one that raced its query
+LONG_POLL_MAX = 30
+# Waiters re-read the cursor at least this often: writes made by other API
+# processes only show up in the database, not on this process's condition
+CHANGE_POLL_INTERVAL = 1.0
+SSE_HEARTBEAT = 15
+
+def record_change(c, aid, status):
+    c.execute("INSERT INTO alert_events (alert_id, status, timestamp) VALUES (?,?,?)", (aid, status, time.time()))
+
+def notify_changes():
+    global change_gen
+    with list_cache_lock:
+        list_cache.clear()
+    with CHANGES:
+        change_gen += 1
+        CHANGES.notify_all()
+
+# hot queries: fixed strings so each thread's statement cache keeps them prepared
+SQL_CURSOR = "SELECT MAX(seq) FROM alert_events"
+SQL_CHANGED_IDS = "SELECT DISTINCT alert_id FROM alert_events WHERE seq > ? AND seq <= ? LIMIT ?"
+SQL_CHANGES = '''SELECT e.seq, e.alert_id, e.status, e.timestamp, a.device_id, a.location, a.cls, a.confidence, a.timestamp
+           FROM alert_events e JOIN alerts a ON a.id = e.alert_id WHERE e.seq > ? AND e.seq <= ?'''
+SQL_ALERT_STATUS = "SELECT status FROM alerts WHERE id=?"
+SQL_ALERT_BY_KEY = "SELECT id FROM alerts WHERE idempotency_key=?"
+SQL_GET_ALERT = f"SELECT {ALERT_COLS} FROM alerts WHERE id=?"
+SQL_EVIDENCE_FILE = "SELECT filename, kind, fps FROM evidence WHERE id=?"
+
+def current_cursor():
+    return db.scalar(SQL_CURSOR) or 0
+
+def changes_since(since, device_id=None, limit=500):
+    """(changes, cursor): events after since and the cursor to resume from."""
+    top = current_cursor()
+    q = SQL_CHANGES
+    args = [since, top]
+    if device_id:
+        q += " AND a.device_id = ?"; args.append(device_id)
+    rows = db.query(q + " ORDER BY e.seq LIMIT ?", args + [limit])
+    out = [{"seq": r[0], "id": r[1], "status": r[2], "changed_at": r[3], "device_id": r[4], "location": r[5],
+            "cls": r[6], "confidence": r[7], "timestamp": r[8]} for r in rows]
+    cursor = out[-1]["seq"] if len(out) == limit else max(since, top)
+    return out, cursor
+
+# ---------- alert list cache ----------
+# An entry is only served while the cursor (read from the database, so writes
+# from other processes count too) is the one it was rendered at; local writes
+# also clear the cache outright.
+list_cache = OrderedDict()
+list_cache_lock = threading.Lock()
+
+def cached_list(key, cursor):
+    with list_cache_lock:
+        hit = list_cache.get(key)
+        if hit is None or hit[0] != cursor:
+            return None
+        list_cache.move_to_end(key)
+        return hit[1]
+
+def cache_list(key, cursor, entry):
+    with list_cache_lock:
+        list_cache[key] = (cursor, entry)
+        list_cache.move_to_end(key)
+        while len(list_cache) > LIST_CACHE_SIZE:
+            list_cache.popitem(last=False)
+
+def wait_for_changes(since, device_id, timeout):
+    """Like changes_since, but blocks up to timeout seconds while there is nothing new."""
+    deadline = time.time() + timeout
+    while True:
+        gen = change_gen
+        out, cursor = changes_since(since, device_id)
+        remaining = deadline - time.time()
+        # cursor > since without changes: newer events exist, none match the filter
+        if out or cursor > since or remaining <= 0:
+            return out, cursor
+        with CHANGES:
+            if gen == change_gen:
+                CHANGES.wait(min(remaining, CHANGE_POLL_INTERVAL))
 
 @app.route("/")
 def home():
     return render_template("index.html")
 
+# multipart, or urlencoded when a client has no JPEG to attach (requests drops an empty files=)
+FORM_TYPES = ("multipart/form-data", "application/x-www-form-urlencoded")
+
 @app.route("/api/alerts", methods=["POST"])
 def create_alert():
-    data = request.json
+    """JSON with frame_b64 (legacy) or multipart: metadata fields + raw JPEG in the "frame" part.
+    A retry with the same idempotency_key field gets the id of the alert the first attempt created."""
+    if request.mimetype in FORM_TYPES:
+        data = request.form.to_dict()
+        f = request.files.get("frame")
+        jpeg = f.read() if f else None
+    else:
+        data = json_body()
+        jpeg = b64_frame(data.get("frame_b64"))
+    aid, sha = db.write(lambda c: insert_alert(c, data, jpeg))
+    notify_changes()
+    enqueue_thumbnails([sha])
+    return jsonify({"id": aid}), 201
+
+@app.route("/api/alerts/bulk", methods=["POST"])
+def create_alerts_bulk():
+    """Many alerts in one request/transaction.
+    multipart: "alerts" = JSON list of metadata, each may name its JPEG part in "frame" (e.g. "frame0").
+    JSON: {"alerts": [...]} with optional frame_b64 per alert. Each alert may carry an idempotency_key
+    (see create_alert); "ids" has one id per alert, in order."""
+    if request.mimetype in FORM_TYPES:
+        items = alert_items(request.form.get("alerts", "[]"))
+        frames = {}
+        for it in items:
+            part = it.get("frame")
+            if part and request.files.get(part):
+                frames[part] = request.files[part].read()
+        jpegs = [frames.get(it.get("frame")) for it in items]
+    else:
+        items = alert_items(json_body().get("alerts", []))
+        jpegs = [b64_frame(it.get("frame_b64")) for it in items]
+    rows = db.write(lambda c: [insert_alert(c, it, jpeg) for it, jpeg in zip(items, jpegs)])
+    notify_changes()
+    enqueue_thumbnails([sha for _, sha in rows])
+    return jsonify({"ids": [aid for aid, _ in rows]}), 201
+
+def insert_alert(c, data, jpeg):
+    """(alert id, new snapshot sha); an idempotency_key seen before returns that alert instead."""
+    key = data.get("idempotency_key") or None
+    if key is not None:
+        row = c.execute(SQL_ALERT_BY_KEY, (key,)).fetchone()
+        if row:
+            return row[0], None
     aid = str(uuid.uuid4())
-    conn = sqlite3.connect(DB); c = conn.cursor()
-    c.execute("INSERT INTO alerts VALUES (?,?,?,?,?,?,?,?)",
+    sha = store_snapshot(c, jpeg) if jpeg else None
+    ts = data.get("timestamp")
+    c.execute("INSERT INTO alerts (id, device_id, location, cls, confidence, status, timestamp, snapshot_sha, "
+              "idempotency_key) VALUES (?,?,?,?,?,?,?,?,?)",
               (aid, data.get("device_id"), data.get("location"), data.get("cls"),
-               data.get("confidence"), "pending", data.get("timestamp"), data.get("frame_b64")))
-    conn.commit(); conn.close()
-    return jsonify({"id": aid}), 201
+               number("confidence", data.get("confidence"), float),
+               "pending", number("timestamp", ts, float, time.time()), sha, key))
+    record_change(c, aid, "pending")
+    return aid, sha
+
+def enqueue_thumbnails(shas):
+    """One thumbnail job per new snapshot; until it has run the thumbnail route serves the full JPEG."""
+    try:
+        queue.enqueue_many([("thumbnail", {"sha256": sha}, f"thumbnail:{sha}") for sha in set(shas) if sha])
+    except Exception as e:
+        # the alert is committed already; a missing thumbnail only costs bandwidth
+        log.error("could not enqueue thumbnails", error=e)
 
 @app.route("/api/alerts", methods=["GET"])
 def list_alerts():
+    """Newest first, keyset-paginated: pass the X-Next-Page header back as ?page= for the next page.
+    ?since=<cursor> returns only what changed after it as {"cursor", "alerts", "removed"}
+    (410 when too much changed; reload the list). The change cursor is the ETag, so
+    If-None-Match gets a 304 without touching the alerts while nothing changed."""
+    cursor = current_cursor()
+    etag = f"alerts-{cursor}"
+    # clients subscribe to the change feed (or poll ?since=) from X-Alerts-Cursor
+    headers = {"ETag": f'"{etag}"', "X-Alerts-Cursor": str(cursor), "Cache-Control": "no-cache"}
+    if request.if_none_match.contains(etag):
+        LIST_REQUESTS.labels("not_modified").inc()
+        return Response(status=304, headers=headers)
+    key = request.query_string
+    entry = cached_list(key, cursor)
+    LIST_REQUESTS.labels("miss" if entry is None else "hit").inc()
+    if entry is None:
+        since = number("since", request.args.get("since"), int, lo=0)
+        entry = alerts_page() if since is None else alerts_delta(since, cursor)
+        if entry is None:
+            return jsonify({"error": "cursor too old or unknown, reload the list", "cursor": cursor}), 410
+        cache_list(key, cursor, entry)
+    body, extra = entry
+    headers.update(extra)
+    return Response(body, mimetype="application/json", headers=headers)
+
+def alerts_page():
+    """(body, headers) for one page of the list."""
     status = request.args.get("status")
-    conn = sqlite3.connect(DB); c = conn.cursor()
+    device_id = request.args.get("device_id")
+    limit = number("limit", request.args.get("limit"), int, PAGE_DEFAULT, 1, PAGE_MAX)
+    where, args = [], []
     if status:
-        rows = c.execute("SELECT id, device_id, location, cls, confidence, status, timestamp FROM alerts WHERE status=?", (status,)).fetchall()
+        where.append("status=?"); args.append(status)
+    if device_id:
+        where.append("device_id=?"); args.append(device_id)
+    page = request.args.get("page")
+    if page:
+        ts, _, last_id = page.partition(":")
+        ts = number("page", ts, float)
+        if ts is None or not last_id:
+            raise BadParam("page: pass back the X-Next-Page header value")
+        where.append("(timestamp < ? OR (timestamp = ? AND id < ?))"); args += [ts, ts, last_id]
+    q = f"SELECT {ALERT_COLS} FROM alerts"
+    if where:
+        q += " WHERE " + " AND ".join(where)
+    q += " ORDER BY timestamp DESC, id DESC LIMIT ?"
+    rows = db.query(q, args + [limit])
+    headers = {}
+    if len(rows) == limit:
+        headers["X-Next-Page"] = f"{rows[-1][6]!r}:{rows[-1][0]}"
+    return json.dumps([alert_row_to_dict(r) for r in rows]).encode(), headers
+
+def alerts_delta(since, cursor):
+    """(body, headers) for alerts changed in (since, cursor]: current rows of those that
+    match the filters, ids of those that no longer do. None if there are too many."""
+    if since > cursor:
+        return None
+    ids = [r[0] for r in db.query(SQL_CHANGED_IDS, (since, cursor, PAGE_MAX + 1))]
+    if len(ids) > PAGE_MAX:
+        return None
+    status = request.args.get("status")
+    device_id = request.args.get("device_id")
+    rows = db.query(f"SELECT {ALERT_COLS} FROM alerts WHERE id IN ({','.join('?' * len(ids))})", ids) if ids else []
+    alerts, removed = [], set(ids)
+    for r in sorted(rows, key=lambda r: (r[6], r[0]), reverse=True):
+        if (not status or r[5] == status) and (not device_id or r[1] == device_id):
+            alerts.append(alert_row_to_dict(r))
+            removed.discard(r[0])
+    return json.dumps({"cursor": cursor, "alerts": alerts, "removed": sorted(removed)}).encode(), {}
+
+@app.route("/api/alerts/<aid>", methods=["GET"])
+def get_alert(aid):
+    r = db.one(SQL_GET_ALERT, (aid,))
+    if not r:
+        return jsonify({"error":"not found"}), 404
+    return jsonify(alert_row_to_dict(r))
+
+@app.route("/api/alerts/<aid>/snapshot", methods=["GET"])
+def alert_snapshot(aid):
+    r = db.one("SELECT s.sha256, s.data FROM alerts a JOIN snapshots s ON s.sha256 = a.snapshot_sha WHERE a.id=?", (aid,))
+    if not r:
+        return "Not found", 404
+    # content-addressed, so the bytes behind an ETag never change
+    headers = {"ETag": f'"{r[0]}"', "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.if_none_match.contains(r[0]):
+        return Response(status=304, headers=headers)
+    return Response(bytes(r[1]), mimetype="image/jpeg", headers=headers)
+
+@app.route("/api/alerts/<aid>/thumbnail", methods=["GET"])
+def alert_thumbnail(aid):
+    r = db.one("SELECT s.sha256, COALESCE(s.thumb, s.data), s.thumb IS NOT NULL FROM alerts a "
+               "JOIN snapshots s ON s.sha256 = a.snapshot_sha WHERE a.id=?", (aid,))
+    if not r:
+        return "Not found", 404
+    if not r[2]:
+        # not rendered yet: the full snapshot, revalidated so the thumbnail replaces it later
+        etag, headers = r[0], {"Cache-Control": "no-cache"}
     else:
-        rows = c.execute("SELECT id, device_id, location, cls, confidence, status, timestamp FROM alerts").fetchall()
-    conn.close()
-    out = [{"id": r[0], "device_id": r[1], "location": r[2], "cls": r[3], "confidence": r[4], "status": r[5], "timestamp": r[6]} for r in rows]
-    return jsonify(out)
+        etag, headers = f"t-{r[0]}", {"Cache-Control": "private, max-age=31536000, immutable"}
+    headers["ETag"] = f'"{etag}"'
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    return Response(bytes(r[1]), mimetype="image/jpeg", headers=headers)
+
+@app.route("/api/alerts/changes", methods=["GET"])
+def alert_changes():
+    """Long-poll change feed. Without ?since= returns the current cursor immediately."""
+    device_id = request.args.get("device_id")
+    since = number("since", request.args.get("since"), int, lo=0)
+    if since is None:
+        return jsonify({"cursor": current_cursor(), "changes": []})
+    timeout = number("timeout", request.args.get("timeout"), float, 25, 0, LONG_POLL_MAX)
+    out, cursor = wait_for_changes(since, device_id, timeout)
+    return jsonify({"cursor": cursor, "changes": out})
+
+@app.route("/api/alerts/stream", methods=["GET"])
+def alert_stream():
+    """Server-Sent Events change feed; resumes from Last-Event-ID or ?since=."""
+    device_id = request.args.get("device_id")
+    since = number("since", request.headers.get("Last-Event-ID") or request.args.get("since"), int, lo=0)
+    if since is None:
+        since = current_cursor()
+
+    def gen(since):
+        yield "retry: 3000\n\n"
+        while True:
+            out, cursor = wait_for_changes(since, device_id, SSE_HEARTBEAT)
+            since = cursor
+            if not out:
+                yield ": keepalive\n\n"
+                continue
+            for ch in out:
+                yield f"id: {ch['seq']}\nevent: alert\ndata: {json.dumps(ch)}\n\n"
+
+    return Response(stream_with_context(gen(since)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/api/alerts/status", methods=["GET", "POST"])
+def alert_status_batch():
+    """Status of many alerts in one request: ?ids=a,b,c or JSON {"ids": [...]}."""
+    if request.method == "POST":
+        ids = json_body().get("ids") or []
+        if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+            raise BadParam("ids: a list of alert ids expected")
+    else:
+        ids = [i for i in request.args.get("ids", "").split(",") if i]
+    ids = ids[:500]
+    out = {}
+    if ids:
+        rows = db.query(f"SELECT id, status FROM alerts WHERE id IN ({','.join('?' * len(ids))})", ids)
+        out = {r[0]: r[1] for r in rows}
+    return jsonify({"statuses": out})
 
 @app.route("/api/alerts/<aid>/status", methods=["GET"])
 def alert_status(aid):
-    conn = sqlite3.connect(DB); c = conn.cursor()
-    r = c.execute("SELECT status FROM alerts WHERE id=?", (aid,)).fetchone()
-    conn.close()
+    r = db.one(SQL_ALERT_STATUS, (aid,))
     if not r:
         return jsonify({"error":"not found"}), 404
     return jsonify({"status": r[0]})
 
 @app.route("/api/alerts/<aid>/action", methods=["POST"])
 def alert_action(aid):
-    data = request.json
+    data = json_body()
     action = data.get("action")
     reviewer = data.get("reviewer", "anonymous")
-    conn = sqlite3.connect(DB); c = conn.cursor()
     if action not in ["confirm", "reject"]:
         return jsonify({"error":"invalid action"}), 400
-    c.execute("UPDATE alerts SET status=? WHERE id=?", (action, aid))
-    conn.commit(); conn.close()
+
+    def apply(c):
+        c.execute("UPDATE alerts SET status=? WHERE id=?", (action, aid))
+        if c.rowcount:
+            record_change(c, aid, action)
+    db.write(apply)
+    notify_changes()
     return jsonify({"ok": True})
 
 
@@ -101,37 +496,110 @@ def alert_action(aid):
 def upload_evidence():
     alert_id = request.form.get("alert_id")
     file = request.files.get("file")
+    writers = [f.stream for f in request.files.values() if isinstance(f.stream, evidence_crypto.EncryptingWriter)]
     if not alert_id or not file:
+        for w in writers:
+            w.abort()
         return jsonify({"error":"missing"}), 400
-    filename = f"{int(time.time())}_{file.filename}"
-    raw_path = EVIDENCE_DIR / filename
-    file.save(raw_path)
-    data = raw_path.read_bytes()
-    enc_path = EVIDENCE_DIR / (filename + ".enc")
-    enc_path.write_bytes(fernet.encrypt(data))
-    raw_path.unlink(missing_ok=True)
+    # already encrypted while the body streamed in (see EvidenceRequest)
+    enc_path = file.stream.finish()
+    for w in writers:
+        if w is not file.stream:
+            w.abort()
     eid = str(uuid.uuid4())
-    conn = sqlite3.connect(DB); c = conn.cursor()
-    c.execute("INSERT INTO evidence VALUES (?,?,?,?)", (eid, alert_id, str(enc_path), time.time()))
-    conn.commit(); conn.close()
+    size = os.path.getsize(enc_path)
+    db.write(lambda c: c.execute("INSERT INTO evidence (id, alert_id, filename, timestamp, kind, size) "
+                                 "VALUES (?,?,?,?,?,?)", (eid, alert_id, str(enc_path), time.time(), "file", size)))
     return jsonify({"ok": True, "evidence_id": eid})
 
+@app.route("/api/evidence/segments/missing", methods=["POST"])
+def evidence_segments_missing():
+    """Which of {"hashes": [...]} the store lacks; uploads skip the rest."""
+    hashes = (request.json or {}).get("hashes") or []
+    return jsonify({"missing": store.missing(hashes[:1000])})
+
+@app.route("/api/evidence/segments/<sha>", methods=["PUT"])
+def evidence_segment_put(sha):
+    """Raw EVS1 segment body; encrypted as it streams in and checked against its sha256."""
+    try:
+        created = store.put_segment(sha, request.stream)
+    except evidence_store.SegmentMismatch as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"ok": True, "stored": created}), 201 if created else 200
+
+@app.route("/api/evidence/manifest", methods=["POST"])
+def evidence_manifest():
+    """{"alert_id", "segments": [{"sha256", "start", "end", "frames"}], "fps"}: a clip made of stored segments."""
+    data = request.json or {}
+    alert_id, segments = data.get("alert_id"), data.get("segments")
+    if not alert_id or not segments:
+        return jsonify({"error": "missing"}), 400
+    eid, missing = store.add_manifest(alert_id, segments, data.get("fps"))
+    if missing:
+        return jsonify({"error": "segments missing", "missing": missing}), 409
+    # the playback copy is rendered (and encrypted) by a worker, not on first view
+    queue.enqueue("render", {"evidence_id": eid}, key=f"render:{eid}")
+    return jsonify({"ok": True, "evidence_id": eid}), 201
+
+@app.route("/api/evidence/usage", methods=["GET"])
+def evidence_usage():
+    return jsonify({"bytes": store.usage(), "quota_bytes": store.quota_bytes,
+                    "retention_days": store.retention_days, "jobs": queue.stats()})
+
 @app.route("/api/evidence", methods=["GET"])
 def list_evidence():
-    conn = sqlite3.connect(DB); c = conn.cursor()
-    rows = c.execute("SELECT id, alert_id, filename, timestamp FROM evidence").fetchall()
-    conn.close()
-    out = [{"id": r[0], "alert_id": r[1], "path": r[2], "timestamp": r[3]} for r in rows]
+    rows = db.query("SELECT id, alert_id, filename, timestamp, kind FROM evidence")
+    out = [{"id": r[0], "alert_id": r[1], "path": r[2], "timestamp": r[3], "kind": r[4] or "file"} for r in rows]
     return jsonify(out)
 
+def evidence_container(row, evidence_id):
+    """Encrypted file behind an evidence row; segmented clips are rendered (and cached) first."""
+    if row[1] == "segments":
+        return store.rendered(evidence_id, row[2])
+    return row[0] if row[0] and os.path.exists(row[0]) else None
+
 @app.route("/api/download/<evidence_id>", methods=["GET"])
 def download_evidence(evidence_id):
-    conn = sqlite3.connect(DB); c = conn.cursor()
-    row = c.execute("SELECT filename FROM evidence WHERE id=?", (evidence_id,)).fetchone()
-    conn.close()
+    row = db.one(SQL_EVIDENCE_FILE, (evidence_id,))
+    if not row:
+        return "Not found", 404
+    try:
+        path = evidence_container(row, evidence_id)
+    except ImportError:
+        return "rendering segmented evidence needs opencv-python", 501
+    if not path:
+        return "Not found", 404
+    return send_file(path, as_attachment=True)
+
+@app.route("/api/evidence/<evidence_id>/video", methods=["GET"])
+def stream_evidence(evidence_id):
+    """Decrypted clip, streamed segment by segment; honours HTTP Range for seeking."""
+    row = db.one(SQL_EVIDENCE_FILE, (evidence_id,))
     if not row:
         return "Not found", 404
-    return send_file(row[0], as_attachment=True)
+    try:
+        path = evidence_container(row, evidence_id)
+    except ImportError:
+        return "rendering segmented evidence needs opencv-python", 501
+    if not path:
+        return "Not found", 404
+    path = str(path)
+    if not evidence_crypto.is_container(path):
+        # evidence from before the chunked format: single Fernet token
+        return Response(fernet.decrypt(Path(path).read_bytes()), mimetype="video/mp4")
+    total = evidence_crypto.plaintext_size(path)
+    headers = {"Accept-Ranges": "bytes"}
+    rng = request.range.range_for_length(total) if request.range else None
+    if request.range and rng is None:
+        return Response(status=416, headers={"Content-Range": f"bytes */{total}"})
+    start, stop = rng if rng else (0, total)
+    headers["Content-Length"] = str(stop - start)
+    body = stream_with_context(evidence_crypto.decrypt_range(path, stream_key, start, stop))
+    if rng:
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{total}"
+        return Response(body, status=206, mimetype="video/mp4", headers=headers)
+    return Response(body, mimetype="video/mp4", headers=headers)
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000)
+    # development server; in production wsgi.py runs under gunicorn next to worker.py
+    app.run(host="0.0.0.0", port=8000, threaded=True)
@@ -0,0 +1,80 @@
+"""
+Evidence encryption benchmark: old whole-file Fernet path vs chunked EVC1 streaming.
+Reports throughput and peak Python heap (tracemalloc) for encrypt and decrypt.
+
+    python bench_crypto.py --size-mb 64
+"""
+import os, time, argparse, tempfile, tracemalloc
+from pathlib import Path
+from cryptography.fernet import Fernet
+import evidence_crypto
+
+CHUNK = 64 * 1024
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return dt, peak
+
+
+def old_encrypt(src, workdir, fernet):
+    # mirrors the previous upload_evidence: save upload, read_bytes, encrypt, write
+    raw = workdir / "upload.raw"
+    with open(src, "rb") as f, open(raw, "wb") as out:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            out.write(chunk)
+    (workdir / "old.enc").write_bytes(fernet.encrypt(raw.read_bytes()))
+    raw.unlink()
+
+
+def new_encrypt(src, workdir, key):
+    # mirrors EvidenceRequest: encrypt chunks as they arrive from the request stream
+    w = evidence_crypto.EncryptingWriter(str(workdir / "new.enc"), key)
+    with open(src, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            w.write(chunk)
+    w.finish()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size-mb", type=int, default=64)
+    args = ap.parse_args()
+
+    fkey = Fernet.generate_key()
+    fernet = Fernet(fkey)
+    key = evidence_crypto.derive_key(fkey)
+    size = args.size_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as d:
+        workdir = Path(d)
+        src = workdir / "clip.bin"
+        with open(src, "wb") as f:
+            for _ in range(size // CHUNK):
+                f.write(os.urandom(CHUNK))
+
+        rows = [
+            ("fernet encrypt", measure(lambda: old_encrypt(src, workdir, fernet))),
+            ("chunked encrypt", measure(lambda: new_encrypt(src, workdir, key))),
+            ("fernet decrypt", measure(lambda: fernet.decrypt((workdir / "old.enc").read_bytes()))),
+            ("chunked decrypt", measure(lambda: evidence_crypto.decrypt_file(workdir / "new.enc", workdir / "out.bin", key))),
+        ]
+        mb = size / 1e6
+        print(f"{args.size_mb} MiB clip")
+        for label, (dt, peak) in rows:
+            print(f"{label:16s} {mb / dt:8.1f} MB/s   peak heap {peak / 1e6:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""
+Database access for the backend.
+- One connection per thread, reused across requests (no connect/close per route),
+  and closed when its thread exits (app.run(threaded=True) starts one per request).
+- SQLite runs in WAL mode with synchronous=NORMAL, so dashboard reads don't
+  block behind alert writes. Every connection keeps a statement cache, so the
+  hot queries (kept as fixed SQL strings in app.py) are prepared once per thread.
+- Writes go through a BatchWriter: a burst of alerts is committed as one
+  transaction (each write in its own savepoint) instead of one fsync per alert.
+- Schema and migrations live here only (MIGRATIONS, tracked in schema_version).
+- on_query, if set, is called with the seconds every query / write took
+  (app.py turns it into per-route query time).
+- DATABASE_URL selects the backend: a path or sqlite:///path for SQLite,
+  postgresql://... for PostgreSQL (needs psycopg2). App code uses "?" placeholders
+  and the SQLite dialect, the PostgreSQL dialect rewrites what differs, so a local
+  SQLite file can stand in for PostgreSQL in tests.
+"""
+import os, time, base64, hashlib, sqlite3, threading, queue, weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+# SQLite tuning
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+STATEMENT_CACHE = 256
+# Group commit
+BATCH_MAX = 64
+BATCH_MAX_DELAY = 0.005
+
+
+class SqliteDialect:
+    name = "sqlite"
+    autoinc_pk = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    blob = "BLOB"
+    begin_write = "BEGIN IMMEDIATE"
+
+    def __init__(self, target):
+        self.path = target[len("sqlite:///"):] if target.startswith("sqlite:///") else target
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False,
+                               cached_statements=STATEMENT_CACHE, isolation_level=None,
+                               uri=self.path.startswith("file:"))
+        for p in SQLITE_PRAGMAS:
+            conn.execute(p)
+        return conn
+
+    def sql(self, q):
+        return q
+
+    def columns(self, c, table):
+        return [r[1] for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+class PostgresDialect:
+    name = "postgresql"
+    autoinc_pk = "BIGSERIAL PRIMARY KEY"
+    blob = "BYTEA"
+    begin_write = "BEGIN"
+
+    def __init__(self, target):
+        import psycopg2   # optional dependency, only needed for PostgreSQL
+        self.psycopg2 = psycopg2
+        self.url = target
+
+    def connect(self):
+        conn = self.psycopg2.connect(self.url)
+        conn.autocommit = True    # transactions are explicit, like the SQLite side
+        return conn
+
+    def sql(self, q):
+        q = q.replace("?", "%s")
+        if q.lstrip().upper().startswith("INSERT OR IGNORE"):
+            q = q.replace("INSERT OR IGNORE", "INSERT", 1) + " ON CONFLICT DO NOTHING"
+        return q
+
+    def columns(self, c, table):
+        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name=%s", (table,))
+        return [r[0] for r in c.fetchall()]
+
+
+class Cursor:
+    """Thin cursor wrapper that translates SQL for the active dialect."""
+
+    def __init__(self, raw, dialect):
+        self.raw = raw
+        self.dialect = dialect
+
+    def execute(self, q, args=()):
+        self.raw.execute(self.dialect.sql(q), tuple(args))
+        return self
+
+    def fetchone(self):
+        return self.raw.fetchone()
+
+    def fetchall(self):
+        return self.raw.fetchall()
+
+    @property
+    def rowcount(self):
+        return self.raw.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.raw.lastrowid
+
+
+class _ThreadConn:
+    """Holds a thread's connection in Database.local; dropped (and the
+    connection closed) when the thread exits."""
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+
+
+def _close_quietly(conn):
+    try: conn.close()
+    except Exception: pass
+
+
+class Database:
+    def __init__(self, url, log=print):
+        self.url = url
+        self.log = log            # callable(message) for migration notes
+        self.dialect = PostgresDialect(url) if url.startswith(("postgres://", "postgresql://")) else SqliteDialect(url)
+        self.local = threading.local()
+        self.all_conns = weakref.WeakSet()   # _ThreadConn of live threads
+        self.lock = threading.Lock()
+        self.writer = BatchWriter(self)
+        self.writer.start()
+        self.on_query = None      # callable(seconds), see module docstring
+
+    # ----- connections -----
+    def conn(self):
+        held = getattr(self.local, "conn", None)
+        if held is None:
+            held = _ThreadConn(self.dialect.connect())
+            weakref.finalize(held, _close_quietly, held.conn)
+            self.local.conn = held
+            with self.lock:
+                self.all_conns.add(held)
+        return held.conn
+
+    def cursor(self):
+        return Cursor(self.conn().cursor(), self.dialect)
+
+    def close(self):
+        self.writer.stop()
+        with self.lock:
+            for held in list(self.all_conns):
+                _close_quietly(held.conn)
+            self.all_conns = weakref.WeakSet()
+        self.local = threading.local()
+
+    def _timed(self, t0):
+        if self.on_query is not None:
+            self.on_query(time.perf_counter() - t0)
+
+    # ----- reads -----
+    def query(self, q, args=()):
+        t0 = time.perf_counter()
+        try:
+            return self.cursor().execute(q, args).fetchall()
+        finally:
+            self._timed(t0)
+
+    def one(self, q, args=()):
+        t0 = time.perf_counter()
+        try:
+            return self.cursor().execute(q, args).fetchone()
+        finally:
+            self._timed(t0)
+
+    def scalar(self, q, args=()):
+        r = self.one(q, args)
+        return r[0] if r else None
+
+    # ----- writes -----
+    @contextmanager
+    def transaction(self):
+        """Immediate transaction on this thread's connection, for writes outside the batcher."""
+        c = self.cursor()
+        c.execute(self.dialect.begin_write)
+        try:
+            yield c
+            c.execute("COMMIT")
+        except BaseException:
+            # also when COMMIT itself failed (busy, disk full): the connection is reused by
+            # this thread and must not stay inside the transaction
+            try:
+                c.execute("ROLLBACK")
+            except Exception:
+                pass          # the failed COMMIT already ended it
+            raise
+
+    def write(self, fn):
+        """Run fn(cursor) in the next group-commit batch and return its result once committed."""
+        t0 = time.perf_counter()
+        try:
+            return self.writer.submit(fn).result()
+        finally:
+            self._timed(t0)
+
+    # ----- schema -----
+    def migrate(self):
+        with self.transaction() as c:
+            c.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER)")
+            current = c.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+            for version, step in MIGRATIONS:
+                if version > current:
+                    note = step(c, self.dialect)
+                    c.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+                    self.log(f"Applied schema migration {version}")
+                    if note:
+                        self.log(note)
+
+
+class BatchWriter(threading.Thread):
+    """Collects write functions and commits them together (group commit)."""
+
+    def __init__(self, db, max_batch=BATCH_MAX, max_delay=BATCH_MAX_DELAY):
+        super().__init__(daemon=True)
+        self.name = "db-writer"
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = queue.Queue()
+        self.shutdown_flag = threading.Event()
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, fn):
+        fut = Future()
+        self.pending.put((fn, fut))
+        return fut
+
+    def stop(self):
+        self.shutdown_flag.set()
+
+    def _gather(self):
+        try:
+            first = self.pending.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                batch.append(self.pending.get(timeout=remaining) if remaining > 0 else self.pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not self.shutdown_flag.is_set():
+            batch = self._gather()
+            if not batch:
+                continue
+            done = []
+            try:
+                with self.db.transaction() as c:
+                    for i, (fn, fut) in enumerate(batch):
+                        # a failing write only rolls back itself, not the rest of the batch
+                        c.execute(f"SAVEPOINT w{i}")
+                        try:
+                            done.append((fut, fn(c), None))
+                            c.execute(f"RELEASE SAVEPOINT w{i}")
+                        except Exception as e:
+                            c.execute(f"ROLLBACK TO SAVEPOINT w{i}")
+                            c.execute(f"RELEASE SAVEPOINT w{i}")
+                            done.append((fut, None, e))
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.batches += 1
+            self.writes += len(batch)
+            for fut, result, err in done:
+                if err is not None:
+                    fut.set_exception(err)
+                else:
+                    fut.set_result(result)
+
+
+# ---------- schema ----------
+
+def store_snapshot(c, jpeg):
+    """Insert JPEG bytes into the snapshot store (deduplicated); returns the sha256 key."""
+    sha = hashlib.sha256(jpeg).hexdigest()
+    c.execute("INSERT OR IGNORE INTO snapshots (sha256, data, size, timestamp) VALUES (?,?,?,?)",
+              (sha, jpeg, len(jpeg), time.time()))
+    return sha
+
+
+def _m1_base(c, d):
+    c.execute('''CREATE TABLE IF NOT EXISTS alerts (
+                    id TEXT PRIMARY KEY,
+                    device_id TEXT,
+                    location TEXT,
+                    cls TEXT,
+                    confidence REAL,
+                    status TEXT,
+                    timestamp REAL,
+                    frame_b64 TEXT
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS evidence (
+                    id TEXT PRIMARY KEY,
+                    alert_id TEXT,
+                    filename TEXT,
+                    timestamp REAL
+                )''')
+
+
+def _m2_change_feed(c, d):
+    # one row per alert creation / status transition, seq is the cursor
+    c.execute(f'''CREATE TABLE IF NOT EXISTS alert_events (
+                    seq {d.autoinc_pk},
+                    alert_id TEXT,
+                    status TEXT,
+                    timestamp REAL
+                )''')
+
+
+def _m3_snapshots(c, d, batch=200):
+    # snapshots live outside the alerts table, keyed by the sha256 of the JPEG
+    c.execute(f'''CREATE TABLE IF NOT EXISTS snapshots (
+                    sha256 TEXT PRIMARY KEY,
+                    data {d.blob},
+                    size INTEGER,
+                    timestamp REAL
+                )''')
+    if "snapshot_sha" not in d.columns(c, "alerts"):
+        c.execute("ALTER TABLE alerts ADD COLUMN snapshot_sha TEXT")
+    # move base64 snapshots left in alerts.frame_b64 by older versions
+    moved = 0
+    while True:
+        rows = c.execute("SELECT id, frame_b64 FROM alerts WHERE frame_b64 IS NOT NULL LIMIT ?", (batch,)).fetchall()
+        if not rows:
+            break
+        for aid, b64 in rows:
+            try:
+                sha = store_snapshot(c, base64.b64decode(b64))
+            except Exception:
+                sha = None
+            c.execute("UPDATE alerts SET snapshot_sha=?, frame_b64=NULL WHERE id=?", (sha, aid))
+        moved += len(rows)
+    if moved:
+        return f"Moved {moved} inline snapshots to the snapshots table (run VACUUM to reclaim space)"
+
+
+def _m4_indexes(c, d):
+    c.execute("CREATE INDEX IF NOT EXISTS alerts_status_ts ON alerts (status, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS alerts_device_ts ON alerts (device_id, timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS evidence_alert ON evidence (alert_id)")
+
+
+def _m5_evidence_segments(c, d):
+    # evidence is a whole encrypted file (kind 'file') or a manifest of shared segments (see evidence_store.py)
+    cols = d.columns(c, "evidence")
+    for col, typ in (("kind", "TEXT"), ("size", "INTEGER"), ("fps", "REAL")):
+        if col not in cols:
+            c.execute(f"ALTER TABLE evidence ADD COLUMN {col} {typ}")
+    c.execute('''CREATE TABLE IF NOT EXISTS evidence_segments (
+                    sha256 TEXT PRIMARY KEY,
+                    size INTEGER,
+                    stored_size INTEGER,
+                    tier TEXT,
+                    created REAL,
+                    last_used REAL
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS evidence_manifest (
+                    evidence_id TEXT,
+                    seq INTEGER,
+                    sha256 TEXT,
+                    start_ts REAL,
+                    end_ts REAL,
+                    frames INTEGER,
+                    PRIMARY KEY (evidence_id, seq)
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS evidence_manifest_sha ON evidence_manifest (sha256)")
+    c.execute("CREATE INDEX IF NOT EXISTS evidence_ts ON evidence (timestamp)")
+    # sizes of existing whole-file evidence, for the quota
+    rows = c.execute("SELECT id, filename FROM evidence WHERE kind IS NULL").fetchall()
+    for eid, filename in rows:
+        size = os.path.getsize(filename) if filename and os.path.exists(filename) else 0
+        c.execute("UPDATE evidence SET kind='file', size=? WHERE id=?", (size, eid))
+    if rows:
+        return f"Recorded sizes of {len(rows)} evidence files for the storage quota"
+
+
+def _m6_jobs(c, d):
+    # job queue shared by the API and the workers (jobs.DatabaseQueue); done jobs are deleted
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT,
+                    key TEXT,
+                    payload TEXT,
+                    state TEXT,
+                    attempts INTEGER,
+                    run_at REAL,
+                    lease_until REAL,
+                    worker TEXT,
+                    error TEXT,
+                    created REAL
+                )''')
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+    c.execute("CREATE INDEX IF NOT EXISTS jobs_runnable ON jobs (state, run_at)")
+    # small JPEGs for the dashboards, made by the thumbnail job
+    if "thumb" not in d.columns(c, "snapshots"):
+        c.execute(f"ALTER TABLE snapshots ADD COLUMN thumb {d.blob}")
+
+
+def _m7_alert_keys(c, d):
+    # client-chosen key per alert, so a retried POST returns the alert it already created
+    if "idempotency_key" not in d.columns(c, "alerts"):
+        c.execute("ALTER TABLE alerts ADD COLUMN idempotency_key TEXT")
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS alerts_idempotency_key ON alerts (idempotency_key)")
+
+
+# (version, step); steps are idempotent so databases created before
+# schema_version existed migrate cleanly. A step may return a note to log
+MIGRATIONS = [
+    (1, _m1_base),
+    (2, _m2_change_feed),
+    (3, _m3_snapshots),
+    (4, _m4_indexes),
+    (5, _m5_evidence_segments),
+    (6, _m6_jobs),
+    (7, _m7_alert_keys),
+]
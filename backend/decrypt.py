@@ -1,33 +1,99 @@
+"""
+Decrypt stored evidence for offline review.
+- The key and EVIDENCE_DIR come from settings.py (EVIDENCE_KEY or
+  EVIDENCE_KEY_FILE, EVIDENCE_DIR), the same environment the API and the
+  workers run with; a missing key file is an error here, never created.
+- Default: every whole-file evidence (EVIDENCE_DIR/*.enc) and every rendered
+  clip in the render cache (EVIDENCE_DIR/render/*.evc).
+- --clip ID renders a segmented clip first (needs DATABASE_URL and OpenCV).
+"""
 from cryptography.fernet import Fernet
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import os, sys, argparse
+import settings     # first: puts the shared YOLOv8 modules (metrics.py) on the path
+import evidence_crypto
+import metrics
 
+DECRYPTED_DIR = Path(os.environ.get("DECRYPTED_DIR", "decrypted_videos"))
 
-FERNET_KEY_FILE = "fernet.key"   
-EVIDENCE_DIR = Path("evidence") 
-DECRYPTED_DIR = Path("decrypted_videos")
-DECRYPTED_DIR.mkdir(exist_ok=True)
 
+def load_key():
+    if settings.KEY:
+        return settings.KEY.encode()
+    try:
+        return settings.KEY_FILE.read_bytes().strip()
+    except FileNotFoundError:
+        sys.exit(f"No evidence key: set EVIDENCE_KEY or EVIDENCE_KEY_FILE ({settings.KEY_FILE} does not exist)")
 
-key = Path(FERNET_KEY_FILE).read_text().strip()
-fernet = Fernet(key.encode())
 
+def out_path(enc_file, out_dir):
+    # <id>.enc / <id>.evc -> <id> (whole files keep their own extension), rendered clips -> <id>.mp4
+    enc_file = Path(enc_file)
+    return out_dir / (enc_file.stem + ".mp4" if enc_file.suffix == ".evc" else enc_file.stem)
 
-enc_files = list(EVIDENCE_DIR.glob("*.enc"))
 
-if not enc_files:
-    print("No encrypted files found in evidence/")
-else:
-    for enc_file in enc_files:
-        print(f"Decrypting {enc_file.name}...")
-        enc_data = enc_file.read_bytes()
-        try:
-            decrypted_data = fernet.decrypt(enc_data)
-         
-            original_name = enc_file.stem  
-            out_path = DECRYPTED_DIR / original_name
-            out_path.write_bytes(decrypted_data)
-            print(f"Saved decrypted video as {out_path}")
-        except Exception as e:
-            print(f"Failed to decrypt {enc_file.name}: {e}")
+def decrypt_one(enc_file, key=None, out_dir=DECRYPTED_DIR):
+    """Decrypt one evidence file into out_dir. Chunked (EVC1) files are
+    streamed with constant memory; older single-token Fernet files are loaded whole."""
+    key = key or load_key()
+    enc_file = Path(enc_file)
+    dest = out_path(enc_file, out_dir)
+    try:
+        if evidence_crypto.is_container(enc_file):
+            evidence_crypto.decrypt_file(enc_file, dest, evidence_crypto.derive_key(key))
+        else:
+            dest.write_bytes(Fernet(key).decrypt(enc_file.read_bytes()))
+        return f"Saved decrypted video as {dest}"
+    except Exception as e:
+        return f"Failed to decrypt {enc_file.name}: {e}"
 
-print("Done!")
+
+def render_clips(ids):
+    """Encrypted mp4 paths of segmented clips, rendered (and cached) by the evidence store."""
+    if not ids:
+        return []
+    svc = settings.Services(metrics.get_logger("decrypt"))
+    paths = []
+    for eid in ids:
+        path = svc.store.rendered(eid)
+        if path is None:
+            print(f"Clip {eid} has no stored frames")
+        else:
+            paths.append(path)
+    svc.db.close()
+    return paths
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Decrypt evidence from EVIDENCE_DIR into decrypted_videos/")
+    ap.add_argument("files", nargs="*", help="specific .enc / .evc files (default: all in EVIDENCE_DIR)")
+    ap.add_argument("--clip", nargs="+", default=[], metavar="ID", help="segmented clips (evidence ids) to render")
+    ap.add_argument("-o", "--out", type=Path, default=DECRYPTED_DIR, help="output directory")
+    ap.add_argument("-j", "--jobs", type=int, default=1, help="decrypt this many files in parallel")
+    args = ap.parse_args()
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    key = load_key()
+    enc_files = [Path(f) for f in args.files] + render_clips(args.clip)
+    if not args.files and not args.clip:
+        enc_files = sorted(settings.EVIDENCE_DIR.glob("*.enc")) + sorted((settings.EVIDENCE_DIR / "render").glob("*.evc"))
+
+    if not enc_files:
+        print(f"No encrypted files found in {settings.EVIDENCE_DIR}/")
+    elif args.jobs > 1:
+        print(f"Decrypting {len(enc_files)} files with {args.jobs} workers...")
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            n = len(enc_files)
+            for msg in pool.map(decrypt_one, enc_files, [key] * n, [args.out] * n):
+                print(msg)
+    else:
+        for enc_file in enc_files:
+            print(f"Decrypting {enc_file.name}...")
+            print(decrypt_one(enc_file, key, args.out))
+
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Chunked authenticated encryption for evidence files (container format "EVC1").
+- The plaintext is split into fixed-size segments, each sealed with AES-256-GCM,
+  so files are encrypted while the upload streams in and can be decrypted
+  piecewise (HTTP Range) with constant memory.
+- Nonce = 7-byte random prefix | 4-byte segment counter | 1-byte last flag
+  (the STREAM construction): reordering, dropping or truncating segments fails
+  authentication. The header is bound into every segment as associated data.
+- The AES key is derived from the existing Fernet key with HKDF, so no new
+  key material has to be distributed.
+
+Layout: MAGIC(4) VERSION(1) SEGMENT_SIZE(4, big endian) NONCE_PREFIX(7)
+        then segments of (ciphertext + 16-byte tag); the last one may be short.
+
+STATS counts the bytes and seconds spent sealing / opening segments
+(encryption throughput, exported as metrics by app.py).
+"""
+import os, time, struct, base64, threading
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives import hashes
+
+MAGIC = b"EVC1"
+VERSION = 1
+HEADER_SIZE = 16
+TAG_SIZE = 16
+DEFAULT_SEGMENT_SIZE = 64 * 1024
+
+STATS = {"encrypt_bytes": 0, "encrypt_seconds": 0.0, "decrypt_bytes": 0, "decrypt_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _account(op, nbytes, seconds):
+    with _stats_lock:
+        STATS[op + "_bytes"] += nbytes
+        STATS[op + "_seconds"] += seconds
+
+
+def derive_key(fernet_key):
+    """AES-256 key for the container, derived from the base64 Fernet key."""
+    raw = base64.urlsafe_b64decode(fernet_key)
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"evidence-stream-v1").derive(raw)
+
+
+def _nonce(prefix, counter, last):
+    return prefix + struct.pack(">IB", counter, 1 if last else 0)
+
+
+def is_container(path):
+    with open(path, "rb") as f:
+        return f.read(4) == MAGIC
+
+
+class EncryptingWriter:
+    """Write-only file object: plaintext in, EVC1 container out to path.
+    Call finish() (or close()) after the last write to seal the final segment."""
+
+    def __init__(self, path, key, segment_size=DEFAULT_SEGMENT_SIZE):
+        self.path = path
+        self.aead = AESGCM(key)
+        self.segment_size = segment_size
+        self.prefix = os.urandom(7)
+        self.header = MAGIC + struct.pack(">BI", VERSION, segment_size) + self.prefix
+        self.f = open(path, "wb")
+        self.f.write(self.header)
+        self.buf = bytearray()
+        self.counter = 0
+        self.plaintext_size = 0
+        self.finished = False
+
+    def _seal(self, chunk, last):
+        t0 = time.perf_counter()
+        sealed = self.aead.encrypt(_nonce(self.prefix, self.counter, last), bytes(chunk), self.header)
+        _account("encrypt", len(chunk), time.perf_counter() - t0)
+        self.f.write(sealed)
+        self.counter += 1
+
+    def write(self, data):
+        if self.finished:
+            raise ValueError("write after finish")
+        self.buf += data
+        self.plaintext_size += len(data)
+        # keep at least one byte buffered: the last segment must be sealed with the last flag
+        while len(self.buf) > self.segment_size:
+            self._seal(self.buf[:self.segment_size], False)
+            del self.buf[:self.segment_size]
+        return len(data)
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self._seal(self.buf, True)
+            self.buf = bytearray()
+            self.f.close()
+        return self.path
+
+    close = finish
+
+    def seek(self, pos, whence=0):
+        # werkzeug seeks to 0 once a multipart file part is complete; nothing to rewind
+        return 0
+
+    def abort(self):
+        """Discard a partial container."""
+        try: self.f.close()
+        except Exception: pass
+        try: os.remove(self.path)
+        except OSError: pass
+        self.finished = True
+
+
+def encrypt_file(src, dst, key, segment_size=DEFAULT_SEGMENT_SIZE):
+    w = EncryptingWriter(dst, key, segment_size)
+    with open(src, "rb") as f:
+        while True:
+            chunk = f.read(segment_size)
+            if not chunk:
+                break
+            w.write(chunk)
+    return w.finish()
+
+
+def _read_header(f):
+    header = f.read(HEADER_SIZE)
+    if len(header) != HEADER_SIZE or header[:4] != MAGIC:
+        raise ValueError("not an EVC1 container")
+    version, segment_size = struct.unpack(">BI", header[4:9])
+    if version != VERSION:
+        raise ValueError(f"unsupported container version {version}")
+    return header, segment_size, header[9:16]
+
+
+def plaintext_size(path):
+    with open(path, "rb") as f:
+        _, segment_size, _ = _read_header(f)
+    body = os.path.getsize(path) - HEADER_SIZE
+    full = segment_size + TAG_SIZE
+    nseg = max(1, -(-body // full))
+    return (nseg - 1) * segment_size + (body - (nseg - 1) * full - TAG_SIZE)
+
+
+def decrypt_range(path, key, start=0, end=None):
+    """Yield plaintext bytes [start, end) decrypting only the segments that cover them."""
+    total = plaintext_size(path)
+    end = total if end is None else min(end, total)
+    if start >= end and total > 0:
+        return
+    aead = AESGCM(key)
+    with open(path, "rb") as f:
+        header, segment_size, prefix = _read_header(f)
+        nseg = max(1, -(-total // segment_size)) if total else 1
+        full = segment_size + TAG_SIZE
+        first = start // segment_size
+        f.seek(HEADER_SIZE + first * full)
+        for idx in range(first, nseg):
+            seg_start = idx * segment_size
+            if seg_start >= end and total > 0:
+                break
+            last = idx == nseg - 1
+            ct = f.read(full if not last else (total - seg_start) + TAG_SIZE)
+            t0 = time.perf_counter()
+            pt = aead.decrypt(_nonce(prefix, idx, last), ct, header)
+            _account("decrypt", len(pt), time.perf_counter() - t0)
+            lo = max(0, start - seg_start)
+            hi = min(len(pt), end - seg_start)
+            if hi > lo:
+                yield pt[lo:hi]
+
+
+def decrypt_file(src, dst, key):
+    """Streaming decrypt of a whole container to dst; returns bytes written."""
+    n = 0
+    tmp = str(dst) + ".part"
+    with open(tmp, "wb") as out:
+        for chunk in decrypt_range(src, key):
+            out.write(chunk)
+            n += len(chunk)
+    os.replace(tmp, dst)
+    return n
@@ -0,0 +1,336 @@
+"""
+Content-addressed evidence segments with manifests, retention, tiering and a quota.
+- Detectors upload clips as EVS1 segments (YOLOv8/evidence_segments.py):
+  missing() tells them which hashes are not stored yet, put_segment() stores
+  one, encrypted as an EVC1 container while its sha256 is verified, and
+  add_manifest() records a clip as an ordered list of segments. Segments are
+  stored once; overlapping clips and retried uploads share them.
+- Files: EVIDENCE_DIR/segments/<aa>/<sha256>.evc (hot tier) or the same under
+  cold_dir once unused for cold_after_days (cold tier, e.g. a bigger slower
+  disk); rendered mp4s (for the player) are cached encrypted in
+  EVIDENCE_DIR/render and trimmed least recently used first.
+- maintain(), run every MAINTENANCE_INTERVAL as a worker job (worker.py):
+    retention  - evidence older than retention_days is deleted
+    quota      - while the store is over quota_bytes, the oldest evidence
+                 (older than QUOTA_MIN_AGE) is deleted first
+    compaction - segments no manifest refers to (past SEGMENT_GRACE, so
+                 uploads waiting for their manifest survive) and stale
+                 temp files are removed, the render cache is trimmed and
+                 idle segments move to the cold tier
+- Whole-file evidence (the /api/upload_evidence path) counts against the
+  quota and falls under the same retention.
+"""
+import os, time, uuid, hashlib, threading
+from pathlib import Path
+import evidence_crypto
+import metrics
+
+# Defaults (settings.py overrides them from the environment)
+RETENTION_DAYS = 90
+QUOTA_BYTES = 20 * 1024 ** 3
+COLD_AFTER_DAYS = 14
+RENDER_CACHE_BYTES = 512 * 1024 ** 2
+MAINTENANCE_INTERVAL = 300
+# Unreferenced segments younger than this are kept (manifest still to come)
+SEGMENT_GRACE = 3600
+# The quota never deletes evidence younger than this; it logs instead
+QUOTA_MIN_AGE = 24 * 3600
+# Largest segment body accepted
+SEGMENT_MAX_BYTES = 32 * 1024 * 1024
+# Evidence deleted per quota pass before the total is measured again
+QUOTA_BATCH = 20
+
+log = metrics.get_logger("evidence")
+STORE_BYTES = metrics.gauge("evidence_store_bytes", "Bytes on disk per tier", ("tier",))
+SEGMENT_COUNT = metrics.gauge("evidence_segments", "Stored segments")
+DEDUP_BYTES = metrics.counter("evidence_dedup_bytes_total", "Segment bytes a manifest reused instead of storing again")
+DELETED = metrics.counter("evidence_deleted_total", "Evidence removed by maintenance", ("reason",))
+
+SQL_SEGMENT = "SELECT tier FROM evidence_segments WHERE sha256=?"
+SQL_MANIFEST = '''SELECT m.sha256, s.tier FROM evidence_manifest m JOIN evidence_segments s ON s.sha256 = m.sha256
+           WHERE m.evidence_id=? ORDER BY m.seq'''
+
+
+class SegmentMismatch(ValueError):
+    pass
+
+
+class EvidenceStore:
+    def __init__(self, db, root, key, cold_dir=None, retention_days=RETENTION_DAYS, quota_bytes=QUOTA_BYTES,
+                 cold_after_days=COLD_AFTER_DAYS, render_cache_bytes=RENDER_CACHE_BYTES):
+        self.db = db
+        self.root = Path(root)
+        self.key = key
+        self.dirs = {"hot": self.root / "segments"}
+        if cold_dir:
+            self.dirs["cold"] = Path(cold_dir) / "segments"
+        self.render_dir = self.root / "render"
+        for d in list(self.dirs.values()) + [self.render_dir]:
+            d.mkdir(parents=True, exist_ok=True)
+        self.retention_days = retention_days
+        self.quota_bytes = quota_bytes
+        self.cold_after_days = cold_after_days
+        self.render_cache_bytes = render_cache_bytes
+        self.render_locks = {}
+        self.lock = threading.Lock()
+        self.last_run = {}
+        for tier in ("hot", "cold", "render", "files"):
+            STORE_BYTES.labels(tier).set_function(lambda t=tier: self.usage().get(t, 0))
+        SEGMENT_COUNT.set_function(lambda: self.db.scalar("SELECT COUNT(*) FROM evidence_segments") or 0)
+
+    # ----- paths -----
+    def segment_path(self, sha, tier="hot"):
+        return self.dirs.get(tier, self.dirs["hot"]) / sha[:2] / f"{sha}.evc"
+
+    def render_path(self, evidence_id):
+        return self.render_dir / f"{evidence_id}.evc"
+
+    # ----- upload -----
+    def missing(self, hashes):
+        hashes = [h for h in dict.fromkeys(hashes) if _is_sha(h)]
+        if not hashes:
+            return []
+        rows = self.db.query(f"SELECT sha256 FROM evidence_segments WHERE sha256 IN ({','.join('?' * len(hashes))})",
+                             hashes)
+        have = {r[0] for r in rows}
+        return [h for h in hashes if h not in have]
+
+    def put_segment(self, sha, stream, chunk_size=64 * 1024):
+        """Store one segment from a file-like body. Returns False if it was already stored.
+        Raises SegmentMismatch if the body does not hash to sha."""
+        if not _is_sha(sha):
+            raise SegmentMismatch("not a sha256")
+        if self.db.one(SQL_SEGMENT, (sha,)):
+            while stream.read(chunk_size):
+                pass
+            return False
+        path = self.segment_path(sha)
+        path.parent.mkdir(exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{uuid.uuid4().hex[:8]}.part")
+        w = evidence_crypto.EncryptingWriter(str(tmp), self.key)
+        h = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > SEGMENT_MAX_BYTES:
+                    raise SegmentMismatch("segment too large")
+                h.update(chunk)
+                w.write(chunk)
+            if h.hexdigest() != sha:
+                raise SegmentMismatch("sha256 does not match the body")
+            w.finish()
+        except Exception:
+            w.abort()
+            raise
+        os.replace(tmp, path)
+        now = time.time()
+        stored = path.stat().st_size
+        self.db.write(lambda c: c.execute(
+            "INSERT OR IGNORE INTO evidence_segments (sha256, size, stored_size, tier, created, last_used) "
+            "VALUES (?,?,?,?,?,?)", (sha, size, stored, "hot", now, now)))
+        return True
+
+    def add_manifest(self, alert_id, segments, fps=None):
+        """Record a clip. Returns (evidence_id, missing hashes); nothing is written if any
+        segment is missing. The id is derived from the content, so a retried upload
+        of the same clip returns the existing evidence."""
+        hashes = [s["sha256"] for s in segments]
+        digest = hashlib.sha256((alert_id + ":" + ",".join(hashes)).encode()).hexdigest()
+        eid = str(uuid.UUID(digest[:32]))
+        now = time.time()
+
+        def apply(c):
+            uniq = list(dict.fromkeys(hashes))
+            have = {r[0] for r in c.execute(
+                f"SELECT sha256 FROM evidence_segments WHERE sha256 IN ({','.join('?' * len(uniq))})", uniq).fetchall()}
+            missing = [h for h in uniq if h not in have]
+            if missing:
+                return missing
+            if c.execute("SELECT 1 FROM evidence WHERE id=?", (eid,)).fetchone():
+                return []
+            shared = c.execute(f"SELECT SUM(size) FROM evidence_segments WHERE sha256 IN ({','.join('?' * len(uniq))}) "
+                               "AND sha256 IN (SELECT sha256 FROM evidence_manifest)", uniq).fetchone()[0]
+            c.execute("INSERT INTO evidence (id, alert_id, filename, timestamp, kind, fps) VALUES (?,?,?,?,?,?)",
+                      (eid, alert_id, None, now, "segments", fps))
+            for seq, s in enumerate(segments):
+                c.execute("INSERT INTO evidence_manifest (evidence_id, seq, sha256, start_ts, end_ts, frames) "
+                          "VALUES (?,?,?,?,?,?)", (eid, seq, s["sha256"], s.get("start"), s.get("end"), s.get("frames")))
+            c.execute(f"UPDATE evidence_segments SET last_used=? WHERE sha256 IN ({','.join('?' * len(uniq))})",
+                      [now] + uniq)
+            if shared:
+                DEDUP_BYTES.inc(shared)
+            return []
+
+        if not hashes:
+            raise ValueError("empty manifest")
+        missing = self.db.write(apply)
+        return (None, missing) if missing else (eid, [])
+
+    # ----- playback -----
+    def segment_datas(self, evidence_id):
+        """Decrypted EVS1 bytes of a clip's segments, in order."""
+        for sha, tier in self.db.query(SQL_MANIFEST, (evidence_id,)):
+            yield b"".join(evidence_crypto.decrypt_range(str(self.segment_path(sha, tier)), self.key))
+
+    def rendered(self, evidence_id, fps=None):
+        """Path of the clip rendered to an encrypted mp4 (EVC1), rendering it once.
+        Needs OpenCV; the plaintext mp4 only exists while it is being encrypted."""
+        path = self.render_path(evidence_id)
+        with self.lock:
+            lock = self.render_locks.setdefault(evidence_id, threading.Lock())
+        try:
+            with lock:
+                if not path.exists():
+                    from evidence_segments import render_mp4   # imports cv2
+                    # unique names: other API / worker processes may render the same clip at once
+                    tag = uuid.uuid4().hex[:8]
+                    plain = self.render_dir / f"{evidence_id}.{tag}.part.mp4"
+                    tmp = path.with_name(f"{path.name}.{tag}.part")
+                    try:
+                        if not render_mp4(self.segment_datas(evidence_id), str(plain), fps or 5):
+                            return None
+                        evidence_crypto.encrypt_file(str(plain), str(tmp), self.key)
+                        os.replace(tmp, path)
+                    finally:
+                        _unlink(plain)
+                        _unlink(tmp)
+                os.utime(path)     # LRU order for the cache trim
+        finally:
+            with self.lock:
+                self.render_locks.pop(evidence_id, None)
+        return path
+
+    # ----- maintenance -----
+    def usage(self):
+        """Bytes per tier: hot / cold segments, render cache, whole-file evidence."""
+        out = {t: n or 0 for t, n in self.db.query(
+            "SELECT tier, SUM(stored_size) FROM evidence_segments GROUP BY tier")}
+        out["render"] = sum(p.stat().st_size for p in self.render_dir.glob("*.evc"))
+        out["files"] = self.db.scalar("SELECT SUM(size) FROM evidence WHERE kind='file'") or 0
+        return out
+
+    def delete_evidence(self, ids, reason):
+        """Remove evidence rows (+ manifests, whole files and renders); segments are
+        reclaimed by the next compaction once nothing refers to them."""
+        if not ids:
+            return 0
+        marks = ",".join("?" * len(ids))
+
+        def apply(c):
+            files = [r[0] for r in c.execute(f"SELECT filename FROM evidence WHERE id IN ({marks}) "
+                                             "AND filename IS NOT NULL", ids).fetchall()]
+            c.execute(f"DELETE FROM evidence_manifest WHERE evidence_id IN ({marks})", ids)
+            c.execute(f"DELETE FROM evidence WHERE id IN ({marks})", ids)
+            return files
+        for f in self.db.write(apply):
+            _unlink(Path(f))
+        for eid in ids:
+            _unlink(self.render_path(eid))
+        DELETED.labels(reason).inc(len(ids))
+        return len(ids)
+
+    def apply_retention(self, now):
+        if not self.retention_days:
+            return 0
+        cutoff = now - self.retention_days * 86400
+        ids = [r[0] for r in self.db.query("SELECT id FROM evidence WHERE timestamp < ?", (cutoff,))]
+        n = self.delete_evidence(ids, "retention")
+        if n:
+            log.info("retention removed evidence", evidence=n, days=self.retention_days)
+        return n
+
+    def enforce_quota(self, now):
+        if not self.quota_bytes:
+            return 0
+        removed = 0
+        while True:
+            total = sum(self.usage().values())
+            if total <= self.quota_bytes:
+                return removed
+            ids = [r[0] for r in self.db.query("SELECT id FROM evidence WHERE timestamp < ? ORDER BY timestamp LIMIT ?",
+                                               (now - QUOTA_MIN_AGE, QUOTA_BATCH))]
+            if not ids:
+                log.error("evidence store over quota, nothing old enough to delete",
+                          used_mb=total // 2 ** 20, quota_mb=self.quota_bytes // 2 ** 20)
+                return removed
+            removed += self.delete_evidence(ids, "quota")
+            self.compact(now)
+            log.warning("quota removed oldest evidence", evidence=len(ids), used_mb=total // 2 ** 20,
+                        quota_mb=self.quota_bytes // 2 ** 20)
+
+    def compact(self, now, grace=SEGMENT_GRACE):
+        """Delete unreferenced segments, stale temp files and old renders; move idle segments cold."""
+        def apply(c):
+            rows = c.execute("SELECT sha256, tier FROM evidence_segments s WHERE created < ? AND NOT EXISTS "
+                             "(SELECT 1 FROM evidence_manifest m WHERE m.sha256 = s.sha256)",
+                             (now - grace,)).fetchall()
+            for sha, _ in rows:
+                c.execute("DELETE FROM evidence_segments WHERE sha256=?", (sha,))
+            return rows
+        # rows go first: a manifest arriving now finds the segment missing and is retried
+        gone = self.db.write(apply)
+        for sha, tier in gone:
+            _unlink(self.segment_path(sha, tier))
+        for d in list(self.dirs.values()) + [self.render_dir]:
+            for p in d.rglob("*.part*"):
+                if now - _mtime(p) > SEGMENT_GRACE:
+                    _unlink(p)
+        # render cache: least recently viewed first
+        renders = sorted(self.render_dir.glob("*.evc"), key=_mtime)
+        size = sum(p.stat().st_size for p in renders)
+        while renders and size > self.render_cache_bytes:
+            p = renders.pop(0)
+            size -= p.stat().st_size
+            _unlink(p)
+        moved = self.move_cold(now) if "cold" in self.dirs else 0
+        if gone or moved:
+            log.info("compacted evidence store", removed_segments=len(gone), moved_cold=moved)
+        return len(gone)
+
+    def move_cold(self, now, limit=500):
+        rows = self.db.query("SELECT sha256 FROM evidence_segments WHERE tier='hot' AND last_used < ? LIMIT ?",
+                             (now - self.cold_after_days * 86400, limit))
+        for (sha,) in rows:
+            src, dst = self.segment_path(sha, "hot"), self.segment_path(sha, "cold")
+            dst.parent.mkdir(exist_ok=True)
+            tmp = dst.with_name(dst.name + ".part")
+            with open(src, "rb") as fi, open(tmp, "wb") as fo:
+                while True:
+                    chunk = fi.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    fo.write(chunk)
+            os.replace(tmp, dst)
+            self.db.write(lambda c, sha=sha: c.execute("UPDATE evidence_segments SET tier='cold' WHERE sha256=?",
+                                                       (sha,)))
+            _unlink(src)
+        return len(rows)
+
+    def maintain(self, now=None):
+        now = now or time.time()
+        out = {"retention": self.apply_retention(now), "compacted": self.compact(now)}
+        out["quota"] = self.enforce_quota(now)
+        self.last_run = dict(out, at=now)
+        return out
+
+
+def _is_sha(h):
+    return isinstance(h, str) and len(h) == 64 and all(ch in "0123456789abcdef" for ch in h)
+
+
+def _mtime(p):
+    try:
+        return p.stat().st_mtime
+    except OSError:
+        return 0.0
+
+
+def _unlink(p):
+    try:
+        p.unlink()
+    except OSError:
+        pass
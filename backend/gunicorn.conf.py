@@ -0,0 +1,36 @@
+"""
+gunicorn settings for the API tier (gunicorn -c gunicorn.conf.py wsgi:app).
+- Every worker process is a full API; they share the database, EVIDENCE_DIR
+  and job queue (settings.py) and nothing else.
+- Threaded workers, so long-polls and SSE streams don't hold a process each.
+- Metrics are per process: /metrics on the API port answers from whichever
+  worker took the request. With METRICS_PORT set, every worker also serves its
+  own on one port of METRICS_PORT .. METRICS_PORT + workers - 1; scrape all of
+  them (a restarted worker takes the port its predecessor freed).
+"""
+import os
+import settings
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", 8))
+# evidence uploads and SSE streams outlive the default 30s
+timeout = 120
+graceful_timeout = 30
+# first per-worker metrics port (0 = off) and the interface it listens on
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+
+def on_starting(server):
+    # once, in the master: workers importing app.py at the same time find the schema ready
+    settings.migrate(server.log.info)
+
+
+def post_fork(server, worker):
+    if METRICS_PORT:
+        import metrics
+        for port in range(METRICS_PORT, METRICS_PORT + workers):
+            if metrics.serve_metrics(port, host=METRICS_HOST, profiling=settings.PROFILING):
+                break
@@ -0,0 +1,307 @@
+"""
+Job queue between the API tier and the background workers (worker.py).
+- API processes only enqueue; slow or periodic work runs in workers, so any
+  number of API processes can serve requests and none of them owns state.
+- JobQueue is the interface: enqueue_many([(kind, payload, key)]), claim(),
+  done(), fail(). A claimed job is leased for LEASE_SECONDS; a worker that dies
+  loses the lease and the job is handed out again, so handlers must be
+  idempotent. A key dedupes: enqueueing a key that is still queued or running
+  is a no-op (e.g. one retention run, one thumbnail per snapshot).
+- Failed jobs come back after RETRY_BACKOFF * 2^attempt seconds; after
+  MAX_ATTEMPTS they are kept as "dead" for inspection.
+- make_queue() picks the implementation from JOB_QUEUE_URL:
+    db (default)      DatabaseQueue: a jobs table in the app database
+                      (SQLite for local runs, PostgreSQL across nodes)
+    memory://         MemoryQueue: in-process only, the API runs the
+                      workers itself (tests, single-process dev runs)
+    redis://...       RedisQueue: a broker (needs the redis package)
+"""
+import time, json, uuid, threading
+import metrics
+
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 5.0
+
+log = metrics.get_logger("jobs")
+ENQUEUED = metrics.counter("jobs_enqueued_total", "Jobs enqueued (duplicates of a queued key included)", ("kind",))
+
+
+def _backoff(attempts):
+    return RETRY_BACKOFF * 2 ** max(0, attempts - 1)
+
+
+class Job:
+    __slots__ = ("id", "kind", "payload", "attempts", "key")
+
+    def __init__(self, id, kind, payload, attempts=0, key=None):
+        self.id = id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.key = key
+
+
+class JobQueue:
+    """Interface; see the module docstring for the semantics."""
+
+    def enqueue(self, kind, payload=None, key=None, delay=0.0):
+        self.enqueue_many([(kind, payload or {}, key)], delay)
+
+    def enqueue_many(self, jobs, delay=0.0):
+        raise NotImplementedError
+
+    def claim(self, kinds, worker, limit=1, lease=LEASE_SECONDS):
+        """Up to limit runnable jobs of the given kinds, leased to worker."""
+        raise NotImplementedError
+
+    def done(self, job):
+        raise NotImplementedError
+
+    def fail(self, job, error):
+        raise NotImplementedError
+
+    def stats(self):
+        """{kind: {state: count}}"""
+        raise NotImplementedError
+
+    def wait(self, timeout):
+        """Block until there may be new work; idle workers call it between claims."""
+        time.sleep(timeout)
+
+
+class MemoryQueue(JobQueue):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.jobs = {}        # id -> [job, state, run_at, lease_until]
+        self.keys = {}        # key -> id while queued / running
+
+    def enqueue_many(self, jobs, delay=0.0):
+        now = time.time()
+        with self.cond:
+            for kind, payload, key in jobs:
+                ENQUEUED.labels(kind).inc()
+                if key is not None and key in self.keys:
+                    continue
+                job = Job(uuid.uuid4().hex, kind, payload, 0, key)
+                self.jobs[job.id] = [job, "queued", now + delay, 0.0]
+                if key is not None:
+                    self.keys[key] = job.id
+            self.cond.notify_all()
+
+    def claim(self, kinds, worker, limit=1, lease=LEASE_SECONDS):
+        now = time.time()
+        out = []
+        with self.cond:
+            for entry in sorted(self.jobs.values(), key=lambda e: e[2]):
+                job, state, run_at, lease_until = entry
+                if len(out) >= limit:
+                    break
+                if job.kind not in kinds:
+                    continue
+                if (state == "queued" and run_at <= now) or (state == "running" and lease_until < now):
+                    entry[1], entry[3] = "running", now + lease
+                    job.attempts += 1
+                    out.append(job)
+        return out
+
+    def wait(self, timeout):
+        with self.cond:
+            self.cond.wait(timeout)
+
+    def done(self, job):
+        with self.cond:
+            self.jobs.pop(job.id, None)
+            if job.key is not None and self.keys.get(job.key) == job.id:
+                del self.keys[job.key]
+
+    def fail(self, job, error):
+        with self.cond:
+            entry = self.jobs.get(job.id)
+            if entry is None:
+                return
+            if job.attempts >= MAX_ATTEMPTS:
+                entry[1] = "dead"
+                self.keys.pop(job.key, None)
+            else:
+                entry[1], entry[2] = "queued", time.time() + _backoff(job.attempts)
+
+    def stats(self):
+        out = {}
+        with self.cond:
+            for job, state, _, _ in self.jobs.values():
+                by_state = out.setdefault(job.kind, {})
+                by_state[state] = by_state.get(state, 0) + 1
+        return out
+
+
+SQL_RUNNABLE = '''SELECT id FROM jobs WHERE kind IN ({kinds})
+           AND ((state='queued' AND run_at <= ?) OR (state='running' AND lease_until < ?))
+           ORDER BY run_at LIMIT ?'''
+
+
+class DatabaseQueue(JobQueue):
+    """Jobs table in the app database (migration 6 in db.py). Claims are an
+    UPDATE ... WHERE state is still what was read, so concurrent workers in
+    any process never get the same job."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def enqueue_many(self, jobs, delay=0.0):
+        now = time.time()
+        rows = []
+        for kind, payload, key in jobs:
+            ENQUEUED.labels(kind).inc()
+            rows.append((uuid.uuid4().hex, kind, key, json.dumps(payload or {}), now + delay, now))
+
+        def apply(c):
+            for row in rows:
+                c.execute("INSERT OR IGNORE INTO jobs (id, kind, key, payload, state, attempts, run_at, created) "
+                          "VALUES (?,?,?,?,'queued',0,?,?)", row)
+        if rows:
+            self.db.write(apply)
+
+    def claim(self, kinds, worker, limit=1, lease=LEASE_SECONDS):
+        kinds = list(kinds)
+        q = SQL_RUNNABLE.format(kinds=",".join("?" * len(kinds)))
+
+        def apply(c):
+            now = time.time()
+            out = []
+            for (jid,) in c.execute(q, kinds + [now, now, limit]).fetchall():
+                c.execute("UPDATE jobs SET state='running', attempts=attempts+1, lease_until=?, worker=? "
+                          "WHERE id=? AND ((state='queued' AND run_at <= ?) OR (state='running' AND lease_until < ?))",
+                          (now + lease, worker, jid, now, now))
+                if c.rowcount:
+                    out.append(c.execute("SELECT id, kind, payload, attempts, key FROM jobs WHERE id=?",
+                                         (jid,)).fetchone())
+            return out
+        return [Job(r[0], r[1], json.loads(r[2] or "{}"), r[3], r[4]) for r in self.db.write(apply)]
+
+    def done(self, job):
+        self.db.write(lambda c: c.execute("DELETE FROM jobs WHERE id=?", (job.id,)))
+
+    def fail(self, job, error):
+        err = str(error)[:500]
+        if job.attempts >= MAX_ATTEMPTS:
+            # the key is released, so the same work can be enqueued again
+            self.db.write(lambda c: c.execute("UPDATE jobs SET state='dead', key=NULL, error=? WHERE id=?",
+                                              (err, job.id)))
+        else:
+            run_at = time.time() + _backoff(job.attempts)
+            self.db.write(lambda c: c.execute("UPDATE jobs SET state='queued', run_at=?, error=? WHERE id=?",
+                                              (run_at, err, job.id)))
+
+    def stats(self):
+        out = {}
+        for kind, state, n in self.db.query("SELECT kind, state, COUNT(*) FROM jobs GROUP BY kind, state"):
+            out.setdefault(kind, {})[state] = n
+        return out
+
+
+# KEYS: queue zset, leases zset; ARGV: now, lease_until, limit. Moves runnable
+# ids (score <= now) from the queue to the leases with the lease deadline.
+_CLAIM = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('ZADD', KEYS[2], ARGV[2], id)
+end
+return ids
+"""
+# KEYS: leases zset, queue zset; ARGV: now. Expired leases go back to the queue.
+_REQUEUE = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+  redis.call('ZREM', KEYS[1], id)
+  redis.call('ZADD', KEYS[2], ARGV[1], id)
+end
+return #ids
+"""
+
+
+class RedisQueue(JobQueue):
+    """Broker-backed queue: per kind a sorted set of job ids by run time and one
+    of leases by deadline; job fields in a hash, keys as SET NX markers."""
+
+    def __init__(self, url, prefix="jobs"):
+        import redis   # optional dependency, only needed for a Redis broker
+        self.r = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self._claim = self.r.register_script(_CLAIM)
+        self._requeue = self.r.register_script(_REQUEUE)
+
+    def _k(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def enqueue_many(self, jobs, delay=0.0):
+        now = time.time()
+        for kind, payload, key in jobs:
+            ENQUEUED.labels(kind).inc()
+            jid = uuid.uuid4().hex
+            if key is not None and not self.r.set(self._k("key", key), jid, nx=True):
+                continue
+            pipe = self.r.pipeline()
+            pipe.hset(self._k("job", jid), mapping={"kind": kind, "payload": json.dumps(payload or {}),
+                                                    "attempts": 0, "key": key or ""})
+            pipe.zadd(self._k("queue", kind), {jid: now + delay})
+            pipe.sadd(self._k("kinds"), kind)
+            pipe.execute()
+
+    def claim(self, kinds, worker, limit=1, lease=LEASE_SECONDS):
+        now = time.time()
+        out = []
+        for kind in kinds:
+            if len(out) >= limit:
+                break
+            queue, leases = self._k("queue", kind), self._k("leases", kind)
+            self._requeue(keys=[leases, queue], args=[now])
+            for jid in self._claim(keys=[queue, leases], args=[now, now + lease, limit - len(out)]):
+                jid = jid.decode()
+                h = self.r.hgetall(self._k("job", jid))
+                if not h:
+                    self.r.zrem(leases, jid)
+                    continue
+                attempts = self.r.hincrby(self._k("job", jid), "attempts", 1)
+                out.append(Job(jid, kind, json.loads(h[b"payload"]), attempts, h[b"key"].decode() or None))
+        return out
+
+    def done(self, job):
+        pipe = self.r.pipeline()
+        pipe.zrem(self._k("leases", job.kind), job.id)
+        pipe.delete(self._k("job", job.id))
+        if job.key:
+            pipe.delete(self._k("key", job.key))
+        pipe.execute()
+
+    def fail(self, job, error):
+        pipe = self.r.pipeline()
+        pipe.zrem(self._k("leases", job.kind), job.id)
+        pipe.hset(self._k("job", job.id), "error", str(error)[:500])
+        if job.attempts >= MAX_ATTEMPTS:
+            pipe.zadd(self._k("dead", job.kind), {job.id: time.time()})
+            if job.key:
+                pipe.delete(self._k("key", job.key))
+        else:
+            pipe.zadd(self._k("queue", job.kind), {job.id: time.time() + _backoff(job.attempts)})
+        pipe.execute()
+
+    def stats(self):
+        out = {}
+        for kind in self.r.smembers(self._k("kinds")):
+            kind = kind.decode()
+            out[kind] = {state: self.r.zcard(self._k(name, kind))
+                         for state, name in (("queued", "queue"), ("running", "leases"), ("dead", "dead"))}
+        return out
+
+
+def make_queue(url, db=None):
+    """JobQueue for JOB_QUEUE_URL (see the module docstring); db is the app Database."""
+    if url in ("", "db", "database"):
+        return DatabaseQueue(db)
+    if url.startswith("memory:"):
+        return MemoryQueue()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(url)
+    raise ValueError(f"unknown JOB_QUEUE_URL {url!r} (expected db, memory:// or redis://...)")
@@ -0,0 +1,192 @@
+"""
+Backend load test: N simulated cameras posting alerts + M dashboard pollers
+(+ one reviewer acting on pending alerts) for a fixed duration.
+Prints request count, errors and p50/p99 latency per endpoint.
+
+    python app.py                                   # in another shell
+    python loadtest.py --cameras 16 --pollers 8 --seconds 30
+
+With --workers the test starts the API itself under gunicorn (wsgi.py), once
+per worker count, each time on a fresh SQLite database and evidence dir, and
+compares throughput; the load has to be high enough to saturate one worker:
+
+    python loadtest.py --workers 1 2 4 --cameras 32 --alert-rate 20 --pollers 16 --poll-interval 0.1
+
+SQLite serializes writes across processes, so alert POSTs scale less than the
+reads; --job-workers N also runs worker.py (thumbnails) next to the API.
+"""
+import os, sys, time, random, shutil, argparse, tempfile, threading, subprocess
+from collections import defaultdict
+from contextlib import contextmanager
+import requests
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    vals = sorted(values)
+    return vals[min(len(vals) - 1, int(round(pct / 100.0 * (len(vals) - 1))))]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.lat = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def timed(self, name, fn):
+        t0 = time.perf_counter()
+        try:
+            r = fn()
+            ok = r.status_code < 400
+        except requests.RequestException:
+            r, ok = None, False
+        dt = time.perf_counter() - t0
+        with self.lock:
+            self.lat[name].append(dt)
+            if not ok:
+                self.errors[name] += 1
+        return r
+
+    def report(self, elapsed):
+        print(f"{'endpoint':28s} {'reqs':>7s} {'err':>5s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s}")
+        for name in sorted(self.lat):
+            vals = self.lat[name]
+            print(f"{name:28s} {len(vals):7d} {self.errors[name]:5d} {len(vals) / elapsed:8.1f} "
+                  f"{percentile(vals, 50) * 1000:8.1f} {percentile(vals, 99) * 1000:8.1f}")
+
+    def totals(self, elapsed):
+        """(requests, errors, req/s, p50, p99) over all endpoints."""
+        vals = [v for lat in self.lat.values() for v in lat]
+        return len(vals), sum(self.errors.values()), len(vals) / elapsed, percentile(vals, 50), percentile(vals, 99)
+
+
+def camera(base, idx, rate, stop, rec, jpeg):
+    s = requests.Session()
+    interval = 1.0 / rate
+    while not stop.is_set():
+        meta = {"device_id": f"load_cam_{idx}", "location": "loadtest", "cls": "knife",
+                "confidence": round(random.uniform(0.4, 0.99), 3), "timestamp": time.time()}
+        r = rec.timed("POST /api/alerts", lambda: s.post(base + "/api/alerts", data=meta,
+                                                        files={"frame": ("f.jpg", jpeg, "image/jpeg")}, timeout=10))
+        if r is not None and r.status_code == 201:
+            aid = r.json()["id"]
+            rec.timed("POST /api/alerts/status", lambda: s.post(base + "/api/alerts/status", json={"ids": [aid]}, timeout=10))
+        stop.wait(interval * random.uniform(0.5, 1.5))
+
+
+def poller(base, interval, stop, rec):
+    s = requests.Session()
+    while not stop.is_set():
+        rec.timed("GET /api/alerts?pending", lambda: s.get(base + "/api/alerts", params={"status": "pending"}, timeout=10))
+        stop.wait(interval)
+
+
+def reviewer(base, stop, rec):
+    s = requests.Session()
+    while not stop.is_set():
+        r = rec.timed("GET /api/alerts?pending", lambda: s.get(base + "/api/alerts",
+                                                               params={"status": "pending", "limit": 20}, timeout=10))
+        if r is not None and r.status_code == 200:
+            for a in r.json()[:5]:
+                action = random.choice(["confirm", "reject"])
+                rec.timed("POST /api/alerts/<id>/action", lambda: s.post(f"{base}/api/alerts/{a['id']}/action",
+                                                                         json={"action": action}, timeout=10))
+        stop.wait(1.0)
+
+
+def run(args, url):
+    """Drive url with the configured load for args.seconds; (recorder, elapsed)."""
+    rec = Recorder()
+    stop = threading.Event()
+    jpeg = b"\xff\xd8" + bytes(random.getrandbits(8) for _ in range(args.jpeg_kb * 1024)) + b"\xff\xd9"
+    threads = [threading.Thread(target=camera, args=(url, i, args.alert_rate, stop, rec, jpeg), daemon=True)
+               for i in range(args.cameras)]
+    threads += [threading.Thread(target=poller, args=(url, args.poll_interval, stop, rec), daemon=True)
+                for _ in range(args.pollers)]
+    threads.append(threading.Thread(target=reviewer, args=(url, stop, rec), daemon=True))
+
+    print(f"{args.cameras} cameras @ {args.alert_rate}/s, {args.pollers} pollers every {args.poll_interval}s, "
+          f"{args.seconds}s against {url}")
+    t0 = time.time()
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join(timeout=15)
+    return rec, time.time() - t0
+
+
+@contextmanager
+def serve(workers, threads, job_workers, port):
+    """gunicorn with this many worker processes (+ job workers) on a fresh
+    database and evidence dir; yields its URL and stops it afterwards."""
+    tmp = tempfile.mkdtemp(prefix="loadtest-")
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, DATABASE_URL=os.path.join(tmp, "app.db"), EVIDENCE_DIR=os.path.join(tmp, "evidence"),
+               EVIDENCE_KEY_FILE=os.path.join(tmp, "fernet.key"), JOB_QUEUE_URL="db",
+               BIND=f"127.0.0.1:{port}", WEB_CONCURRENCY=str(workers), WEB_THREADS=str(threads))
+    logfile = open(os.path.join(tmp, "server.log"), "wb")
+    cmds = [[sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]]
+    cmds += [[sys.executable, "worker.py"]] * job_workers
+    procs = [subprocess.Popen(cmd, cwd=here, env=env, stdout=logfile, stderr=subprocess.STDOUT) for cmd in cmds]
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                if requests.get(url + "/api/alerts/changes", timeout=2).ok:
+                    break
+            except requests.RequestException:
+                pass
+            if time.time() > deadline or procs[0].poll() is not None:
+                logfile.flush()
+                with open(logfile.name, "rb") as f:
+                    sys.exit(f"gunicorn did not come up:\n{f.read()[-2000:].decode(errors='replace')}")
+            time.sleep(0.2)
+        yield url
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.wait(timeout=30)
+        logfile.close()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--cameras", type=int, default=16)
+    ap.add_argument("--alert-rate", type=float, default=1.0, help="alerts per second per camera")
+    ap.add_argument("--pollers", type=int, default=8)
+    ap.add_argument("--poll-interval", type=float, default=2.0)
+    ap.add_argument("--seconds", type=float, default=30)
+    ap.add_argument("--jpeg-kb", type=int, default=40, help="snapshot size per alert")
+    ap.add_argument("--workers", type=int, nargs="+", help="run gunicorn with each of these worker counts "
+                                                           "and compare throughput (ignores --url)")
+    ap.add_argument("--threads", type=int, default=8, help="threads per gunicorn worker (--workers)")
+    ap.add_argument("--job-workers", type=int, default=0, help="worker.py processes next to the API (--workers)")
+    ap.add_argument("--port", type=int, default=8765, help="gunicorn port (--workers)")
+    args = ap.parse_args()
+
+    if not args.workers:
+        rec, elapsed = run(args, args.url)
+        rec.report(elapsed)
+        return
+    results = []
+    for n in args.workers:
+        print(f"\n=== {n} gunicorn worker(s) x {args.threads} threads, {args.job_workers} job worker(s)")
+        with serve(n, args.threads, args.job_workers, args.port) as url:
+            rec, elapsed = run(args, url)
+        rec.report(elapsed)
+        results.append((n, rec.totals(elapsed)))
+    base = results[0][1][2] or 1.0
+    print(f"\n{'workers':>7s} {'reqs':>8s} {'err':>6s} {'req/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'speedup':>8s}")
+    for n, (reqs, errs, rate, p50, p99) in results:
+        print(f"{n:7d} {reqs:8d} {errs:6d} {rate:8.1f} {p50 * 1000:8.1f} {p99 * 1000:8.1f} {rate / base:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
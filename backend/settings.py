@@ -0,0 +1,87 @@
+"""
+Backend configuration, shared by the API (app.py, wsgi.py) and the workers (worker.py).
+- Everything comes from the environment, so any number of API and worker
+  processes on any number of nodes run with the same settings: DATABASE_URL
+  (PostgreSQL once there is more than one node), EVIDENCE_DIR on storage all
+  of them mount, JOB_QUEUE_URL for the queue (jobs.py).
+- The evidence key is EVIDENCE_KEY (a Fernet key) or the file EVIDENCE_KEY_FILE.
+  A missing key file is created once, atomically, so processes starting together
+  end up with the same key; other nodes need the same file or EVIDENCE_KEY.
+- Services() gives a process its key, database, evidence store and job queue.
+"""
+import os, sys
+from pathlib import Path
+from cryptography.fernet import Fernet
+# metrics.py (registry, profiler, logging) is shared with the detector
+sys.path.append(str(Path(__file__).resolve().parent.parent / "YOLOv8"))
+import evidence_crypto
+import evidence_store
+import jobs
+from db import Database
+
+# a path / sqlite:///path, or postgresql://... (see db.py)
+DB = os.environ.get("DATABASE_URL", "app.db")
+EVIDENCE_DIR = Path(os.environ.get("EVIDENCE_DIR", "evidence"))
+KEY = os.environ.get("EVIDENCE_KEY")
+KEY_FILE = Path(os.environ.get("EVIDENCE_KEY_FILE", "fernet.key"))
+# db (the jobs table), memory:// or redis://... (see jobs.py)
+JOB_QUEUE_URL = os.environ.get("JOB_QUEUE_URL", "db")
+# Segmented evidence storage (see evidence_store.py): retention, disk quota, optional cold tier
+EVIDENCE_RETENTION_DAYS = float(os.environ.get("EVIDENCE_RETENTION_DAYS", evidence_store.RETENTION_DAYS))
+EVIDENCE_QUOTA_GB = float(os.environ.get("EVIDENCE_QUOTA_GB", evidence_store.QUOTA_BYTES / 1024 ** 3))
+EVIDENCE_COLD_DIR = os.environ.get("EVIDENCE_COLD_DIR")
+EVIDENCE_COLD_AFTER_DAYS = float(os.environ.get("EVIDENCE_COLD_AFTER_DAYS", evidence_store.COLD_AFTER_DAYS))
+EVIDENCE_RENDER_CACHE_MB = float(os.environ.get("EVIDENCE_RENDER_CACHE_MB", evidence_store.RENDER_CACHE_BYTES / 1024 ** 2))
+# How often a worker schedules retention / quota / compaction (0 = never)
+EVIDENCE_MAINTENANCE_INTERVAL = float(os.environ.get("EVIDENCE_MAINTENANCE_INTERVAL", evidence_store.MAINTENANCE_INTERVAL))
+# /debug/profile is only routed when ENABLE_PROFILING=1 (the backend listens on all interfaces)
+PROFILING = os.environ.get("ENABLE_PROFILING") == "1"
+
+
+def load_key(log):
+    """Fernet key bytes from EVIDENCE_KEY, else KEY_FILE (created on first use)."""
+    if KEY:
+        return KEY.encode()
+    if not KEY_FILE.exists():
+        # written aside and linked into place: of several processes starting at
+        # once exactly one link succeeds, and nobody ever reads a half-written key
+        tmp = KEY_FILE.with_name(f"{KEY_FILE.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(Fernet.generate_key())
+        os.chmod(tmp, 0o600)
+        try:
+            os.link(tmp, KEY_FILE)
+            log.warning("no key found, generated a new one", key_file=str(KEY_FILE))
+        except FileExistsError:
+            pass
+        finally:
+            tmp.unlink()
+    key = KEY_FILE.read_bytes()
+    log.info("fernet key loaded", key_file=str(KEY_FILE))
+    return key
+
+
+class Services:
+    """What a backend process works with; built once per process."""
+
+    def __init__(self, log):
+        self.key = load_key(log)
+        self.fernet = Fernet(self.key)
+        self.stream_key = evidence_crypto.derive_key(self.key)
+        EVIDENCE_DIR.mkdir(parents=True, exist_ok=True)
+        self.db = Database(DB, log=log.info)
+        self.db.migrate()
+        self.store = evidence_store.EvidenceStore(self.db, EVIDENCE_DIR, self.stream_key, cold_dir=EVIDENCE_COLD_DIR,
+                                                  retention_days=EVIDENCE_RETENTION_DAYS,
+                                                  quota_bytes=int(EVIDENCE_QUOTA_GB * 1024 ** 3),
+                                                  cold_after_days=EVIDENCE_COLD_AFTER_DAYS,
+                                                  render_cache_bytes=int(EVIDENCE_RENDER_CACHE_MB * 1024 ** 2))
+        self.queue = jobs.make_queue(JOB_QUEUE_URL, self.db)
+
+
+def migrate(log=print):
+    """Apply migrations once (e.g. before starting many API processes)."""
+    db = Database(DB, log=log)
+    try:
+        db.migrate()
+    finally:
+        db.close()
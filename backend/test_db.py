@@ -0,0 +1,125 @@
+"""
+Database on a temporary SQLite file (python -m pytest test_db.py).
+"""
+import gc, base64, sqlite3, threading
+import pytest
+import db as dbmod
+
+
+@pytest.fixture
+def database(tmp_path):
+    d = dbmod.Database(str(tmp_path / "t.db"), log=lambda msg: None)
+    yield d
+    d.close()
+
+
+@pytest.fixture
+def fk_database(tmp_path, monkeypatch):
+    """Database with a deferred foreign key, which fails at COMMIT after every
+    statement succeeded."""
+    monkeypatch.setattr(dbmod, "SQLITE_PRAGMAS", dbmod.SQLITE_PRAGMAS + ("PRAGMA foreign_keys=ON",))
+    d = dbmod.Database(str(tmp_path / "fk.db"), log=lambda msg: None)
+    c = d.cursor()
+    c.execute("CREATE TABLE parent (id TEXT PRIMARY KEY)")
+    c.execute("CREATE TABLE child (pid TEXT REFERENCES parent(id) DEFERRABLE INITIALLY DEFERRED)")
+    yield d
+    d.close()
+
+
+def test_wal_mode(database):
+    assert database.scalar("PRAGMA journal_mode") == "wal"
+
+
+def test_migrations_apply_all_versions(database):
+    database.migrate()
+    assert database.scalar("SELECT MAX(version) FROM schema_version") == dbmod.MIGRATIONS[-1][0]
+    tables = {r[0] for r in database.query("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert {"alerts", "evidence", "alert_events", "snapshots", "evidence_segments",
+            "evidence_manifest", "jobs"} <= tables
+    cols = database.dialect.columns(database.cursor(), "alerts")
+    assert "snapshot_sha" in cols and "idempotency_key" in cols
+    # running again is a no-op
+    database.migrate()
+    assert database.scalar("SELECT COUNT(*) FROM schema_version") == len(dbmod.MIGRATIONS)
+
+
+def test_migration_moves_inline_snapshots(tmp_path):
+    path = str(tmp_path / "old.db")
+    raw = sqlite3.connect(path)
+    raw.execute("CREATE TABLE alerts (id TEXT PRIMARY KEY, device_id TEXT, location TEXT, cls TEXT, "
+                "confidence REAL, status TEXT, timestamp REAL, frame_b64 TEXT)")
+    raw.execute("INSERT INTO alerts (id, frame_b64) VALUES ('a1', ?)", (base64.b64encode(b"jpeg").decode(),))
+    raw.commit()
+    raw.close()
+    notes = []
+    d = dbmod.Database(path, log=notes.append)
+    try:
+        d.migrate()
+        sha, b64 = d.one("SELECT snapshot_sha, frame_b64 FROM alerts WHERE id='a1'")
+        assert b64 is None
+        assert d.scalar("SELECT data FROM snapshots WHERE sha256=?", (sha,)) == b"jpeg"
+        assert any("Moved 1 inline snapshots" in n for n in notes)
+    finally:
+        d.close()
+
+
+def test_idempotency_key_is_unique(database):
+    database.migrate()
+    database.write(lambda c: c.execute("INSERT INTO alerts (id, idempotency_key) VALUES ('a1', 'k')"))
+    with pytest.raises(sqlite3.IntegrityError):
+        database.write(lambda c: c.execute("INSERT INTO alerts (id, idempotency_key) VALUES ('a2', 'k')"))
+
+
+def test_failing_write_rolls_back_only_itself(database):
+    database.migrate()
+    writer = database.writer
+    writer.max_delay = 0.2      # make the three writes land in one batch
+    ok1 = writer.submit(lambda c: c.execute("INSERT INTO alerts (id) VALUES ('a1')"))
+
+    def bad(c):
+        c.execute("INSERT INTO alerts (id) VALUES ('a2')")
+        raise RuntimeError("boom")
+    failed = writer.submit(bad)
+    ok2 = writer.submit(lambda c: c.execute("INSERT INTO alerts (id) VALUES ('a3')"))
+    ok1.result(5), ok2.result(5)
+    with pytest.raises(RuntimeError):
+        failed.result(5)
+    assert [r[0] for r in database.query("SELECT id FROM alerts ORDER BY id")] == ["a1", "a3"]
+
+
+def test_transaction_rolls_back_when_commit_fails(fk_database):
+    database = fk_database
+    with pytest.raises(sqlite3.IntegrityError):
+        with database.transaction() as c:
+            c.execute("INSERT INTO child (pid) VALUES ('missing')")
+    assert not database.conn().in_transaction
+    assert database.scalar("SELECT COUNT(*) FROM child") == 0
+    with database.transaction() as c:
+        c.execute("INSERT INTO parent (id) VALUES ('p')")
+    assert database.scalar("SELECT COUNT(*) FROM parent") == 1
+
+
+def test_batch_commit_failure_fails_the_batch_and_recovers(fk_database):
+    database = fk_database
+    with pytest.raises(sqlite3.IntegrityError):
+        database.write(lambda c: c.execute("INSERT INTO child (pid) VALUES ('missing')"))
+    database.write(lambda c: c.execute("INSERT INTO parent (id) VALUES ('p')"))
+    assert database.scalar("SELECT COUNT(*) FROM parent") == 1
+    assert database.scalar("SELECT COUNT(*) FROM child") == 0
+
+
+def test_connections_of_finished_threads_are_closed(database):
+    conns = []
+
+    def request():
+        database.scalar("SELECT 1")
+        conns.append(database.conn())
+    for _ in range(5):
+        t = threading.Thread(target=request)
+        t.start()
+        t.join()
+    gc.collect()
+    assert len(database.all_conns) == 0
+    for conn in conns:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
@@ -0,0 +1,147 @@
+"""
+EVC1 containers and ranged evidence playback (python -m pytest test_evidence_crypto.py).
+"""
+import io, os, sys, importlib
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet
+import evidence_crypto as ec
+
+SEG = 1024
+KEY = ec.derive_key(Fernet.generate_key())
+
+
+def container(tmp_path, data, segment_size=SEG):
+    src, dst = tmp_path / "plain", tmp_path / "clip.evc"
+    src.write_bytes(data)
+    ec.encrypt_file(str(src), str(dst), KEY, segment_size)
+    return str(dst)
+
+
+def payload(n):
+    return bytes(i % 251 for i in range(n))
+
+
+@pytest.mark.parametrize("n", [0, 1, SEG - 1, SEG, SEG + 1, 5 * SEG, 5 * SEG + 17])
+def test_round_trip(tmp_path, n):
+    data = payload(n)
+    path = container(tmp_path, data)
+    assert ec.is_container(path)
+    assert ec.plaintext_size(path) == n
+    out = tmp_path / "out"
+    assert ec.decrypt_file(path, out, KEY) == n
+    assert out.read_bytes() == data
+
+
+def test_writer_accepts_arbitrary_chunks(tmp_path):
+    data = payload(3 * SEG + 5)
+    w = ec.EncryptingWriter(str(tmp_path / "w.evc"), KEY, SEG)
+    for i in range(0, len(data), 333):
+        w.write(data[i:i + 333])
+    path = w.finish()
+    assert b"".join(ec.decrypt_range(path, KEY)) == data
+
+
+@pytest.mark.parametrize("start,end", [(0, 1), (0, SEG), (SEG - 3, SEG + 3), (SEG, 2 * SEG),
+                                       (2 * SEG + 7, None), (4 * SEG, 4 * SEG + 17), (10, 10)])
+def test_decrypt_range(tmp_path, start, end):
+    data = payload(4 * SEG + 17)
+    path = container(tmp_path, data)
+    assert b"".join(ec.decrypt_range(path, KEY, start, end)) == data[start:end]
+
+
+def test_wrong_key_fails(tmp_path):
+    path = container(tmp_path, payload(2 * SEG))
+    with pytest.raises(InvalidTag):
+        b"".join(ec.decrypt_range(path, ec.derive_key(Fernet.generate_key())))
+
+
+def test_tampered_segment_fails(tmp_path):
+    path = container(tmp_path, payload(3 * SEG))
+    with open(path, "r+b") as f:
+        f.seek(ec.HEADER_SIZE + SEG + ec.TAG_SIZE + 5)
+        b = f.read(1)
+        f.seek(-1, 1)
+        f.write(bytes([b[0] ^ 1]))
+    with pytest.raises(InvalidTag):
+        b"".join(ec.decrypt_range(path, KEY))
+
+
+def test_truncation_fails(tmp_path):
+    # dropping the final segment leaves a segment without the last flag at the end
+    path = container(tmp_path, payload(3 * SEG))
+    with open(path, "r+b") as f:
+        f.truncate(ec.HEADER_SIZE + 2 * (SEG + ec.TAG_SIZE))
+    with pytest.raises(InvalidTag):
+        b"".join(ec.decrypt_range(path, KEY))
+
+
+def test_abort_removes_the_file(tmp_path):
+    w = ec.EncryptingWriter(str(tmp_path / "a.evc"), KEY, SEG)
+    w.write(payload(SEG * 2))
+    w.abort()
+    assert not (tmp_path / "a.evc").exists()
+
+
+# ---------- /api/evidence/<id>/video ----------
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    pytest.importorskip("flask")
+    d = tmp_path_factory.mktemp("api")
+    env = {"DATABASE_URL": str(d / "t.db"), "EVIDENCE_DIR": str(d / "evidence"),
+           "EVIDENCE_KEY_FILE": str(d / "fernet.key"), "JOB_QUEUE_URL": "memory://",
+           "EVIDENCE_MAINTENANCE_INTERVAL": "0"}
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    for name in ("app", "settings"):
+        sys.modules.pop(name, None)
+    try:
+        app = importlib.import_module("app")
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+    yield app.app.test_client()
+    app.db.close()
+
+
+@pytest.fixture(scope="module")
+def uploaded(client):
+    data = payload(200 * 1024 + 3)
+    r = client.post("/api/upload_evidence", data={"alert_id": "a1", "file": (io.BytesIO(data), "clip.mp4")},
+                    content_type="multipart/form-data")
+    assert r.status_code == 200
+    return r.get_json()["evidence_id"], data
+
+
+def test_video_whole(client, uploaded):
+    eid, data = uploaded
+    r = client.get(f"/api/evidence/{eid}/video")
+    assert r.status_code == 200
+    assert r.headers["Accept-Ranges"] == "bytes"
+    assert r.data == data
+
+
+@pytest.mark.parametrize("header,lo,hi", [("bytes=0-99", 0, 100), ("bytes=65530-65545", 65530, 65546),
+                                          ("bytes=-10", -10, None), ("bytes=204790-", 204790, None)])
+def test_video_range(client, uploaded, header, lo, hi):
+    eid, data = uploaded
+    r = client.get(f"/api/evidence/{eid}/video", headers={"Range": header})
+    assert r.status_code == 206
+    assert r.data == data[lo:hi]
+    start = lo % len(data)
+    assert r.headers["Content-Range"] == f"bytes {start}-{start + len(r.data) - 1}/{len(data)}"
+
+
+def test_video_unsatisfiable_range(client, uploaded):
+    eid, data = uploaded
+    r = client.get(f"/api/evidence/{eid}/video", headers={"Range": f"bytes={len(data) + 10}-"})
+    assert r.status_code == 416
+    assert r.headers["Content-Range"] == f"bytes */{len(data)}"
+
+
+def test_video_unknown_id(client):
+    assert client.get("/api/evidence/nope/video").status_code == 404
@@ -0,0 +1,105 @@
+"""
+MemoryQueue and DatabaseQueue semantics (python -m pytest test_jobs.py).
+"""
+import time, threading
+import pytest
+import settings     # first: puts the shared YOLOv8 modules (metrics.py) on the path
+import jobs
+from db import Database
+
+
+@pytest.fixture(params=["memory", "db"])
+def queue(request, tmp_path):
+    if request.param == "memory":
+        yield jobs.MemoryQueue()
+        return
+    d = Database(str(tmp_path / "jobs.db"), log=lambda msg: None)
+    d.migrate()
+    yield jobs.DatabaseQueue(d)
+    d.close()
+
+
+def kinds(batch):
+    return sorted(j.kind for j in batch)
+
+
+def test_claim_done(queue):
+    queue.enqueue("render", {"evidence_id": "e1"})
+    queue.enqueue("thumbnail", {"sha256": "s"})
+    batch = queue.claim(("render",), "w1", limit=5)
+    assert kinds(batch) == ["render"]
+    assert batch[0].payload == {"evidence_id": "e1"} and batch[0].attempts == 1
+    assert queue.claim(("render",), "w2") == []       # leased
+    queue.done(batch[0])
+    assert queue.stats() == {"thumbnail": {"queued": 1}}
+
+
+def test_key_dedupes_while_queued_or_running(queue):
+    queue.enqueue("retention", key="retention")
+    queue.enqueue("retention", key="retention")
+    assert queue.stats()["retention"] == {"queued": 1}
+    [job] = queue.claim(("retention",), "w")
+    queue.enqueue("retention", key="retention")
+    assert queue.stats()["retention"] == {"running": 1}
+    queue.done(job)
+    queue.enqueue("retention", key="retention")
+    assert queue.stats()["retention"] == {"queued": 1}
+
+
+def test_delay(queue):
+    queue.enqueue("retention", delay=0.2)
+    assert queue.claim(("retention",), "w") == []
+    time.sleep(0.25)
+    assert len(queue.claim(("retention",), "w")) == 1
+
+
+def test_expired_lease_is_handed_out_again(queue):
+    queue.enqueue("render", {"evidence_id": "e1"})
+    [job] = queue.claim(("render",), "w1", lease=-1)    # the worker died right away
+    [again] = queue.claim(("render",), "w2")
+    assert again.id == job.id and again.attempts == 2
+
+
+def test_fail_retries_with_backoff(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "RETRY_BACKOFF", 0.0)
+    queue.enqueue("thumbnail", {"sha256": "s"})
+    [job] = queue.claim(("thumbnail",), "w")
+    queue.fail(job, RuntimeError("boom"))
+    [job] = queue.claim(("thumbnail",), "w")
+    assert job.attempts == 2
+    monkeypatch.setattr(jobs, "RETRY_BACKOFF", 60.0)
+    queue.fail(job, RuntimeError("boom"))
+    assert queue.claim(("thumbnail",), "w") == []       # backing off
+    assert queue.stats()["thumbnail"] == {"queued": 1}
+
+
+def test_dead_after_max_attempts_releases_key(queue, monkeypatch):
+    monkeypatch.setattr(jobs, "RETRY_BACKOFF", 0.0)
+    monkeypatch.setattr(jobs, "MAX_ATTEMPTS", 2)
+    queue.enqueue("retention", key="retention")
+    for _ in range(2):
+        [job] = queue.claim(("retention",), "w")
+        queue.fail(job, RuntimeError("boom"))
+    assert queue.stats()["retention"] == {"dead": 1}
+    assert queue.claim(("retention",), "w") == []
+    queue.enqueue("retention", key="retention")
+    assert queue.stats()["retention"] == {"dead": 1, "queued": 1}
+
+
+def test_concurrent_claims_never_share_a_job(queue):
+    queue.enqueue_many([("render", {"n": i}, None) for i in range(60)])
+    got, lock = [], threading.Lock()
+
+    def work(name):
+        while True:
+            batch = queue.claim(("render",), name, limit=3)
+            if not batch:
+                return
+            with lock:
+                got.extend(j.payload["n"] for j in batch)
+    threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(got) == list(range(60))
@@ -0,0 +1,148 @@
+"""
+Background worker: runs the jobs the API tier queues (jobs.py).
+- render     - a segmented clip is rendered to an encrypted mp4 for playback
+               (EvidenceStore.rendered), so its first view does not wait for it
+- thumbnail  - a THUMBNAIL_WIDTH wide JPEG of an alert snapshot, stored next to
+               it (snapshots.thumb) and served by /api/alerts/<id>/thumbnail
+- retention  - EvidenceStore.maintain(): retention, quota, compaction and the
+               cold tier; every EVIDENCE_MAINTENANCE_INTERVAL, one run at a
+               time across all workers (a keyed job); the next run is queued
+               however a run ends, and workers re-queue it on a timer so a
+               dead run or a failed enqueue cannot stop maintenance for good
+- Jobs whose worker dies are handed out again, so every handler is idempotent.
+- Any number of workers can run, on any node that shares the database,
+  EVIDENCE_DIR and JOB_QUEUE_URL with the API (settings.py):
+
+    python worker.py --concurrency 4
+    python worker.py --kinds render --metrics-port 9110
+"""
+import os, time, socket, argparse, threading
+import settings     # first: puts the shared YOLOv8 modules (metrics.py) on the path
+import metrics
+
+THUMBNAIL_WIDTH = 160
+THUMBNAIL_QUALITY = 80
+# Job threads per process (render and thumbnails spend their time in OpenCV / AES, outside the GIL)
+CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", 2))
+# How long an idle thread waits before asking the queue again
+IDLE_POLL = 1.0
+
+log = metrics.get_logger("worker")
+JOB_SECONDS = metrics.histogram("job_seconds", "Job run time", ("kind", "result"))
+
+
+def render(svc, payload):
+    eid = payload["evidence_id"]
+    row = svc.db.one("SELECT fps FROM evidence WHERE id=?", (eid,))
+    if row is None:
+        return "gone"           # deleted before it was rendered
+    try:
+        svc.store.rendered(eid, row[0])
+    except ImportError:
+        return "skipped"        # no OpenCV on this node: the API renders on first view
+    return "ok"
+
+
+def thumbnail(svc, payload):
+    sha = payload["sha256"]
+    row = svc.db.one("SELECT data FROM snapshots WHERE sha256=? AND thumb IS NULL", (sha,))
+    if row is None:
+        return "ok"             # made already, or the snapshot is gone
+    try:
+        import cv2
+        import numpy as np
+    except ImportError:
+        return "skipped"        # the full snapshot is served instead
+    img = cv2.imdecode(np.frombuffer(bytes(row[0]), np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return "skipped"        # not a decodable JPEG
+    h, w = img.shape[:2]
+    if w > THUMBNAIL_WIDTH:
+        img = cv2.resize(img, (THUMBNAIL_WIDTH, max(1, h * THUMBNAIL_WIDTH // w)), interpolation=cv2.INTER_AREA)
+    _, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    svc.db.write(lambda c: c.execute("UPDATE snapshots SET thumb=? WHERE sha256=?", (buf.tobytes(), sha)))
+    return "ok"
+
+
+def retention(svc, payload):
+    svc.store.maintain()
+    return "ok"
+
+
+HANDLERS = {"render": render, "thumbnail": thumbnail, "retention": retention}
+
+
+def schedule_retention(queue):
+    """The next maintenance run; a no-op while one is queued or running."""
+    if settings.EVIDENCE_MAINTENANCE_INTERVAL > 0:
+        queue.enqueue("retention", key="retention", delay=settings.EVIDENCE_MAINTENANCE_INTERVAL)
+
+
+def run_job(svc, job):
+    t0 = time.perf_counter()
+    try:
+        result = HANDLERS[job.kind](svc, job.payload)
+    except Exception as e:
+        result = "failed"
+        log.error("job failed", kind=job.kind, job=job.id, attempt=job.attempts, error=e)
+        svc.queue.fail(job, e)
+    else:
+        svc.queue.done(job)
+    if job.kind == "retention":
+        # after a failure too: a dead run has released its key
+        schedule_retention(svc.queue)
+    JOB_SECONDS.labels(job.kind, result).observe(time.perf_counter() - t0)
+
+
+def work(svc, kinds, name):
+    interval = settings.EVIDENCE_MAINTENANCE_INTERVAL
+    next_retention = time.time() + interval if "retention" in kinds and interval > 0 else None
+    while True:
+        if next_retention is not None and time.time() >= next_retention:
+            next_retention = time.time() + interval
+            try:
+                schedule_retention(svc.queue)
+            except Exception as e:
+                log.error("scheduling retention failed", error=e)
+        try:
+            batch = svc.queue.claim(kinds, name)
+        except Exception as e:
+            log.error("claiming jobs failed", error=e)
+            batch = []
+        for job in batch:
+            run_job(svc, job)
+        if not batch:
+            svc.queue.wait(IDLE_POLL)
+
+
+def start(svc, kinds=tuple(HANDLERS), concurrency=CONCURRENCY):
+    """Job threads in this process (daemon threads); schedules retention if it is one of kinds."""
+    if "retention" in kinds:
+        schedule_retention(svc.queue)
+    name = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [threading.Thread(target=work, args=(svc, tuple(kinds), f"{name}:{i}"), name=f"job-worker-{i}",
+                                daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    log.info("job workers started", kinds=",".join(kinds), threads=concurrency, queue=settings.JOB_QUEUE_URL)
+    return threads
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run background jobs for the backend.")
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    ap.add_argument("--kinds", nargs="+", choices=sorted(HANDLERS), default=sorted(HANDLERS))
+    ap.add_argument("--metrics-port", type=int, default=0, help="serve /metrics on this port (0 = off)")
+    args = ap.parse_args()
+    svc = settings.Services(log)
+    if args.metrics_port:
+        metrics.serve_metrics(args.metrics_port, profiling=settings.PROFILING)
+    try:
+        for t in start(svc, args.kinds, args.concurrency):
+            t.join()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+"""
+WSGI entry point for the API tier; background jobs run in worker.py.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from app import app
@@ -1,8 +1,59 @@
-from flask import Flask, render_template, jsonify
-import json, os
+from flask import Flask, Response, render_template, jsonify, request
+from collections import OrderedDict
+import json, os, threading
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 
+# mock files are parsed once per version (mtime + size), not on every request;
+# the last few versions are kept so ?since=<version> can be answered with a diff
+MOCK_VERSIONS = 8
+_mock = {}    # name -> OrderedDict(version -> parsed data)
+_mock_lock = threading.Lock()
+
+def load_mock(name):
+    """(version, data) for mock/<name>; the file is only re-read when it changed."""
+    fp = os.path.join(app.root_path, 'mock', name)
+    try:
+        st = os.stat(fp)
+        version = f"{st.st_mtime_ns:x}-{st.st_size:x}"
+    except OSError:
+        return "0", []
+    with _mock_lock:
+        versions = _mock.setdefault(name, OrderedDict())
+        if version in versions:
+            return version, versions[version]
+    try:
+        with open(fp, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception:
+        data = []
+    with _mock_lock:
+        versions[version] = data
+        while len(versions) > MOCK_VERSIONS:
+            versions.popitem(last=False)
+    return version, data
+
+def mock_response(name, since=None):
+    """The whole list, or with since the changes {"cursor", "alerts", "removed"};
+    the version is the ETag, so If-None-Match gets a 304 while the file is unchanged."""
+    version, data = load_mock(name)
+    headers = {'ETag': f'"{version}"', 'X-Alerts-Cursor': version, 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(version):
+        return Response(status=304, headers=headers)
+    if since is not None:
+        with _mock_lock:
+            old = _mock.get(name, {}).get(since)
+        if old is None:
+            return jsonify({'error': 'unknown version, reload the list', 'cursor': version}), 410
+        before = {item.get('id'): item for item in old}
+        now_ids = {item.get('id') for item in data}
+        data = {'cursor': version,
+                'alerts': [item for item in data if before.get(item.get('id')) != item],
+                'removed': [i for i in before if i not in now_ids]}
+    resp = jsonify(data)
+    resp.headers.update(headers)
+    return resp
+
 # serve dashboard (renders templates with Jinja)
 @app.route('/')
 @app.route('/dashboard')
@@ -18,27 +69,15 @@ def alert_review(alert_id):
 def evidence():
     return render_template('evidence.html')
 
-# mock API - reads mock/alerts.json and returns it
+# mock API - mock/alerts.json (cached), ?since=<cursor> for only the changes
 @app.route('/api/alerts')
 def api_alerts():
-    fp = os.path.join(app.root_path, 'mock', 'alerts.json')
-    try:
-        with open(fp, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except Exception:
-        data = []
-    return jsonify(data)
+    return mock_response('alerts.json', request.args.get('since'))
 
 # serve mock evidence if you make one later
 @app.route('/api/evidence')
 def api_evidence():
-    fp = os.path.join(app.root_path, 'mock', 'evidence.json')
-    try:
-        with open(fp, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except Exception:
-        data = []
-    return jsonify(data)
+    return mock_response('evidence.json')
 
 if __name__ == '__main__':
     # debug True for easier development; accessible on localhost:8000
@@ -1,36 +1,94 @@
-// dashboard.js - simple fetch to /api/alerts and populate cards
+// dashboard.js - load /api/alerts once, then poll only the changes (?since=)
+// and patch the cards in place; 304 while nothing changed
+let cursor = null;
+let etag = null;
+const cards = new Map();   // alert id -> card element
+
+function cardFields(alert) {
+  return {
+    snapshot: alert.snapshot || alert.snapshot_url || "",
+    location: alert.location || alert.camera_location || "Unknown",
+    confidence: `Confidence: ${alert.confidence ?? alert.confidence_score ?? "N/A"}%`,
+    href: `/alert/${encodeURIComponent(alert.id)}`,
+  };
+}
+
+function renderCard(card, alert) {
+  const f = cardFields(alert);
+  const img = card.querySelector("img");
+  if (img.getAttribute("src") !== f.snapshot) img.src = f.snapshot;
+  card.querySelector(".location").textContent = f.location;
+  card.querySelector(".confidence").textContent = f.confidence;
+  card.querySelector("a").href = f.href;
+}
+
+function createCard(alert) {
+  const card = document.createElement("div");
+  card.className = "bg-white p-4 rounded shadow hover:shadow-lg transition";
+  card.innerHTML = `
+    <img alt="snapshot" class="w-full h-40 object-cover rounded mb-2">
+    <p class="location font-semibold"></p>
+    <p class="confidence text-sm text-gray-600"></p>
+    <a class="mt-2 inline-block px-3 py-1 bg-blue-600 text-white rounded">Review</a>
+  `;
+  renderCard(card, alert);
+  return card;
+}
+
+function upsert(container, alert) {
+  const card = cards.get(alert.id);
+  if (card) {
+    renderCard(card, alert);
+  } else {
+    const created = createCard(alert);
+    cards.set(alert.id, created);
+    container.appendChild(created);
+  }
+}
+
+function remove(id) {
+  const card = cards.get(id);
+  if (card) card.remove();
+  cards.delete(id);
+}
+
 async function loadAlerts() {
+  const container = document.getElementById("alerts-container");
+  if (!container) return; // not on this page
+  const res = await fetch("/api/alerts", { cache: "no-store" });
+  if (!res.ok) throw new Error("HTTP " + res.status);
+  const alerts = await res.json();
+  container.innerHTML = "";
+  cards.clear();
+  alerts.forEach(alert => upsert(container, alert));
+  cursor = res.headers.get("X-Alerts-Cursor");
+  etag = res.headers.get("ETag");
+}
+
+async function pollChanges() {
+  const container = document.getElementById("alerts-container");
+  if (!container || document.hidden) return;
   try {
-    const res = await fetch("/api/alerts");
+    if (cursor === null) return await loadAlerts();
+    const headers = etag ? { "If-None-Match": etag } : {};
+    const res = await fetch("/api/alerts?since=" + encodeURIComponent(cursor), { cache: "no-store", headers });
+    if (res.status === 304) return;
+    if (res.status === 410) return await loadAlerts();
     if (!res.ok) throw new Error("HTTP " + res.status);
-    const alerts = await res.json();
-
-    const container = document.getElementById("alerts-container");
-    if (!container) return; // not on this page
-    container.innerHTML = "";
-
-    alerts.forEach(alert => {
-      const card = document.createElement("div");
-      card.className = "bg-white p-4 rounded shadow hover:shadow-lg transition";
-
-      card.innerHTML = `
-        <img src="${alert.snapshot}" alt="snapshot" class="w-full h-40 object-cover rounded mb-2">
-        <p class="font-semibold">${alert.location || alert.camera_location || "Unknown"}</p>
-        <p class="text-sm text-gray-600">Confidence: ${alert.confidence ?? alert.confidence_score ?? "N/A"}%</p>
-        <a href="/alert/${alert.id}" class="mt-2 inline-block px-3 py-1 bg-blue-600 text-white rounded">Review</a>
-      `;
-      container.appendChild(card);
-    });
+    const delta = await res.json();
+    delta.removed.forEach(remove);
+    delta.alerts.forEach(alert => upsert(container, alert));
+    cursor = delta.cursor;
+    etag = res.headers.get("ETag");
   } catch (err) {
     console.error("Failed to load alerts:", err);
-    const container = document.getElementById("alerts-container");
-    if (container) container.innerHTML = '<p class="text-red-600">Unable to load alerts</p>';
+    if (cursor === null) container.innerHTML = '<p class="text-red-600">Unable to load alerts</p>';
   }
 }
 
 if (document.readyState !== "loading") {
-  loadAlerts();
+  pollChanges();
 } else {
-  document.addEventListener("DOMContentLoaded", loadAlerts);
+  document.addEventListener("DOMContentLoaded", pollChanges);
 }
-setInterval(loadAlerts, 2000);
+setInterval(pollChanges, 2000);